@@ -4,59 +4,424 @@ as well as audio from google tts.
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
-from moviepy.editor import (
-    concatenate_videoclips,
-)
-
-from images_utils.image_grabber import ImageGrabber
 from text_utils.text_processor import TextProcessor
-from audio_utils.audio import WaveNetTTS
+from video_utils.encoder import (
+    PREVIEW_PRESET,
+    Rendition,
+    concat_renditions,
+    concat_with_audio,
+    encode_frames,
+    frame_count,
+    frame_size,
+)
+from video_utils.pipeline import SegmentPipeline
+from video_utils.segment_cache import SegmentCache
 
 from utils.common import mkdir
+from utils import tracing
+
+if TYPE_CHECKING:
+    from images_utils.image_grabber import ImageGrabber
+    from audio_utils.audio import WaveNetTTS
+    from video_utils.profiles import EncoderProfile
+
+
+def default_gid() -> "ImageGrabber":
+    """Image grabber searching jpg images and resizing them"""
+    from images_utils.image_grabber import ImageGrabber
+
+    return ImageGrabber(
+        search_options="ift:jpg",
+        resize=True,
+    )
+
+
+def default_tts() -> "WaveNetTTS":
+    """WaveNet TTS with an audio cache"""
+    from audio_utils.audio import WaveNetTTS
+    from audio_utils.cache import AudioCache
+
+    return WaveNetTTS(cache=AudioCache())
 
 
 class TextToVideo:
-    def __init__(self, text: str, output: str):
+    def __init__(
+        self,
+        text: str,
+        output: str,
+        tts: "WaveNetTTS" = None,
+        gid: "ImageGrabber" = None,
+    ):
         """This class processes the images and audio then generates the required vidoe
 
         Args:
             text (str): Text to turn into images/audio
             output (str): Output file name
+            tts (WaveNetTTS, optional): TTS object. Defaults to WaveNetTTS
+                with an audio cache, created on first use.
+            gid (ImageGrabber, optional): Image search/grabber object.
+                Defaults to searching jpg images and resizing them, created on
+                first use.
         """
         self.text = text
         self.output = output
-        self._gid = ImageGrabber(
-            search_options="ift:jpg",
-            resize=True,
-        )
+        self._gid = gid
         self._text_processor = TextProcessor(self.text)
-        self._wnTTS = WaveNetTTS()
+        self._wnTTS = tts
+        self._segment_cache = SegmentCache()
         self._output_folder = "output"
         self._video_clips = []
+        # Length of the rendered video in seconds, set by `render_video`
+        self.duration = 0
         mkdir(os.path.join(os.getcwd(), self._output_folder))
 
+    @property
+    def gid(self) -> "ImageGrabber":
+        if self._gid is None:
+            self._gid = default_gid()
+        return self._gid
+
+    @property
+    def tts(self) -> "WaveNetTTS":
+        if self._wnTTS is None:
+            self._wnTTS = default_tts()
+        return self._wnTTS
+
+    @tracing.traced("generate_video")
     def generate_video(self) -> None:
         """Generates the video clips/segments to be concatenated on save"""
 
         video_segments = self._text_processor.video_segments
         for segment in video_segments:
-            final_clip = segment.generate_segment(self._wnTTS, self._gid)
+            final_clip = segment.generate_segment(self.tts, self.gid)
             self._video_clips.append(final_clip)
+        if self.tts.cache is not None:
+            self.tts.cache.flush()
 
-    def save_video(self, fps: int = 24) -> None:
+    def _segment_starts(self, fps: int) -> Tuple[List[float], float]:
+        """Start time of every prepared segment and the video length. Every
+        segment starts on a frame boundary, its narration on its first frame.
+        """
+        starts = []
+        frames = 0
+        for segment in self._text_processor.video_segments:
+            starts.append(frames / fps)
+            frames += frame_count(segment.duration, fps)
+        return starts, frames / fps
+
+    def _rendition_outputs(self, renditions: List[Rendition]) -> List[str]:
+        outputs = [
+            f"{self._output_folder}/{rendition.filename(self.output)}"
+            for rendition in renditions
+        ]
+        if len(set(outputs)) < len(outputs):
+            raise ValueError("renditions must have different heights")
+        return outputs
+
+    @tracing.traced("save_video")
+    def save_video(
+        self,
+        fps: int = 24,
+        renditions: List[Rendition] = None,
+        profile: "EncoderProfile" = None,
+    ) -> None:
         """Saves the processed video
 
         Args:
             fps (int, optional): Desired video FPS. Defaults to 24.
+            renditions (List[Rendition], optional): Variants to write in a
+                single pass, e.g. 1080p, 720p and 480p. Every frame is
+                composed once and scaled to each rendition, `fps` is ignored.
+                Each is saved as <output>_<height>p. Defaults to None, which
+                writes the output file only.
+            profile (EncoderProfile, optional): Encoder settings of the output
+                file, see video_utils.profiles. Renditions carry their own.
+                Defaults to MoviePy's settings.
         """
 
+        from moviepy.editor import concatenate_videoclips
+
         if len(self._video_clips) == 0:
             raise VideoElementsNotProcessed
 
         final_video = concatenate_videoclips(self._video_clips, method="compose")
-        final_video.fps = 24
-        final_video.write_videofile(f"{self._output_folder}/{self.output}")
+        if renditions is None:
+            from video_utils.profiles import PROFILES
+
+            profile = profile or PROFILES["default"]
+            final_video.fps = fps
+            final_video.write_videofile(
+                f"{self._output_folder}/{self.output}",
+                **profile.write_videofile_kwargs(),
+            )
+            return
+
+        from audio_utils.pcm import assemble
+
+        outputs = self._rendition_outputs(renditions)
+        starts = [0.0]
+        for clip in self._video_clips[:-1]:
+            starts.append(starts[-1] + clip.duration)
+        narration = assemble(
+            [segment.audio_files for segment in self._text_processor.video_segments],
+            starts,
+            final_video.duration,
+            os.path.join(self._output_folder, f"{self.output}.pcm"),
+        )
+        # Compose at the highest frame rate, ffmpeg drops frames for the others
+        master_fps = max(rendition.fps for rendition in renditions)
+        print(f"[INFO] Writing {len(renditions)} renditions")
+        try:
+            encode_frames(
+                final_video.iter_frames(fps=master_fps, dtype="uint8"),
+                final_video.size,
+                master_fps,
+                renditions,
+                outputs,
+                narration.path,
+                narration.sample_rate,
+                narration.channels,
+            )
+        finally:
+            os.remove(narration.path)
+
+    @tracing.traced("render_video")
+    def render_video(
+        self,
+        fps: int = 24,
+        workers: int = None,
+        io_workers: int = 4,
+        max_in_flight: int = None,
+        crossfade: float = 0.0,
+        io_pool: ThreadPoolExecutor = None,
+        cpu_pool: ProcessPoolExecutor = None,
+        renditions: List[Rendition] = None,
+        height: int = None,
+        preset: str = None,
+        profile: "EncoderProfile" = None,
+        prune: bool = True,
+    ) -> None:
+        """Parallel alternative to `generate_video` + `save_video`.
+        TTS and image search of upcoming segments run on a thread pool while
+        earlier segments are encoded to their own video only files by a
+        process pool. Segments found in the segment cache are not encoded
+        again. The files are then joined by stream copy, or re-encoded to the
+        largest size if their images had different sizes, and the narration,
+        assembled as one PCM buffer, is encoded once as the audio track.
+
+        Args:
+            fps (int, optional): Desired video FPS. Defaults to 24.
+            workers (int, optional): Number of encoding processes. Defaults
+                to the number of CPUs.
+            io_workers (int, optional): Number of threads running TTS and
+                image search. Defaults to 4.
+            max_in_flight (int, optional): Maximum segments being prepared or
+                rendered at once. Defaults to twice `workers`.
+            crossfade (float, optional): Seconds of crossfade between
+                consecutive voice over chunks of a segment. Defaults to 0.
+            io_pool (ThreadPoolExecutor, optional): Thread pool shared with
+                other renders, `io_workers` is ignored if given.
+            cpu_pool (ProcessPoolExecutor, optional): Process pool shared
+                with other renders, `workers` is ignored if given.
+            renditions (List[Rendition], optional): Variants to encode from
+                the joined segments in a single pass instead of stream
+                copying them, e.g. 1080p, 720p and 480p. Each is saved as
+                <output>_<height>p. Defaults to None.
+            height (int, optional): Frame height of the segments. Defaults to
+                the height of their images.
+            preset (str, optional): x264 preset of the segments, overrides
+                the profile's. Defaults to x264's default.
+            profile (EncoderProfile, optional): Encoder settings, see
+                video_utils.profiles. Segments are encoded with its rate
+                control, preset and threads and the narration with its audio
+                settings. The codec and pixel format of segments are fixed so
+                they can be joined by stream copy. Defaults to x264's
+                defaults.
+            prune (bool, optional): Deletes the least recently used segment
+                files above the segment cache budget once the video is
+                joined. Renders sharing the cache folder with others still
+                joining their segments pass False and prune once they're all
+                done. Defaults to True.
+        """
+
+        video_segments = self._text_processor.video_segments
+        if len(video_segments) == 0:
+            raise VideoElementsNotProcessed
+        if renditions is not None:
+            outputs = self._rendition_outputs(renditions)
+
+        pipeline = SegmentPipeline(
+            self.tts,
+            self.gid,
+            self._segment_cache,
+            fps=fps,
+            io_workers=io_workers,
+            cpu_workers=workers,
+            max_in_flight=max_in_flight,
+            io_pool=io_pool,
+            cpu_pool=cpu_pool,
+            height=height,
+            preset=preset,
+            profile=profile,
+        )
+        try:
+            segment_files = pipeline.run(video_segments)
+        finally:
+            # Speech synthesized before a failure stays cached
+            if self.tts.cache is not None:
+                self.tts.cache.flush()
+
+        if self.tts.cache is not None:
+            print(f"[INFO] TTS cache: {self.tts.cache.stats()}")
+            tracing.current().set(tts_cache=self.tts.cache.stats())
+        if hasattr(self.gid, "latency_stats"):
+            print(f"[INFO] Image acquisition latency: {self.gid.latency_stats()}")
+            tracing.current().set(image_latency=self.gid.latency_stats())
+        print(
+            f"[INFO] Reused {len(segment_files) - pipeline.rendered} cached segments, "
+            f"rendered {pipeline.rendered}"
+        )
+        tracing.current().set(
+            segments=len(segment_files), segments_rendered=pipeline.rendered
+        )
+
+        starts, self.duration = self._segment_starts(fps)
+
+        from audio_utils.pcm import assemble
+
+        print("[INFO] Assembling narration")
+        narration = assemble(
+            [segment.audio_files for segment in video_segments],
+            starts,
+            self.duration,
+            os.path.join(self._output_folder, f"{self.output}.pcm"),
+            crossfade=crossfade,
+        )
+        print(f"[INFO] Joining {len(segment_files)} segment files")
+        try:
+            if renditions is None:
+                concat_with_audio(
+                    segment_files,
+                    narration.path,
+                    f"{self._output_folder}/{self.output}",
+                    narration.sample_rate,
+                    narration.channels,
+                    profile,
+                    self._join_rendition(fps, height, preset, profile),
+                )
+            else:
+                concat_renditions(
+                    segment_files,
+                    narration.path,
+                    renditions,
+                    outputs,
+                    narration.sample_rate,
+                    narration.channels,
+                )
+        finally:
+            os.remove(narration.path)
+        if prune:
+            # The segments of this render are the most likely to be used again
+            self._segment_cache.prune(keep=segment_files)
+
+    def _join_rendition(
+        self, fps: int, height: int, preset: str, profile: "EncoderProfile"
+    ) -> Optional[Rendition]:
+        """Every segment is encoded at the size of its own images. Returns
+        None if they all have the same size and can be joined by stream copy,
+        otherwise the rendition to re-encode them to: the largest width and
+        height, like MoviePy's "compose" concatenation."""
+        sizes = {
+            frame_size(segment.images, height)
+            for segment in self._text_processor.video_segments
+        }
+        if len(sizes) == 1:
+            return None
+        size = (max(w for w, _ in sizes), max(h for _, h in sizes))
+        print(f"[INFO] Segments have different sizes, re-encoding them to {size}")
+        tracing.current().set(reencoded=True)
+        if profile is None:
+            return Rendition(size, fps, preset=preset)
+        return profile.rendition(size, fps, preset)
+
+    @tracing.traced("preview")
+    def preview(
+        self,
+        fps: int = 12,
+        height: int = 360,
+        contact_sheets: bool = False,
+        workers: int = None,
+        io_workers: int = 4,
+    ) -> None:
+        """Fast draft to check a script edit. Speech comes from the TTS cache
+        or is replaced by silence of the estimated duration, the service is
+        never called. The draft is either a low resolution video encoded with
+        the fastest preset, saved as <output>_preview, or a contact sheet PNG
+        per segment and a timing table, without encoding any video.
+
+        Args:
+            fps (int, optional): Draft video FPS. Defaults to 12.
+            height (int, optional): Draft video height. Defaults to 360.
+            contact_sheets (bool, optional): Saves segment_<number>.png and
+                timing.csv to the <output>_preview folder instead of a video.
+                Defaults to False.
+            workers (int, optional): Number of encoding processes. Defaults
+                to the number of CPUs.
+            io_workers (int, optional): Number of threads running image
+                search. Defaults to 4.
+        """
+        from audio_utils.audio import DraftTTS
+
+        tts = DraftTTS(self.tts)
+        root, extension = os.path.splitext(self.output)
+        if not contact_sheets:
+            draft = TextToVideo(
+                self.text, f"{root}_preview{extension}", tts=tts, gid=self.gid
+            )
+            draft.render_video(
+                fps=fps,
+                workers=workers,
+                io_workers=io_workers,
+                height=height,
+                preset=PREVIEW_PRESET,
+            )
+            self.duration = draft.duration
+            print(f"[INFO] Draft speech: {tts.estimated} chunks estimated")
+            return
+
+        from video_utils.preview import contact_sheet, timing_rows, write_timing
+
+        video_segments = self._text_processor.video_segments
+        if len(video_segments) == 0:
+            raise VideoElementsNotProcessed
+        with ThreadPoolExecutor(max_workers=io_workers) as pool:
+            for _ in pool.map(
+                lambda segment: segment.prepare(tts, self.gid), video_segments
+            ):
+                pass
+        print(f"[INFO] Draft speech: {tts.estimated} chunks estimated")
+        if tts.cache is not None:
+            tts.cache.flush()
+
+        folder = os.path.join(self._output_folder, f"{root}_preview")
+        mkdir(folder)
+        starts, self.duration = self._segment_starts(fps)
+        for segment, start in zip(video_segments, starts):
+            contact_sheet(
+                segment,
+                start,
+                os.path.join(folder, f"segment_{segment.segment_number:03d}.png"),
+            )
+        rows = timing_rows(video_segments, starts)
+        write_timing(rows, os.path.join(folder, "timing.csv"))
+
+        print(f"{'segment':>7}  {'image':>5}  {'start':>8}  {'duration':>8}  path")
+        for segment, image, path, start, duration in rows:
+            print(f"{segment:>7}  {image:>5}  {start:>8.2f}  {duration:>8.2f}  {path}")
+        print(f"[INFO] Contact sheets saved to {folder}")
 
 
 class VideoElementsNotProcessed(Exception):
@@ -2,27 +2,36 @@
 """
 
 import os
-from typing import Tuple
-from google.cloud import texttospeech
-from mutagen.mp3 import MP3
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+from retry.api import retry_call
+from audio_utils.backends import TTSBackend, GoogleTTSBackend
+from audio_utils.cache import AudioCache
+from audio_utils.voices import VOICES
+from audio_utils.pcm import (
+    CHANNELS,
+    SAMPLE_RATE,
+    audio_duration,
+    audio_extension,
+    is_wav,
+    split_wav,
+)
 from utils.common import mkdir
+from utils.rate_limit import RateLimiter
+from utils import tracing
+
+if TYPE_CHECKING:
+    from google.cloud import texttospeech
 
 
 class WaveNetTTS:
 
-    VOICES = {
-        "A": ("en-US-Wavenet-A", 1),
-        "B": ("en-US-Wavenet-B", 1),
-        "C": ("en-US-Wavenet-C", 2),
-        "D": ("en-US-Wavenet-D", 1),
-        "E": ("en-US-Wavenet-E", 2),
-        "F": ("en-US-Wavenet-F", 2),
-        "G": ("en-US-Wavenet-G", 2),
-        "H": ("en-US-Wavenet-H", 2),
-        "I": ("en-US-Wavenet-I", 1),
-        "J": ("en-US-Wavenet-J", 1),
-        "DEFAULT": ("en-US-Wavenet-J", 1),
-    }
+    VOICES = VOICES
+
+    # Google's limit on the input of one request, SSML tags included
+    MAX_SSML_BYTES = 5000
 
     @classmethod
     def get_voices(cls, gender):
@@ -44,23 +53,113 @@ class WaveNetTTS:
 
     def __init__(
         self,
-        audio_config: texttospeech.AudioConfig = None,
+        audio_config: "texttospeech.AudioConfig" = None,
+        backend: TTSBackend = None,
+        max_workers: int = 8,
+        qps: float = None,
+        tries: int = 4,
+        retry_delay: float = 0.5,
+        cache: AudioCache = None,
+        coalesce: bool = True,
     ):
         """Initializes client to google's tts
 
         Args:
             audio_config (texttospeech.AudioConfig, optional): Audio configs like pitch, speed, more info on google tts
-            documentation. Defaults to None.
+            documentation. Defaults to uncompressed LINEAR16 audio at the
+            video's sample rate, so nothing is decoded or resampled later.
+            backend (TTSBackend, optional): Service used to synthesize speech.
+                Defaults to google's cloud TTS.
+            max_workers (int, optional): Maximum concurrent requests made by
+                `synthesize_many`. Defaults to 8.
+            qps (float, optional): Maximum requests per second, None for no
+                limit. Defaults to None.
+            tries (int, optional): Attempts per request on transient errors.
+                Defaults to 4.
+            retry_delay (float, optional): Initial delay between attempts in
+                seconds, doubled after each failure. Defaults to 0.5.
+            cache (AudioCache, optional): Cache of synthesized audio, audio is
+                synthesized on every call if None. Defaults to None.
+            coalesce (bool, optional): Lets `synthesize_many` merge texts
+                of the same voice into SSML requests if the backend supports
+                marks. Defaults to True.
         """
-        self.client = texttospeech.TextToSpeechClient()
+        self.backend = backend
+        if self.backend is None:
+            self.backend = GoogleTTSBackend()
         self.audio_config = audio_config
         if self.audio_config is None:
+            from google.cloud import texttospeech
+
             self.audio_config = texttospeech.AudioConfig(
-                audio_encoding=texttospeech.AudioEncoding.MP3, speaking_rate=1
+                audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+                sample_rate_hertz=SAMPLE_RATE,
+                speaking_rate=1,
             )
+        self.max_workers = max_workers
+        self.tries = tries
+        self.retry_delay = retry_delay
+        self._rate_limiter = RateLimiter(qps)
+        self.cache = cache
+        self.coalesce = coalesce
         self.output = os.path.join(os.getcwd(), "tts_output")
         mkdir(self.output)
 
+    def _request(self, call: Callable):
+        """Runs a backend call after waiting for the rate limiter, retrying
+        on transient errors with exponential backoff."""
+
+        def attempt():
+            self._rate_limiter.wait()
+            tracing.add("attempts")
+            return call()
+
+        return retry_call(
+            attempt,
+            exceptions=self.backend.retry_exceptions,
+            tries=self.tries,
+            delay=self.retry_delay,
+            backoff=2,
+            jitter=(0, self.retry_delay),
+        )
+
+    @tracing.traced("tts.request")
+    def _synthesize(self, text: str, voice_name: str = None) -> bytes:
+        """Calls the backend, waiting for the rate limiter and retrying on
+        transient errors with exponential backoff.
+
+        Args:
+            text (str): text to turn into speech
+            voice_name (str, optional): Key in `VOICES`. Defaults to None.
+
+        Returns:
+            bytes: encoded audio content
+        """
+        voice = None if voice_name is None else WaveNetTTS.VOICES[voice_name]
+        audio_content = self._request(
+            lambda: self.backend.synthesize(text, voice, self.audio_config)
+        )
+        tracing.add("bytes", len(audio_content))
+        return audio_content
+
+    @tracing.traced("tts.request")
+    def _synthesize_marked(
+        self, ssml: str, voice_name: str = None
+    ) -> Tuple[bytes, Dict[str, float]]:
+        """`_synthesize` for SSML with <mark> tags
+
+        Returns:
+            Tuple[bytes, Dict[str, float]]: encoded audio content and the
+            time in seconds of every mark, by mark name
+        """
+        voice = None if voice_name is None else WaveNetTTS.VOICES[voice_name]
+        audio_content, marks = self._request(
+            lambda: self.backend.synthesize_marked(ssml, voice, self.audio_config)
+        )
+        tracing.add("bytes", len(audio_content))
+        return audio_content, marks
+
+    @tracing.traced("tts.chunk")
     def generate_tts(
         self, text: str, filename: str, voice_name: str = None
     ) -> Tuple[str, float]:
@@ -69,31 +168,259 @@ class WaveNetTTS:
         Args:
             text (str): text to turn into speech
             filename (str): filename to save output
-            voice (texttospeech.VoiceSelectionParams, optional): Voice selection for WaveNet. Defaults to None.
+            voice_name (str, optional): Voice name in `VOICES`. Defaults to None.
         Returns:
             Tuple[str, float]: output audio file path, audio file duration in seconds
         """
-        if voice_name is None:
-            voice = texttospeech.VoiceSelectionParams(
-                language_code="en-US", ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL
-            )
-        else:
-            voice_params = WaveNetTTS.VOICES[voice_name]
-            voice = texttospeech.VoiceSelectionParams(
-                language_code="en-US",
-                name=voice_params[0],
-                ssml_gender=voice_params[1],
+        if self.cache is not None:
+            cached = self._cached(text, voice_name)
+            if cached is not None:
+                return cached
+
+        audio_content = self._synthesize(text, voice_name)
+        return self._save(text, filename, voice_name, audio_content)
+
+    def _cached(self, text: str, voice_name: str = None) -> Optional[Tuple[str, float]]:
+        """Cached audio file and duration of a text, None on a miss"""
+        key = AudioCache.make_key(text, voice_name, self.audio_config)
+        cached = self.cache.get(key)
+        tracing.add("cache_hits" if cached is not None else "cache_misses")
+        return cached
+
+    def _save(
+        self, text: str, filename: str, voice_name: str, audio_content: bytes
+    ) -> Tuple[str, float]:
+        """Writes synthesized audio to the cache, or to `filename` in the
+        output folder when there's no cache. Cached files are named after
+        their content key instead of the requested filename, so different
+        scripts never overwrite each other.
+
+        Returns:
+            Tuple[str, float]: audio file path, audio file duration in seconds
+        """
+        duration = audio_duration(audio_content)
+        if self.cache is not None:
+            audio_file = self.cache.put(
+                AudioCache.make_key(text, voice_name, self.audio_config),
+                audio_content,
+                duration,
+                extension=audio_extension(audio_content),
             )
-        synthesis_input = texttospeech.SynthesisInput(text=text)
-        response = self.client.synthesize_speech(
-            input=synthesis_input, voice=voice, audio_config=self.audio_config
-        )
+            print(f'[INFO] Audio content written to file "{audio_file}"')
+            return audio_file, duration
 
+        # The extension follows the returned encoding, WAV or MP3
+        filename = os.path.splitext(filename)[0] + audio_extension(audio_content)
         audio_file = os.path.join(self.output, filename)
         with open(audio_file, "wb") as out:
             # Write the response to the output file.
-            out.write(response.audio_content)
+            out.write(audio_content)
             print(f'[INFO] Audio content written to file "{self.output}/{filename}"')
+        return audio_file, duration
+
+    def _generate_one(self, request: Dict) -> Tuple[str, float]:
+        """Synthesizes a request of `synthesize_many`, its cache lookup is
+        already done"""
+        audio_content = self._synthesize(request["text"], request.get("voice"))
+        return self._save(
+            request["text"], request["filename"], request.get("voice"), audio_content
+        )
+
+    @staticmethod
+    def _ssml(texts: List[str]) -> str:
+        """SSML document reading the texts in order, with a mark named after
+        the index of every text but the first one at its start"""
+        parts = [escape(texts[0])]
+        for idx, text in enumerate(texts[1:], start=1):
+            parts.append(f'<mark name="{idx}"/>{escape(text)}')
+        return "<speak>" + " ".join(parts) + "</speak>"
+
+    @tracing.traced("tts.coalesced")
+    def _generate_coalesced(
+        self, requests: List[Dict]
+    ) -> Optional[List[Tuple[str, float]]]:
+        """Synthesizes same-voice requests in a single SSML request and cuts
+        the audio at the marks between them.
 
-        mp3 = MP3(audio_file)
-        return audio_file, mp3.info.length
+        Args:
+            requests (List[Dict]): requests of `synthesize_many`, all with
+                the same voice
+
+        Returns:
+            Optional[List[Tuple[str, float]]]: (audio file path, duration)
+            for every request, in the same order as `requests`. None if the
+            service returned no usable marks, the requests must then be
+            synthesized one by one.
+        """
+        tracing.current().set(chunks=len(requests))
+        voice_name = requests[0].get("voice")
+        texts = [request["text"] for request in requests]
+        audio_content, marks = self._synthesize_marked(self._ssml(texts), voice_name)
+        names = [str(idx) for idx in range(1, len(requests))]
+        times = [marks.get(name) for name in names]
+        if not is_wav(audio_content) or None in times or times != sorted(times):
+            # Only uncompressed audio can be cut at exact samples
+            print("[WARNING] Coalesced TTS response can't be split, retrying per chunk")
+            tracing.add("coalesce_fallbacks")
+            return None
+
+        return [
+            self._save(request["text"], request["filename"], voice_name, part)
+            for request, part in zip(requests, split_wav(audio_content, times))
+        ]
+
+    def _batches(self, requests: List[Dict], indices: List[int]) -> List[List[int]]:
+        """Packs requests of the same voice, in order, into SSML requests of
+        at most MAX_SSML_BYTES
+
+        Args:
+            requests (List[Dict]): requests of `synthesize_many`
+            indices (List[int]): indices of the requests to synthesize
+
+        Returns:
+            List[List[int]]: request indices of every service request
+        """
+        if not self.coalesce or not self.backend.supports_marks:
+            return [[idx] for idx in indices]
+
+        batches = []
+        open_batches = {}
+        for idx in indices:
+            voice_name = requests[idx].get("voice")
+            batch = open_batches.get(voice_name)
+            if batch is not None:
+                texts = [requests[i]["text"] for i in batch + [idx]]
+                if len(self._ssml(texts).encode("utf-8")) > self.MAX_SSML_BYTES:
+                    batch = None
+            if batch is None:
+                batch = open_batches[voice_name] = []
+                batches.append(batch)
+            batch.append(idx)
+        return batches
+
+    @tracing.traced("tts.batch")
+    def synthesize_many(self, requests: List[Dict]) -> List[Tuple[str, float]]:
+        """Runs `generate_tts` for many requests concurrently, at most
+        `max_workers` at a time and `qps` per second. Uncached texts of the
+        same voice are coalesced into SSML requests when the backend reports
+        mark timepoints, every text still gets its own audio file.
+
+        Args:
+            requests (List[Dict]): List of Dict of this format
+                {"text": str, "filename": str, "voice": str}
+
+        Returns:
+            List[Tuple[str, float]]: (audio file path, duration) for every
+            request, in the same order as `requests`.
+        """
+        tracing.current().set(requests=len(requests))
+        if len(requests) == 0:
+            return []
+
+        results = [None] * len(requests)
+        pending = []
+        for idx, request in enumerate(requests):
+            if self.cache is not None:
+                results[idx] = self._cached(request["text"], request.get("voice"))
+            if results[idx] is None:
+                pending.append(idx)
+        batches = self._batches(requests, pending)
+        tracing.current().set(service_requests=len(batches))
+        if len(batches) == 0:
+            return results
+
+        workers = min(self.max_workers, len(batches))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self._generate_one, requests[batch[0]])
+                if len(batch) == 1
+                else executor.submit(
+                    self._generate_coalesced, [requests[idx] for idx in batch]
+                )
+                for batch in batches
+            ]
+            retries = []
+            for batch, future in zip(batches, futures):
+                batch_results = future.result()
+                if batch_results is None:
+                    # Only this batch is split, later calls still coalesce
+                    retries += [
+                        (idx, executor.submit(self._generate_one, requests[idx]))
+                        for idx in batch
+                    ]
+                    continue
+                if len(batch) == 1:
+                    batch_results = [batch_results]
+                for idx, result in zip(batch, batch_results):
+                    results[idx] = result
+            for idx, future in retries:
+                results[idx] = future.result()
+        return results
+
+
+class DraftTTS:
+    """Stands in for WaveNetTTS in draft previews. Cached speech is reused,
+    anything else is replaced by silence of the estimated duration, so a
+    preview never waits for the TTS service.
+
+    Attributes:
+        tts (WaveNetTTS): TTS whose cache and output folder are used.
+        chars_per_second (float): Speaking speed used for estimates.
+        estimated (int): Number of chunks replaced by silence.
+    """
+
+    def __init__(self, tts: WaveNetTTS, chars_per_second: float = 15):
+        """
+        Args:
+            tts (WaveNetTTS): TTS whose cache and output folder are used.
+            chars_per_second (float, optional): Average speaking speed.
+                Defaults to 15, WaveNet's speed at speaking_rate=1.
+        """
+        self.tts = tts
+        self.chars_per_second = chars_per_second
+        self.estimated = 0
+
+    @property
+    def cache(self) -> AudioCache:
+        return self.tts.cache
+
+    def generate_tts(
+        self, text: str, filename: str, voice_name: str = None
+    ) -> Tuple[str, float]:
+        """Returns the cached audio of a text, or a silent file as long as
+        the text would take to say
+
+        Args:
+            text (str): text to turn into speech
+            filename (str): unused, silence is named after the text so
+                drafts of different scripts share it
+            voice_name (str, optional): Voice name in `VOICES`. Defaults to None.
+        Returns:
+            Tuple[str, float]: audio file path, audio file duration in seconds
+        """
+        key = AudioCache.make_key(text, voice_name, self.tts.audio_config)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        self.estimated += 1
+        duration = len(text) / self.chars_per_second
+        # Named after the content, a segment reused by watch mode never has
+        # its silence overwritten by another segment taking its number
+        audio_file = os.path.join(self.tts.output, f"draft-{key}.wav")
+        with wave.open(audio_file, "wb") as out:
+            out.setnchannels(CHANNELS)
+            out.setsampwidth(2)
+            out.setframerate(SAMPLE_RATE)
+            out.writeframes(bytes(round(duration * SAMPLE_RATE) * CHANNELS * 2))
+        return audio_file, duration
+
+    def synthesize_many(self, requests: List[Dict]) -> List[Tuple[str, float]]:
+        """`generate_tts` for every request, in the same order"""
+        return [
+            self.generate_tts(
+                request["text"], request["filename"], request.get("voice")
+            )
+            for request in requests
+        ]
@@ -0,0 +1,132 @@
+"""Speech synthesis backends used by WaveNetTTS.
+A backend only turns text into audio bytes, everything else (files, caching,
+concurrency) is handled by WaveNetTTS, so backends can be swapped for a local
+fake service when benchmarking.
+"""
+
+from typing import Dict, Tuple
+
+
+class TTSBackend:
+    """Base class for TTS backends.
+
+    Attributes:
+        retry_exceptions (Tuple[Exception]): Transient errors worth retrying.
+        supports_marks (bool): Whether `synthesize_marked` is implemented.
+    """
+
+    retry_exceptions = ()
+    supports_marks = False
+
+    def synthesize(
+        self, text: str, voice: Tuple[str, int], audio_config
+    ) -> bytes:
+        """Synthesizes speech for a given text
+
+        Args:
+            text (str): text to turn into speech
+            voice (Tuple[str, int]): (voice_name, gender) or None for the
+                service's default voice.
+            audio_config: Audio configs like encoding, pitch, speed.
+
+        Returns:
+            bytes: encoded audio content
+        """
+        raise NotImplementedError
+
+    def synthesize_marked(
+        self, ssml: str, voice: Tuple[str, int], audio_config
+    ) -> Tuple[bytes, Dict[str, float]]:
+        """Synthesizes speech for SSML with <mark> tags and reports when
+        every mark is reached in the audio
+
+        Args:
+            ssml (str): SSML document
+            voice (Tuple[str, int]): (voice_name, gender) or None for the
+                service's default voice.
+            audio_config: Audio configs like encoding, pitch, speed.
+
+        Returns:
+            Tuple[bytes, Dict[str, float]]: encoded audio content and the
+            time in seconds of every mark, by mark name
+        """
+        raise NotImplementedError
+
+
+class GoogleTTSBackend(TTSBackend):
+    """Google cloud TextToSpeech backend. The gRPC client is only created on
+    the first request. Mark timepoints are only reported by the v1beta1 API,
+    which has its own client."""
+
+    supports_marks = True
+
+    def __init__(self):
+        from google.api_core import exceptions as google_exceptions
+
+        self.retry_exceptions = (
+            google_exceptions.TooManyRequests,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+        )
+        self._client = None
+        self._beta_client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google.cloud import texttospeech
+
+            self._client = texttospeech.TextToSpeechClient()
+        return self._client
+
+    @property
+    def beta_client(self):
+        if self._beta_client is None:
+            from google.cloud import texttospeech_v1beta1
+
+            self._beta_client = texttospeech_v1beta1.TextToSpeechClient()
+        return self._beta_client
+
+    @staticmethod
+    def _voice_params(texttospeech, voice: Tuple[str, int]):
+        if voice is None:
+            return texttospeech.VoiceSelectionParams(
+                language_code="en-US", ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL
+            )
+        return texttospeech.VoiceSelectionParams(
+            language_code="en-US",
+            name=voice[0],
+            ssml_gender=voice[1],
+        )
+
+    def synthesize(
+        self, text: str, voice: Tuple[str, int], audio_config
+    ) -> bytes:
+        from google.cloud import texttospeech
+
+        voice_params = self._voice_params(texttospeech, voice)
+        synthesis_input = texttospeech.SynthesisInput(text=text)
+        response = self.client.synthesize_speech(
+            input=synthesis_input, voice=voice_params, audio_config=audio_config
+        )
+        return response.audio_content
+
+    def synthesize_marked(
+        self, ssml: str, voice: Tuple[str, int], audio_config
+    ) -> Tuple[bytes, Dict[str, float]]:
+        from google.cloud import texttospeech_v1beta1 as texttospeech
+
+        request = texttospeech.SynthesizeSpeechRequest(
+            input=texttospeech.SynthesisInput(ssml=ssml),
+            voice=self._voice_params(texttospeech, voice),
+            audio_config=texttospeech.AudioConfig(
+                **type(audio_config).to_dict(audio_config)
+            ),
+            enable_time_pointing=[
+                texttospeech.SynthesizeSpeechRequest.TimepointType.SSML_MARK
+            ],
+        )
+        response = self.beta_client.synthesize_speech(request=request)
+        marks = {point.mark_name: point.time_seconds for point in response.timepoints}
+        return response.audio_content, marks
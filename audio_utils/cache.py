@@ -0,0 +1,223 @@
+"""A persistent, content addressed cache for synthesized speech.
+Audio files are stored under a hash of everything that affects the output
+(text, voice and audio config), together with their duration in a small JSON
+index, so a cache hit needs no network call and no MP3 parsing.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from utils.common import mkdir
+
+
+class AudioCache:
+    """Size bounded, least recently used cache of audio files.
+
+    Attributes:
+        directory (str): Folder holding the audio files and the index.
+        max_bytes (int): Total size of cached audio before the least recently
+            used entries are evicted, None for no limit.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups not found in the cache.
+        evictions (int): Number of entries evicted to respect `max_bytes`.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory: str = None, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Args:
+            directory (str, optional): Cache folder. Defaults to "tts_cache"
+                in the current working directory.
+            max_bytes (int, optional): Maximum total size of the cached audio.
+                Defaults to 512 MiB.
+        """
+        self.directory = directory
+        if self.directory is None:
+            self.directory = os.path.join(os.getcwd(), "tts_cache")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index = {}
+        # Whether entries were added, used or dropped since the index was
+        # last saved
+        self._dirty = False
+
+        mkdir(self.directory)
+        self._load_index()
+
+    @staticmethod
+    def make_key(text: str, voice_name: Optional[str], audio_config) -> str:
+        """Hashes everything that changes the synthesized audio
+
+        Args:
+            text (str): text to turn into speech
+            voice_name (str, optional): voice name, None for default voice.
+            audio_config: Audio configs like encoding, pitch, speed.
+
+        Returns:
+            str: hex digest identifying the audio
+        """
+        try:
+            config = type(audio_config).to_dict(audio_config)
+        except AttributeError:
+            config = str(audio_config)
+        payload = json.dumps(
+            {"text": text, "voice": voice_name, "config": config},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, AudioCache.INDEX_FILE)
+
+    def _read_index(self) -> Dict[str, Dict]:
+        """Reads the saved index, without the entries whose file is gone"""
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        return {
+            key: entry
+            for key, entry in index.items()
+            if os.path.isfile(os.path.join(self.directory, entry["file"]))
+        }
+
+    def _load_index(self) -> None:
+        self._index = self._read_index()
+
+    def _merge_index(self) -> None:
+        """Adds the entries saved by renders in other processes sharing the
+        cache folder, and drops the ones whose file was evicted by them. Must
+        be called with the lock held."""
+        for key, entry in self._read_index().items():
+            own = self._index.get(key)
+            if own is None:
+                self._index[key] = entry
+            elif entry["last_used"] > own["last_used"]:
+                own["last_used"] = entry["last_used"]
+        self._index = {
+            key: entry
+            for key, entry in self._index.items()
+            if os.path.isfile(os.path.join(self.directory, entry["file"]))
+        }
+
+    def _save_index(self) -> None:
+        """Writes the index atomically, must be called with the lock held"""
+        # Renders in other processes may share the cache folder
+        tmp_path = f"{self._index_path()}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path())
+        self._dirty = False
+
+    def flush(self) -> None:
+        """Saves the entries added and used since the index was last saved,
+        they're only kept in memory until then. The saved index is merged
+        first, so entries of other processes are kept and count towards
+        `max_bytes`."""
+        with self._lock:
+            if self._dirty:
+                self._merge_index()
+                self._evict()
+                self._save_index()
+
+    def _evict(self, keep: str = None) -> None:
+        """Evicts least recently used entries, must be called with the lock held
+
+        Args:
+            keep (str, optional): key that must not be evicted. Defaults to None.
+        """
+        if self.max_bytes is None:
+            return
+        total = sum(entry["size"] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self._index.pop(key)
+            total -= entry["size"]
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """Looks up cached audio
+
+        Args:
+            key (str): key from `make_key`
+
+        Returns:
+            Optional[Tuple[str, float]]: audio file path and duration in
+            seconds, None on a miss.
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                path = os.path.join(self.directory, entry["file"])
+            if entry is None or not os.path.isfile(path):
+                if self._index.pop(key, None) is not None:
+                    self._dirty = True
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Saved by `flush`, a hit never writes the index
+            entry["last_used"] = time.time()
+            self._dirty = True
+            return path, entry["duration"]
+
+    def put(
+        self, key: str, audio_content: bytes, duration: float, extension: str = ".mp3"
+    ) -> str:
+        """Stores audio in the cache
+
+        Args:
+            key (str): key from `make_key`
+            audio_content (bytes): encoded audio
+            duration (float): audio duration in seconds
+            extension (str, optional): audio file extension. Defaults to ".mp3".
+
+        Returns:
+            str: path of the cached audio file. The entry is saved to the
+            index by `flush`.
+        """
+        filename = key + extension
+        path = os.path.join(self.directory, filename)
+        # Write next to the final file then rename, so readers never see a
+        # partially written file.
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(audio_content)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._index[key] = {
+                "file": filename,
+                "duration": duration,
+                "size": len(audio_content),
+                "last_used": time.time(),
+            }
+            self._evict(keep=key)
+            self._dirty = True
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit/miss counters and the current cache size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": sum(entry["size"] for entry in self._index.values()),
+            }
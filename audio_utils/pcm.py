@@ -0,0 +1,226 @@
+"""PCM audio timeline.
+The narration of the whole video is assembled into one contiguous buffer of
+16 bit samples, every chunk placed at an exact sample offset, and handed to
+the encoder as a single raw audio track. Long narrations are assembled in a
+memory-mapped file instead of RAM.
+"""
+
+import io
+import wave
+from typing import List
+
+import numpy as np
+
+from video_utils.encoder import (
+    SEGMENT_AUDIO_CHANNELS,
+    SEGMENT_CODEC_PARAMS,
+    decode_audio,
+)
+from utils import tracing
+
+SAMPLE_RATE = SEGMENT_CODEC_PARAMS["audio_fps"]
+CHANNELS = SEGMENT_AUDIO_CHANNELS
+
+# Narrations longer than this many seconds are memory-mapped
+MEMMAP_SECONDS = 10 * 60
+
+
+def is_wav(content: bytes) -> bool:
+    return content[:4] == b"RIFF" and content[8:12] == b"WAVE"
+
+
+def audio_extension(content: bytes) -> str:
+    """File extension of encoded audio, LINEAR16 responses are WAV files"""
+    return ".wav" if is_wav(content) else ".mp3"
+
+
+def audio_duration(content: bytes) -> float:
+    """Duration in seconds of WAV or MP3 audio content"""
+    if is_wav(content):
+        with wave.open(io.BytesIO(content), "rb") as w:
+            return w.getnframes() / w.getframerate()
+
+    from mutagen.mp3 import MP3
+
+    return MP3(io.BytesIO(content)).info.length
+
+
+def split_wav(content: bytes, times: List[float]) -> List[bytes]:
+    """Cuts WAV content at the given times
+
+    Args:
+        content (bytes): WAV file content
+        times (List[float]): cut points in seconds, in increasing order
+
+    Returns:
+        List[bytes]: len(times) + 1 WAV files with the same format
+    """
+    with wave.open(io.BytesIO(content), "rb") as w:
+        params = w.getparams()
+        frames = w.readframes(w.getnframes())
+    frame_size = params.sampwidth * params.nchannels
+    total = len(frames) // frame_size
+    cuts = [min(total, int(round(t * params.framerate))) for t in times]
+    parts = []
+    for start, end in zip([0] + cuts, cuts + [total]):
+        out = io.BytesIO()
+        with wave.open(out, "wb") as w:
+            w.setparams(params)
+            w.writeframes(frames[start * frame_size : max(start, end) * frame_size])
+        parts.append(out.getvalue())
+    return parts
+
+
+def read_pcm(
+    path: str, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS
+) -> np.ndarray:
+    """Decodes an audio file to 16 bit samples. 16 bit WAV files at the
+    requested rate are read directly, anything else is decoded by ffmpeg.
+
+    Args:
+        path (str): audio file path
+        sample_rate (int, optional): Output sample rate. Defaults to 44100.
+        channels (int, optional): Output channels. Defaults to 2.
+
+    Returns:
+        np.ndarray: (samples, channels) int16 array
+    """
+    try:
+        with wave.open(path, "rb") as w:
+            if w.getsampwidth() == 2 and w.getframerate() == sample_rate:
+                samples = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2")
+                samples = samples.reshape(-1, w.getnchannels())
+                if samples.shape[1] == channels:
+                    return samples
+                if samples.shape[1] == 1:
+                    return np.repeat(samples, channels, axis=1)
+    except (wave.Error, EOFError):
+        pass
+
+    raw = decode_audio(path, sample_rate, channels)
+    return np.frombuffer(raw, dtype="<i2").reshape(-1, channels)
+
+
+class AudioTimeline:
+    """Fixed length buffer of 16 bit samples that audio is placed into.
+
+    Attributes:
+        path (str): Raw s16le file the timeline is saved to.
+        sample_rate (int): Samples per second.
+        channels (int): Interleaved channels.
+        samples (np.ndarray): (length, channels) int16 buffer, silent until
+            audio is added.
+        memmap (bool): Whether `samples` is mapped to `path`.
+    """
+
+    def __init__(
+        self,
+        duration: float,
+        path: str,
+        sample_rate: int = SAMPLE_RATE,
+        channels: int = CHANNELS,
+        memmap: bool = None,
+    ):
+        """
+        Args:
+            duration (float): Timeline length in seconds.
+            path (str): Raw s16le file the timeline is saved to.
+            sample_rate (int, optional): Defaults to 44100.
+            channels (int, optional): Defaults to 2.
+            memmap (bool, optional): Map the buffer to `path` instead of
+                holding it in RAM. Defaults to True for timelines longer
+                than MEMMAP_SECONDS.
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.memmap = memmap
+        if self.memmap is None:
+            self.memmap = duration > MEMMAP_SECONDS
+        shape = (max(1, self.offset(duration)), channels)
+        if self.memmap:
+            # A new mapped file is zero filled, i.e. silent
+            self.samples = np.memmap(path, dtype="<i2", mode="w+", shape=shape)
+        else:
+            self.samples = np.zeros(shape, dtype="<i2")
+
+    def offset(self, seconds: float) -> int:
+        """Sample offset of a time in seconds"""
+        return int(round(seconds * self.sample_rate))
+
+    def add(self, samples: np.ndarray, start: int, fade: int = 0) -> int:
+        """Places samples on the timeline, cut at its end
+
+        Args:
+            samples (np.ndarray): (n, channels) int16 samples
+            start (int): sample offset of the first sample
+            fade (int, optional): number of samples crossfaded linearly with
+                the audio already at `start`. Defaults to 0.
+
+        Returns:
+            int: sample offset right after the placed audio
+        """
+        end = min(start + len(samples), len(self.samples))
+        samples = samples[: max(0, end - start)]
+        fade = min(fade, len(samples))
+        if fade > 0:
+            ramp = np.linspace(0, 1, fade, endpoint=False, dtype=np.float32)[:, None]
+            mixed = (
+                self.samples[start : start + fade] * (1 - ramp)
+                + samples[:fade] * ramp
+            )
+            self.samples[start : start + fade] = np.clip(mixed, -32768, 32767)
+        self.samples[start + fade : end] = samples[fade:]
+        return end
+
+    def save(self) -> str:
+        """Writes the timeline to `path` and returns it"""
+        if self.memmap:
+            self.samples.flush()
+        else:
+            self.samples.tofile(self.path)
+        return self.path
+
+
+@tracing.traced("audio.assemble")
+def assemble(
+    tracks: List[List[str]],
+    starts: List[float],
+    duration: float,
+    path: str,
+    crossfade: float = 0.0,
+    sample_rate: int = SAMPLE_RATE,
+    channels: int = CHANNELS,
+) -> AudioTimeline:
+    """Assembles audio files into one timeline and saves it.
+
+    Args:
+        tracks (List[List[str]]): audio files played back to back, one list
+            per segment.
+        starts (List[float]): start time in seconds of every track. A track
+            running past the next start is cut there, so segments stay in
+            sync with the video.
+        duration (float): timeline length in seconds
+        path (str): raw s16le file to write
+        crossfade (float, optional): seconds of overlap between consecutive
+            files of a track. Defaults to 0.
+        sample_rate (int, optional): Defaults to 44100.
+        channels (int, optional): Defaults to 2.
+
+    Returns:
+        AudioTimeline: the saved timeline
+    """
+    timeline = AudioTimeline(duration, path, sample_rate, channels)
+    fade = timeline.offset(crossfade)
+    stops = [timeline.offset(start) for start in starts[1:]] + [len(timeline.samples)]
+    for files, start, stop in zip(tracks, starts, stops):
+        first = position = timeline.offset(start)
+        for audio_file in files:
+            samples = read_pcm(audio_file, sample_rate, channels)
+            overlap = min(fade, len(samples), position - first)
+            position -= overlap
+            samples = samples[: max(0, stop - position)]
+            position = timeline.add(samples, position, overlap)
+    tracing.current().set(samples=len(timeline.samples), memmap=timeline.memmap)
+    timeline.save()
+    return timeline
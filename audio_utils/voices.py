@@ -0,0 +1,19 @@
+"""WaveNet voices usable in [VOICE] tags.
+Kept apart from the TTS client so scripts can be validated without loading
+the audio libraries.
+"""
+
+# Tag name: (WaveNet voice name, gender), 1 for male and 2 for female
+VOICES = {
+    "A": ("en-US-Wavenet-A", 1),
+    "B": ("en-US-Wavenet-B", 1),
+    "C": ("en-US-Wavenet-C", 2),
+    "D": ("en-US-Wavenet-D", 1),
+    "E": ("en-US-Wavenet-E", 2),
+    "F": ("en-US-Wavenet-F", 2),
+    "G": ("en-US-Wavenet-G", 2),
+    "H": ("en-US-Wavenet-H", 2),
+    "I": ("en-US-Wavenet-I", 1),
+    "J": ("en-US-Wavenet-J", 1),
+    "DEFAULT": ("en-US-Wavenet-J", 1),
+}
@@ -0,0 +1,278 @@
+"""Batch rendering of many scripts in one process.
+A manifest lists the jobs, settings missing from a job are taken from
+"defaults" and script paths are relative to the manifest:
+
+    {
+        "defaults": {"fps": 24},
+        "jobs": [
+            {"script": "scripts/a.txt", "output": "a.mp4"},
+            {"script": "scripts/b.txt", "output": "b.mp4", "crossfade": 0.05},
+            {"script": "scripts/c.txt", "output": "c.mp4",
+             "renditions": ["1920x1080", "1280x720@30:crf=26"]},
+            {"script": "scripts/d.txt", "output": "d.mp4", "profile": "auto"}
+        ]
+    }
+
+All jobs share one TTS client and audio cache, one image grabber (browser
+pool and image index) and the same worker pools. The segment cache is pruned
+once every job is done, not by each job, so a finished job never deletes
+segments another job hasn't joined yet. The status of every job is
+checkpointed to a state file after each job, running the same manifest again
+skips the jobs that are already done.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List
+
+from TextToVideo import TextToVideo, default_gid, default_tts
+from video_utils.encoder import Rendition
+from video_utils.profiles import get_profile
+from video_utils.segment_cache import SegmentCache
+from utils.common import process_pool
+from utils import tracing
+
+if TYPE_CHECKING:
+    from audio_utils.audio import WaveNetTTS
+    from images_utils.image_grabber import ImageGrabber
+
+# Job keys passed on to `TextToVideo.render_video`
+JOB_SETTINGS = ("fps", "crossfade", "max_in_flight", "renditions", "profile")
+
+
+class ManifestError(Exception):
+    pass
+
+
+def load_manifest(path: str) -> List[Dict]:
+    """Reads and checks the jobs of a manifest
+
+    Args:
+        path (str): manifest file, a JSON object with "jobs" and optional
+            "defaults", or a plain list of jobs.
+
+    Returns:
+        List[Dict]: jobs with defaults applied, absolute script paths and
+        parsed renditions
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    outputs = set()
+    for idx, job in enumerate(manifest.get("jobs", [])):
+        job = {**defaults, **job}
+        if "script" not in job or "output" not in job:
+            raise ManifestError(f"job #{idx + 1} needs a script and an output")
+        unknown = set(job) - {"script", "output", *JOB_SETTINGS}
+        if unknown:
+            raise ManifestError(
+                f"job #{idx + 1} has unknown settings: {', '.join(sorted(unknown))}"
+            )
+        if job["output"] in outputs:
+            raise ManifestError(f"output {job['output']} is used by two jobs")
+        outputs.add(job["output"])
+        if "renditions" in job:
+            try:
+                job["renditions"] = [Rendition.parse(r) for r in job["renditions"]]
+            except ValueError as e:
+                raise ManifestError(f"job #{idx + 1}: {e}")
+        if "profile" in job:
+            try:
+                job["profile"] = get_profile(job["profile"])
+            except ValueError as e:
+                raise ManifestError(f"job #{idx + 1}: {e}")
+        job["script"] = os.path.join(base, job["script"])
+        jobs.append(job)
+    return jobs
+
+
+class BatchRunner:
+    """Renders jobs concurrently with shared resources and checkpoints their
+    status.
+
+    Attributes:
+        state_path (str): JSON file the status of every job is saved to,
+            keyed by output name.
+        jobs (int): Number of jobs rendered at once.
+        workers (int): Encoding processes shared by all jobs.
+        io_workers (int): TTS and image search threads shared by all jobs.
+        state (Dict[str, Dict]): Status, timing and error of every job.
+    """
+
+    def __init__(
+        self,
+        state_path: str,
+        jobs: int = 2,
+        workers: int = None,
+        io_workers: int = 4,
+        tts: "WaveNetTTS" = None,
+        gid: "ImageGrabber" = None,
+    ):
+        """
+        Args:
+            state_path (str): Checkpoint file, loaded if it exists.
+            jobs (int, optional): Jobs rendered at once. Defaults to 2.
+            workers (int, optional): Encoding processes. Defaults to the
+                number of CPUs.
+            io_workers (int, optional): TTS and image search threads.
+                Defaults to 4.
+            tts (WaveNetTTS, optional): Shared TTS object. Defaults to
+                WaveNetTTS with an audio cache.
+            gid (ImageGrabber, optional): Shared image grabber. Defaults to
+                searching jpg images and resizing them.
+        """
+        self.state_path = state_path
+        self.jobs = jobs
+        self.workers = workers or os.cpu_count()
+        self.io_workers = io_workers
+        self.tts = tts
+        if self.tts is None:
+            self.tts = default_tts()
+        self.gid = gid
+        if self.gid is None:
+            self.gid = default_gid()
+        self._lock = threading.Lock()
+        self.state = {}
+        if os.path.exists(state_path):
+            with open(state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def _update(self, output: str, **record) -> None:
+        """Updates the record of a job and saves the state file"""
+        with self._lock:
+            self.state[output] = record
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp_path, self.state_path)
+
+    def is_done(self, job: Dict) -> bool:
+        """Whether a job finished in a previous run and its videos still exist"""
+        record = self.state.get(job["output"], {})
+        files = [job["output"]]
+        if "renditions" in job:
+            files = [r.filename(job["output"]) for r in job["renditions"]]
+        return record.get("status") == "done" and all(
+            os.path.isfile(os.path.join("output", name)) for name in files
+        )
+
+    @tracing.traced("batch")
+    def run(self, jobs: List[Dict]) -> bool:
+        """Renders the jobs that aren't done yet
+
+        Args:
+            jobs (List[Dict]): jobs from `load_manifest`
+
+        Returns:
+            bool: True if every job is done
+        """
+        pending = [job for job in jobs if not self.is_done(job)]
+        print(
+            f"[INFO] Batch of {len(jobs)} jobs, {len(jobs) - len(pending)} already "
+            f"done, {len(pending)} to render"
+        )
+        tracing.current().set(jobs=len(jobs), pending=len(pending))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.io_workers) as io_pool:
+            with process_pool(max_workers=self.workers) as cpu_pool:
+                with ThreadPoolExecutor(max_workers=self.jobs) as job_pool:
+                    futures = [
+                        job_pool.submit(self._run_job, job, io_pool, cpu_pool)
+                        for job in pending
+                    ]
+                    for future in futures:
+                        future.result()
+        # Jobs skip pruning, the segments of one could be deleted before
+        # another joins them
+        SegmentCache().prune()
+        self.report(jobs, pending, time.perf_counter() - start)
+        return all(self.is_done(job) for job in jobs)
+
+    @tracing.traced("batch.job")
+    def _run_job(
+        self,
+        job: Dict,
+        io_pool: ThreadPoolExecutor,
+        cpu_pool: ProcessPoolExecutor,
+    ) -> None:
+        output = job["output"]
+        tracing.current().set(output=output)
+        self._update(output, status="running", script=job["script"])
+        start = time.perf_counter()
+        try:
+            with open(job["script"], "r", encoding="utf-8") as f:
+                text = f.read().replace("\n", " ")
+            ttv = TextToVideo(text, output, tts=self.tts, gid=self.gid)
+            ttv.render_video(
+                workers=self.workers,
+                io_pool=io_pool,
+                cpu_pool=cpu_pool,
+                prune=False,
+                **{key: job[key] for key in JOB_SETTINGS if key in job},
+            )
+        except Exception as e:
+            print(f"[ERROR] Job {output} failed: {e!r}")
+            self._update(
+                output,
+                status="failed",
+                script=job["script"],
+                seconds=time.perf_counter() - start,
+                error=repr(e),
+            )
+            return
+
+        seconds = time.perf_counter() - start
+        print(
+            f"[INFO] Job {output} done in {seconds:.1f}s, "
+            f"{ttv.duration / seconds:.2f}x realtime"
+        )
+        self._update(
+            output,
+            status="done",
+            script=job["script"],
+            seconds=seconds,
+            video_seconds=ttv.duration,
+        )
+
+    def report(self, jobs: List[Dict], rendered: List[Dict], wall: float) -> None:
+        """Prints the timing of every job and the throughput of this run
+
+        Args:
+            jobs (List[Dict]): jobs of the batch
+            rendered (List[Dict]): jobs rendered by this run
+            wall (float): wall time of this run in seconds
+        """
+        print(f"{'status':>8}  {'seconds':>8}  {'video s':>8}  {'speed':>6}  output")
+        for job in jobs:
+            record = self.state.get(job["output"], {})
+            seconds = record.get("seconds", 0.0)
+            length = record.get("video_seconds", 0.0)
+            speed = f"{length / seconds:.2f}x" if seconds and length else "-"
+            print(
+                f"{record.get('status', 'pending'):>8}  {seconds:>8.1f}  "
+                f"{length:>8.1f}  {speed:>6}  {job['output']}"
+            )
+
+        records = [self.state.get(job["output"], {}) for job in rendered]
+        done = [record for record in records if record.get("status") == "done"]
+        video_seconds = sum(record["video_seconds"] for record in done)
+        hours = max(wall, 1e-9) / 3600
+        print()
+        print(
+            f"[BATCH] jobs done:   {sum(self.is_done(job) for job in jobs)}/{len(jobs)}"
+            f", {len(done)}/{len(rendered)} in this run"
+        )
+        print(f"[BATCH] wall time:   {wall:.1f}s")
+        print(
+            f"[BATCH] throughput:  {len(done) / hours:.1f} jobs/hour, "
+            f"{video_seconds / 60 / hours:.1f} video minutes/hour"
+        )
+        tracing.current().set(done=len(done), wall=wall)
@@ -0,0 +1,102 @@
+"""Compares downloading every candidate url of a keyword with `download_all`
+to `acquire` stopping at a target count, a deadline and hedging slow
+downloads, against a local fake image host with slow, failing, hanging and
+corrupt endpoints. No network access needed.
+
+Usage:
+    python -m benchmarks.acquire_bench --keywords 5 --candidates 20 --target 5
+"""
+
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+from typing import List, Tuple
+
+from benchmarks.fake_images import KINDS, FakeImageServer
+from images_utils.downloader import ImageDownloader
+from images_utils.phash import dhash_batch
+from utils.latency import LatencyStats
+
+
+def decodes(path: str) -> bool:
+    return dhash_batch([path])[0] is not None
+
+
+def run(keywords, fetch) -> Tuple[LatencyStats, List[int]]:
+    """Runs fetch(urls, directory) for every keyword and returns the latency
+    and the number of usable images of every keyword"""
+    latency = LatencyStats()
+    usable = []
+    with tempfile.TemporaryDirectory() as directory:
+        for idx, urls in enumerate(keywords):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                paths = fetch(urls, f"{directory}/keyword_{idx}")
+            latency.record(time.perf_counter() - start)
+            usable.append(sum(1 for path in paths if decodes(path)))
+    return latency, usable
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keywords", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--target", type=int, default=5)
+    parser.add_argument("--deadline", type=float, default=8.0)
+    parser.add_argument("--hedge-after", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=3.0)
+    parser.add_argument("--hang", type=float, default=20.0)
+    parser.add_argument(
+        "--weights",
+        type=float,
+        nargs=len(KINDS),
+        default=[0.4, 0.2, 0.15, 0.15, 0.1],
+        help=f"weights of the {', '.join(KINDS)} endpoints",
+    )
+    args = parser.parse_args()
+
+    with FakeImageServer(args.candidates, args.latency, args.hang) as server:
+        keywords = [
+            server.urls(args.weights, args.candidates, seed)
+            for seed in range(args.keywords)
+        ]
+        # Every url is on the same host, unlike search results, so don't
+        # limit downloads per host
+        per_host = args.candidates
+        full, full_usable = run(
+            keywords, ImageDownloader(per_host=per_host).download_all
+        )
+        full_requests = server.requests_count
+
+        server.requests_count = 0
+        downloader = ImageDownloader(per_host=per_host)
+        acquired, acquired_usable = run(
+            keywords,
+            lambda urls, directory: downloader.acquire(
+                urls,
+                directory,
+                args.target,
+                deadline=time.monotonic() + args.deadline,
+                hedge_after=args.hedge_after,
+                accept=decodes,
+            ),
+        )
+        acquired_requests = server.requests_count
+
+    for name, latency, usable, requests in (
+        ("download_all", full, full_usable, full_requests),
+        ("acquire", acquired, acquired_usable, acquired_requests),
+    ):
+        stats = latency.summary()
+        print(
+            f"[BENCH] {name + ':':14} p50 {stats['p50']:.2f}s, "
+            f"p99 {stats['p99']:.2f}s, {requests} requests, "
+            f"usable images per keyword {min(usable)}-{max(usable)}"
+        )
+    print(f"[BENCH] acquire download latency: {downloader.latency.summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Runs image searches against a local static page mimicking google images,
+once with a new browser per search and once through a warm BrowserPool.
+Needs chrome installed, but no network access after the driver is resolved.
+
+Usage:
+    python -m benchmarks.crawl_bench --searches 10 --images 20 --sessions 2
+"""
+
+import argparse
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from images_utils.google_crawl import (
+    BrowserPool,
+    driver_path,
+    google_image_search,
+    new_driver,
+)
+
+PAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_google")
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def search(wd, url_t, query, n):
+    sources = google_image_search(wd, query, n=n, search_url_t=url_t)
+    assert len(sources) >= n, f"expected {n} images, got {len(sources)}"
+    return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--searches", type=int, default=10)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=2)
+    args = parser.parse_args()
+
+    handler = functools.partial(QuietHandler, directory=PAGE_DIR)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    url_t = f"http://{host}:{port}/search.html?q={{q}}&safe={{safe}}&tbs={{opts}}"
+    queries = [f"keyword {idx}" for idx in range(args.searches)]
+
+    # Resolve the driver up front so both runs measure browser work only
+    driver_path()
+
+    start = time.perf_counter()
+    for query in queries:
+        wd = new_driver()
+        try:
+            search(wd, url_t, query, args.images)
+        finally:
+            wd.quit()
+    cold = time.perf_counter() - start
+
+    pool = BrowserPool(size=args.sessions)
+
+    def pooled_search(query):
+        with pool.session() as wd:
+            return search(wd, url_t, query, args.images)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+        list(executor.map(pooled_search, queries))
+    warm = time.perf_counter() - start
+    pool.close()
+    server.shutdown()
+
+    print(f"[BENCH] new browser per search: {cold:.2f}s")
+    print(f"[BENCH] browser pool:           {warm:.2f}s ({cold / warm:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
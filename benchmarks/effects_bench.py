@@ -0,0 +1,72 @@
+"""Measures frames/s of every motion effect against decoding the image and
+cropping and resizing it with PIL for every frame, without encoding. Both
+sample the same oversampled source.
+
+Usage:
+    python -m benchmarks.effects_bench --size 1920x1080 --frames 96
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from PIL import Image
+
+from video_utils.effects import EFFECTS, crop_rects, effect_frames, oversampling
+from video_utils.frame_store import FrameStore, decode, set_default_store
+
+
+def make_image(directory: str, size) -> str:
+    rng = random.Random(0)
+    small = Image.frombytes(
+        "RGB", (64, 36), bytes(rng.getrandbits(8) for _ in range(64 * 36 * 3))
+    )
+    path = os.path.join(directory, "image.jpg")
+    small.resize(size, Image.BILINEAR).save(path, "JPEG")
+    return path
+
+
+def naive_frames(image: str, effect: str, frames: int, size):
+    """Decodes the source and resizes its crop window with PIL every frame"""
+    factor = oversampling(effect)
+    source_size = (round(size[0] * factor), round(size[1] * factor))
+    for x, y, w, h in crop_rects(effect, frames, source_size):
+        source = Image.fromarray(decode(image, source_size))
+        yield source.resize(size, Image.BILINEAR, box=(x, y, x + w, y + h))
+
+
+def measure(frames_iter, frames: int) -> float:
+    wall = time.perf_counter()
+    count = sum(1 for _ in frames_iter)
+    wall = time.perf_counter() - wall
+    assert count == frames
+    return frames / wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--frames", type=int, default=96)
+    args = parser.parse_args()
+    size = tuple(int(value) for value in args.size.lower().split("x"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        image = make_image(directory, size)
+        print(f"{'effect':>10}  {'engine':>10}  {'per frame':>10}  speedup")
+        for effect in EFFECTS:
+            # An empty store, so the engine decodes the image once too
+            set_default_store(FrameStore(os.path.join(directory, effect)))
+            engine = measure(
+                effect_frames(image, effect, args.frames, size), args.frames
+            )
+            naive = measure(naive_frames(image, effect, args.frames, size), args.frames)
+            print(
+                f"{effect:>10}  {engine:>8.1f}/s  {naive:>8.1f}/s  "
+                f"{engine / naive:.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
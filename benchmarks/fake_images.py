@@ -0,0 +1,104 @@
+"""A local fake image host used to benchmark image acquisition offline.
+Every url path names a behaviour and an image number, e.g. /fast/3, so a
+list of candidate urls can mix fast, slow, failing, hanging and corrupt
+endpoints like a real image search result.
+"""
+
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from benchmarks.fakes import make_images
+
+KINDS = ("fast", "slow", "fail", "hang", "corrupt")
+
+
+class FakeImageServer:
+    """Threaded HTTP server serving generated JPEG images.
+
+    Attributes:
+        latency (float): Seconds /slow/ urls wait before answering.
+        hang (float): Seconds /hang/ urls trickle their body over.
+        requests_count (int): Number of requests received.
+    """
+
+    def __init__(self, images: int = 20, latency: float = 3.0, hang: float = 20.0):
+        self.latency = latency
+        self.hang = hang
+        self.requests_count = 0
+        with tempfile.TemporaryDirectory() as directory:
+            self._images = []
+            for path in make_images(directory, images, (640, 360)):
+                with open(path, "rb") as f:
+                    self._images.append(f.read())
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def url(self, kind: str, number: int) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/{kind}/{number}"
+
+    def urls(self, weights: List[float], count: int, seed: int = 0) -> List[str]:
+        """`count` urls of distinct images, with kinds drawn from `weights`
+        given in the order of KINDS"""
+        rng = random.Random(seed)
+        return [
+            self.url(rng.choices(KINDS, weights)[0], idx % len(self._images))
+            for idx in range(count)
+        ]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                _, kind, number = self.path.split("/")
+                with server._lock:
+                    server.requests_count += 1
+                body = server._images[int(number)]
+
+                if kind == "fail":
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                if kind == "slow":
+                    time.sleep(server.latency)
+                if kind == "corrupt":
+                    body = os.urandom(len(body))
+                # Clients hang up on cancelled downloads
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/jpeg")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    if kind != "hang":
+                        self.wfile.write(body)
+                        return
+                    # Trickles the body, so read timeouts never fire
+                    steps = max(1, int(server.hang * 4))
+                    chunk = -(-len(body) // steps)
+                    for start in range(0, len(body), chunk):
+                        self.wfile.write(body[start : start + chunk])
+                        self.wfile.flush()
+                        time.sleep(server.hang / steps)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
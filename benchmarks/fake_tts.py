@@ -0,0 +1,196 @@
+"""A local fake TTS service used to benchmark WaveNetTTS offline.
+The server answers with silent audio whose length depends on the text, after
+an injected latency, and can be told to fail a fraction of the requests.
+SSML requests are answered like Google's v1beta1 API with mark timepoints.
+"""
+
+import base64
+import html
+import io
+import json
+import random
+import re
+import threading
+import time
+import wave
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+from audio_utils.backends import TTSBackend
+
+# MPEG-1 Layer III, 128 kbps, 44100 Hz, mono. A frame with zeroed side info
+# decodes to 1152 samples of silence.
+MP3_FRAME_HEADER = b"\xff\xfb\x90\xc0"
+MP3_FRAME_SIZE = 417
+MP3_FRAME_SAMPLES = 1152
+MP3_SAMPLE_RATE = 44100
+
+# Speaking speed used to derive the fake audio length from the text
+CHARS_PER_SECOND = 15
+
+
+def silent_mp3(seconds: float) -> bytes:
+    """Generates a silent MP3 stream of (about) the given length"""
+    frames = max(1, round(seconds * MP3_SAMPLE_RATE / MP3_FRAME_SAMPLES))
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+    return frame * frames
+
+
+def silent_wav(seconds: float, sample_rate: int = 44100) -> bytes:
+    """Generates a silent mono 16 bit WAV file, like a LINEAR16 response"""
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(bytes(2 * int(seconds * sample_rate)))
+    return out.getvalue()
+
+
+def speech_length(text: str) -> float:
+    """Fake speech duration of a text in seconds"""
+    return max(0.5, len(text) / CHARS_PER_SECOND)
+
+
+def marked_speech(ssml: str, sample_rate: int = 44100) -> Tuple[bytes, Dict]:
+    """Fake speech of an SSML document with <mark> tags. Each text between
+    marks lasts `speech_length` and is a constant sample value, 1 for the
+    first text, 2 for the second... so cuts can be checked.
+
+    Returns:
+        Tuple[bytes, Dict]: mono 16 bit WAV content and the time of every
+        mark in seconds, by name
+    """
+    body = re.sub(r"</?speak>", "", ssml)
+    pieces = re.split(r'<mark name="([^"]*)"/>', body)
+    texts, names = pieces[0::2], pieces[1::2]
+    frames = bytearray()
+    marks = {}
+    for idx, text in enumerate(texts):
+        if idx > 0:
+            marks[names[idx - 1]] = len(frames) // 2 / sample_rate
+        samples = int(speech_length(html.unescape(text).strip()) * sample_rate)
+        frames += (idx + 1).to_bytes(2, "little") * samples
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(bytes(frames))
+    return out.getvalue(), marks
+
+
+class FakeTTSServer:
+    """Threaded HTTP server emulating a TTS service.
+
+    Attributes:
+        latency (float): Seconds each request waits before answering.
+        failure_rate (float): Fraction of requests answered with HTTP 503.
+        requests_count (int): Number of requests received.
+    """
+
+    def __init__(self, latency: float = 0.2, failure_rate: float = 0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/synthesize"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers["Content-Length"])
+                request = json.loads(self.rfile.read(length))
+                with server._lock:
+                    server.requests_count += 1
+                time.sleep(server.latency)
+
+                if random.random() < server.failure_rate:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+
+                if "ssml" in request:
+                    audio, marks = marked_speech(request["ssml"])
+                    body = json.dumps(
+                        {
+                            "audioContent": base64.b64encode(audio).decode(),
+                            "timepoints": [
+                                {"markName": name, "timeSeconds": seconds}
+                                for name, seconds in marks.items()
+                            ],
+                        }
+                    ).encode()
+                    content_type = "application/json"
+                elif "LINEAR16" in request["config"]:
+                    body = silent_wav(speech_length(request["text"]))
+                    content_type = "audio/wav"
+                else:
+                    body = silent_mp3(speech_length(request["text"]))
+                    content_type = "audio/mpeg"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class HTTPTTSBackend(TTSBackend):
+    """Backend talking to a FakeTTSServer."""
+
+    retry_exceptions = (urllib.error.URLError, ConnectionError)
+
+    def __init__(self, url: str, marks: bool = True):
+        self.url = url
+        self.supports_marks = marks
+
+    def _post(self, payload: Dict) -> bytes:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.read()
+
+    def synthesize(self, text: str, voice: Tuple[str, int], audio_config) -> bytes:
+        return self._post(
+            {"text": text, "voice": voice and voice[0], "config": str(audio_config)}
+        )
+
+    def synthesize_marked(
+        self, ssml: str, voice: Tuple[str, int], audio_config
+    ) -> Tuple[bytes, Dict[str, float]]:
+        response = json.loads(
+            self._post(
+                {"ssml": ssml, "voice": voice and voice[0], "config": str(audio_config)}
+            )
+        )
+        marks = {
+            point["markName"]: point["timeSeconds"] for point in response["timepoints"]
+        }
+        return base64.b64decode(response["audioContent"]), marks
@@ -0,0 +1,108 @@
+"""Offline stand-ins for the cloud/network parts of the pipeline, used by the
+benchmarks: a TTS backend answering with silent audio and an image grabber
+serving a generated local corpus.
+"""
+
+import os
+import random
+from typing import List, Tuple
+
+from PIL import Image
+
+from audio_utils.backends import TTSBackend
+from benchmarks.fake_tts import silent_mp3, silent_wav, CHARS_PER_SECOND
+from images_utils.phash import dhash_batch, select_distinct
+from utils.common import mkdir
+
+
+class SilentTTSBackend(TTSBackend):
+    """In process backend returning silent audio.
+
+    Attributes:
+        chars_per_second (float): Speaking speed the audio length is derived
+            from, lower values make longer videos.
+        encoding (str): "wav" for LINEAR16 like responses, "mp3" otherwise.
+        requests_count (int): Number of synthesize calls.
+    """
+
+    def __init__(
+        self, chars_per_second: float = CHARS_PER_SECOND, encoding: str = "wav"
+    ):
+        self.chars_per_second = chars_per_second
+        self.encoding = encoding
+        self.requests_count = 0
+
+    def synthesize(self, text: str, voice: Tuple[str, int], audio_config) -> bytes:
+        self.requests_count += 1
+        seconds = max(0.5, len(text) / self.chars_per_second)
+        if self.encoding == "wav":
+            return silent_wav(seconds)
+        return silent_mp3(seconds)
+
+
+class FakeImageGrabber:
+    """Serves a generated corpus of images instead of searching google.
+
+    Attributes:
+        directory (str): Folder holding the corpus.
+        images (List[str]): Paths of the corpus images.
+        searches_count (int): Number of search_image calls.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        count: int = 12,
+        size: Tuple[int, int] = (1920, 1080),
+        seed: int = 0,
+    ):
+        self.directory = directory
+        self.searches_count = 0
+        self.images = make_images(directory, count, size, seed)
+        self._phashes = dhash_batch(self.images)
+
+    def search_image(self, keyword: str) -> List[str]:
+        self.searches_count += 1
+        return list(self.images)
+
+    def select_images(self, keyword: str, count: int, seed: str = "") -> List[str]:
+        self.searches_count += 1
+        return [self.images[idx] for idx in select_distinct(self._phashes, count, seed)]
+
+
+def make_images(
+    directory: str, count: int, size: Tuple[int, int] = (1920, 1080), seed: int = 0
+) -> List[str]:
+    """Writes `count` deterministic noisy JPEG images of the given size.
+    Images already in `directory` are kept as they are, so a corpus reused
+    across runs keeps its mtimes and rendered segments stay cached."""
+    mkdir(directory)
+    rng = random.Random(seed)
+    paths = []
+    for idx in range(count):
+        # Upscaled noise compresses like a photo instead of a flat color
+        small = Image.frombytes(
+            "RGB", (64, 36), bytes(rng.getrandbits(8) for _ in range(64 * 36 * 3))
+        )
+        path = os.path.join(directory, f"image_{seed}_{idx}_{size[0]}x{size[1]}.jpg")
+        if not os.path.isfile(path):
+            small.resize(size, Image.BILINEAR).save(path, "JPEG")
+        paths.append(path)
+    return paths
+
+
+def make_script(segments: int, chunks: int, seed: int = 0) -> str:
+    """Generates a script of `segments` image tags, each followed by `chunks`
+    voiceover chunks alternating between the default voice and a voice tag"""
+    rng = random.Random(seed)
+    words = "the quick brown fox jumps over a lazy dog while narrating".split()
+    parts = []
+    for idx in range(segments):
+        parts.append(f"[IMAGE: keyword {idx} {rng.randint(3, 6)}]")
+        for chunk in range(chunks):
+            words_count = rng.randint(8, 20)
+            sentence = " ".join(rng.choice(words) for _ in range(words_count)) + "."
+            if chunk % 2:
+                sentence = f"[VOICE: {rng.choice('ABCDEFGHIJ')}]{sentence}[/VOICE]"
+            parts.append(sentence)
+    return " ".join(parts)
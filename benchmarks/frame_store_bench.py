@@ -0,0 +1,109 @@
+"""Compares decoding images with PIL to reading them from a FrameStore, cold
+and warm, and the peak memory of building and reading the clips of a video
+with one `ImageClip` per image against the frame store backed clips of
+`VideoSegment.build_clip`.
+
+Usage:
+    python -m benchmarks.frame_store_bench --images 30 --size 1920x1080
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import make_images
+from video_utils.frame_store import FrameStore, decode, set_default_store
+from video_utils.video_segment import VideoSegment
+
+
+def peak_rss(mode: str, images, store_directory: str) -> None:
+    """Builds the clips of every image, reads a frame of each like writing
+    the video would and prints the peak RSS in MiB. Run in a child process,
+    so the peak isn't shared between modes."""
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if mode == "imageclip":
+        from moviepy.editor import ImageClip, concatenate_videoclips
+
+        clip = concatenate_videoclips(
+            [ImageClip(image, duration=1) for image in images], method="compose"
+        )
+    else:
+        set_default_store(FrameStore(store_directory))
+        segment = VideoSegment("benchmark", [], "benchmark", 1, len(images))
+        segment.images = images
+        segment.duration = len(images)
+        clip = segment.build_clip(audio=False)
+    for idx in range(len(images)):
+        # Copies the frame out like the ffmpeg writer does
+        clip.get_frame(idx + 0.5).tobytes()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{(peak - before) / 1024:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=30)
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--rss", choices=["imageclip", "store"], help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    size = tuple(int(value) for value in args.size.lower().split("x"))
+
+    if args.rss is not None:
+        images = sorted(
+            os.path.join(args.directory, "images", name)
+            for name in os.listdir(os.path.join(args.directory, "images"))
+        )
+        peak_rss(args.rss, images, os.path.join(args.directory, "store"))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        images = make_images(os.path.join(directory, "images"), args.images, size)
+
+        start = time.perf_counter()
+        for image in images:
+            decode(image, size)
+        decoded = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = FrameStore(os.path.join(directory, "store"))
+        for image in images:
+            store.frame(image, size)
+        cold = time.perf_counter() - start
+
+        # A new store, like the next render, reads the frames from disk
+        start = time.perf_counter()
+        store = FrameStore(os.path.join(directory, "store"))
+        for image in images:
+            # Touch every page, as encoding the frame would
+            int(store.frame(image, size).sum(dtype="uint64"))
+        warm = time.perf_counter() - start
+        assert store.misses == 0
+
+        peaks = {}
+        for mode in ("imageclip", "store"):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.frame_store_bench"]
+                + ["--rss", mode, "--directory", directory],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            peaks[mode] = int(output.split()[-1])
+
+    count = len(images)
+    print(f"[BENCH] PIL decode:        {decoded / count * 1000:.1f} ms/image")
+    print(f"[BENCH] frame store cold:  {cold / count * 1000:.1f} ms/image")
+    print(f"[BENCH] frame store warm:  {warm / count * 1000:.1f} ms/image")
+    print(
+        f"[BENCH] peak RSS growth, {count} images: ImageClip "
+        f"{peaks['imageclip']} MiB, frame store {peaks['store']} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Measures CLI startup of the `plan` command. That it imports no heavy
+module (MoviePy, selenium, PIL, the google cloud clients) is checked by
+tests/test_cli_imports.py.
+
+Usage:
+    python -m benchmarks.import_bench --runs 5
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "test_script.txt")
+
+CHECK = """
+from cli import main
+main(["plan", {script!r}])
+"""
+
+
+def run(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        process = run(CHECK.format(script=SCRIPT))
+        timings.append(time.perf_counter() - start)
+        if process.returncode != 0:
+            print(process.stderr)
+            sys.exit(1)
+
+    print(f"[BENCH] cli plan startup: best {min(timings) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Compares the old in place `_resize_images` with ImageNormalizer on a
+generated local corpus of mixed size JPEG/PNG/WEBP images.
+
+Usage:
+    python -m benchmarks.normalize_bench --images 60 --workers 4
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import List, Tuple
+
+from PIL import Image
+
+from images_utils.normalizer import ImageNormalizer
+
+SIZES = [(640, 480), (1280, 720), (1920, 1080), (3000, 2000), (4032, 3024)]
+FORMATS = [("JPEG", ".jpg"), ("PNG", ".png"), ("WEBP", ".webp")]
+
+
+def make_corpus(directory: str, count: int, seed: int = 0) -> List[str]:
+    """Writes `count` noisy images of random sizes and formats"""
+    rng = random.Random(seed)
+    paths = []
+    for idx in range(count):
+        size = rng.choice(SIZES)
+        image_format, extension = rng.choice(FORMATS)
+        # Upscaled noise compresses like a photo instead of a flat color
+        small = Image.frombytes(
+            "RGB", (64, 48), bytes(rng.getrandbits(8) for _ in range(64 * 48 * 3))
+        )
+        path = os.path.join(directory, f"image_{idx}{extension}")
+        small.resize(size, Image.BILINEAR).save(path, image_format)
+        paths.append(path)
+    return paths
+
+
+def legacy_resize(files: List[str], size: Tuple[int, int]) -> None:
+    """The resize loop ImageNormalizer replaced: full decode, in place"""
+    for file in files:
+        background = Image.new("RGB", size)
+        im = Image.open(file)
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        wr = size[0] / im.width
+        hr = size[1] / im.height
+        if wr > hr:
+            im = im.resize((int(im.width * hr), size[1]), Image.ANTIALIAS)
+        else:
+            im = im.resize((size[0], int(im.height * wr)), Image.ANTIALIAS)
+        background.paste(im, ((size[0] - im.width) // 2, (size[1] - im.height) // 2))
+        background.save(file, "JPEG")
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    size = (1920, 1080)
+
+    with tempfile.TemporaryDirectory() as root:
+        corpus = os.path.join(root, "corpus", "keyword")
+        os.makedirs(corpus)
+        print(f"[BENCH] Generating {args.images} images")
+        sources = make_corpus(corpus, args.images)
+
+        legacy = os.path.join(root, "legacy")
+        shutil.copytree(corpus, legacy)
+        legacy_files = [os.path.join(legacy, os.path.basename(s)) for s in sources]
+        legacy_time = timed(legacy_resize, legacy_files, size)
+
+        normalizer = ImageNormalizer(
+            size, os.path.join(root, "normalized"), max_workers=args.workers
+        )
+        cold_time = timed(normalizer.normalize, sources)
+        warm_time = timed(normalizer.normalize, sources)
+        normalizer.close()
+
+    print(f"[BENCH] legacy _resize_images: {legacy_time:.2f}s")
+    print(f"[BENCH] normalizer, cold:      {cold_time:.2f}s")
+    print(f"[BENCH] normalizer, warm:      {warm_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compares the old two pass TextProcessor parsing with the single pass
+tokenizer on synthetic scripts with many [IMAGE] and [VOICE] tags.
+
+Usage:
+    python -m benchmarks.parser_bench --segments 5000 --voices 4
+"""
+
+import argparse
+import io
+import random
+import re
+import time
+
+from text_utils.text_processor import TextProcessor
+
+IMAGE_RE = r"\[IMAGE: (.+?)(\d*?)]"
+SPLIT_IMAGE_RE = r"\[IMAGE: .+?\d*?]"
+SEARCH_VOICE_RE = r"\[VOICE: (.+?)](.+?)\[\/VOICE]"
+SPLIT_VOICE_RE = r"\[VOICE: .+?](.+?)\[\/VOICE]"
+
+
+def make_script(segments: int, voices: int, seed: int = 0) -> str:
+    """Generates a script with `segments` image tags and `voices` voice tags
+    per segment"""
+    rng = random.Random(seed)
+    parts = []
+    for idx in range(segments):
+        parts.append(f"[IMAGE: keyword {idx} {rng.randint(1, 9)}]")
+        for voice in range(voices):
+            parts.append(f"Narration {idx}-{voice} goes here.")
+            parts.append(f"[VOICE: {rng.choice('ABCDEFGHIJ')}]")
+            parts.append(f"Quote {idx}-{voice} in another voice.[/VOICE]")
+    return " ".join(parts)
+
+
+def legacy_parse(text: str):
+    """The two pass parsing TextProcessor used before the tokenizer"""
+    groups = []
+    for match in re.finditer(IMAGE_RE, text, re.DOTALL):
+        try:
+            images_number = int(match.group(2))
+        except ValueError:
+            images_number = 5
+        groups.append((match.group(1), images_number))
+
+    segments = []
+    i = 0
+    for sentence in re.split(SPLIT_IMAGE_RE, text, re.DOTALL):
+        if len(sentence) > 0:
+            segments.append((legacy_voices(sentence.strip()), groups[i]))
+            i += 1
+    return segments
+
+
+def legacy_voices(text: str):
+    voiceover_segment = []
+    for sentence in re.split(SPLIT_VOICE_RE, text, re.DOTALL | re.MULTILINE):
+        if len(sentence.strip()) > 0:
+            voiceover_segment.append({"voice": "DEFAULT", "text": sentence.strip()})
+    for sentence in re.finditer(SEARCH_VOICE_RE, text, re.DOTALL | re.MULTILINE):
+        for idx, t in enumerate(voiceover_segment):
+            if t["text"] == sentence.group(2).strip():
+                voiceover_segment[idx]["voice"] = sentence.group(1)
+    return voiceover_segment
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--segments", type=int, default=5000)
+    parser.add_argument("--voices", type=int, default=4)
+    args = parser.parse_args()
+
+    script = make_script(args.segments, args.voices)
+    tags = args.segments * (1 + 2 * args.voices)
+    print(f"[BENCH] {tags} tags, {len(script) / 1e6:.1f}M characters")
+
+    legacy = timed(legacy_parse, script)
+    single = timed(lambda: list(TextProcessor.parse(io.StringIO(script))))
+    print(f"[BENCH] two pass:    {legacy:.2f}s")
+    print(f"[BENCH] single pass: {single:.2f}s ({legacy / single:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
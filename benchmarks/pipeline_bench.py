@@ -0,0 +1,182 @@
+"""End to end benchmark of TextProcessor -> VideoSegment -> TextToVideo with
+a silent TTS backend and a generated image corpus, no network needed.
+
+Every script size is rendered by `generate_video` + `save_video`, then twice
+by `render_video`: cold, with empty TTS and segment caches, and warm, with
+the caches of the cold run, as when a script is rendered again. The image
+corpus is generated once in --corpus and reused by later runs, so its mtimes
+and the segment fingerprints stay the same. Every size runs in a fresh
+process so peak RSS is measured per size.
+Results can be saved as a baseline and later runs compared against it, the
+command exits with status 1 when a metric regressed past the tolerance.
+
+Usage:
+    python -m benchmarks.pipeline_bench --sizes small medium
+    python -m benchmarks.pipeline_bench --save-baseline baseline.json
+    python -m benchmarks.pipeline_bench --baseline baseline.json --tolerance 0.15
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+# (segments, voiceover chunks per segment)
+SIZES = {
+    "small": (3, 2),
+    "medium": (10, 4),
+    "large": (40, 6),
+}
+
+# Metrics compared against the baseline, all of them lower is better
+GATED_METRICS = [
+    "parse_s",
+    "generate_s",
+    "save_s",
+    "total_s",
+    "render_cold_s",
+    "render_warm_s",
+    "peak_rss_mb",
+]
+
+DEFAULT_CORPUS = os.path.join(tempfile.gettempdir(), "ttv_bench_corpus")
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process and of its largest finished child, in MiB"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KiB on linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return max(own, children) / scale
+
+
+def run_size(size: str, fps: int, corpus: str) -> Dict:
+    """Renders one synthetic script, meant to run in its own process"""
+    # Imported here so the parent process stays light and each size starts
+    # from a cold process.
+    from audio_utils.audio import WaveNetTTS
+    from audio_utils.cache import AudioCache
+    from benchmarks.fakes import FakeImageGrabber, SilentTTSBackend, make_script
+    from text_utils.text_processor import TextProcessor
+    from TextToVideo import TextToVideo
+
+    segments, chunks = SIZES[size]
+    script = make_script(segments, chunks)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        gid = FakeImageGrabber(corpus)
+        tts = WaveNetTTS(backend=SilentTTSBackend())
+
+        start = time.perf_counter()
+        TextProcessor(script)
+        parse_s = time.perf_counter() - start
+
+        ttv = TextToVideo(script, f"{size}.mp4", tts=tts, gid=gid)
+
+        start = time.perf_counter()
+        ttv.generate_video()
+        generate_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ttv.save_video(fps)
+        save_s = time.perf_counter() - start
+
+        duration = sum(s.duration for s in ttv._text_processor.video_segments)
+        output_bytes = os.path.getsize(os.path.join("output", f"{size}.mp4"))
+
+        # Caches start empty in the temporary directory and are kept for the
+        # warm run
+        cached_tts = WaveNetTTS(backend=SilentTTSBackend(), cache=AudioCache())
+        renders = {}
+        for run in ("cold", "warm"):
+            ttv = TextToVideo(script, f"{size}_{run}.mp4", tts=cached_tts, gid=gid)
+            start = time.perf_counter()
+            ttv.render_video(fps)
+            renders[run] = time.perf_counter() - start
+            renders[f"{run}_segments"] = ttv._segment_cache.misses
+
+    return {
+        "segments": segments,
+        "chunks": segments * chunks,
+        "video_s": round(duration, 2),
+        "parse_s": round(parse_s, 4),
+        "generate_s": round(generate_s, 3),
+        "save_s": round(save_s, 3),
+        "total_s": round(parse_s + generate_s + save_s, 3),
+        "frames_per_s": round(duration * fps / save_s, 1),
+        "render_cold_s": round(renders["cold"], 3),
+        "render_warm_s": round(renders["warm"], 3),
+        "render_frames_per_s": round(duration * fps / renders["cold"], 1),
+        "segments_rendered_warm": renders["warm_segments"],
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "output_mb": round(output_bytes / (1024 * 1024), 2),
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> bool:
+    """Prints regressions against a baseline, returns True if none"""
+    ok = True
+    for size, metrics in results.items():
+        for metric in GATED_METRICS:
+            before = baseline.get(size, {}).get(metric)
+            if not before:
+                continue
+            change = metrics[metric] / before - 1
+            if change > tolerance:
+                ok = False
+                print(
+                    f"[REGRESSION] {size} {metric}: {before} -> {metrics[metric]} "
+                    f"(+{change:.0%})"
+                )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=list(SIZES))
+    parser.add_argument("--fps", type=int, default=24)
+    parser.add_argument(
+        "--corpus",
+        default=DEFAULT_CORPUS,
+        help="image corpus folder, generated on the first run and reused",
+    )
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare results with this JSON file")
+    parser.add_argument("--save-baseline", help="write results as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[size] = executor.submit(
+                run_size, size, args.fps, args.corpus
+            ).result()
+        print(f"[BENCH] {size}: {json.dumps(results[size])}")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+        print(f"[BENCH] No regression over {args.tolerance:.0%} tolerance")
+
+
+if __name__ == "__main__":
+    main()
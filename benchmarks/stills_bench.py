@@ -0,0 +1,94 @@
+"""Compares MoviePy's per-frame compositing with the still image fast path
+when rendering a segment made only of static images.
+
+Usage:
+    python -m benchmarks.stills_bench --images 5 --seconds 30 --fps 24
+"""
+
+import argparse
+import os
+import random
+import resource
+import tempfile
+import time
+
+from PIL import Image
+
+from benchmarks.fake_tts import silent_wav
+from video_utils.encoder import SEGMENT_CODEC_PARAMS, encode_stills
+from video_utils.video_segment import VideoSegment
+
+
+def cpu_time() -> float:
+    """User + system CPU time of this process and its finished children"""
+    usage = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        r = resource.getrusage(who)
+        usage += r.ru_utime + r.ru_stime
+    return usage
+
+
+def make_segment(directory: str, images: int, seconds: float) -> VideoSegment:
+    rng = random.Random(0)
+    segment = VideoSegment("benchmark", [], "benchmark", 1, images)
+    for idx in range(images):
+        small = Image.frombytes(
+            "RGB", (64, 36), bytes(rng.getrandbits(8) for _ in range(64 * 36 * 3))
+        )
+        path = os.path.join(directory, f"image_{idx}.jpg")
+        small.resize((1920, 1080), Image.BILINEAR).save(path, "JPEG")
+        segment.images.append(path)
+
+    audio_file = os.path.join(directory, "voiceover.wav")
+    with open(audio_file, "wb") as out:
+        out.write(silent_wav(seconds))
+    segment.audio_files = [audio_file]
+    segment.duration = seconds
+    return segment
+
+
+def measure(name: str, render, frames: int) -> None:
+    wall, cpu = time.perf_counter(), cpu_time()
+    render()
+    wall, cpu = time.perf_counter() - wall, cpu_time() - cpu
+    print(
+        f"[BENCH] {name}: {wall:.2f}s wall, {cpu:.2f}s CPU, "
+        f"{frames / wall:.0f} frames/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--fps", type=int, default=24)
+    args = parser.parse_args()
+    frames = int(args.seconds * args.fps)
+
+    with tempfile.TemporaryDirectory() as directory:
+        segment = make_segment(directory, args.images, args.seconds)
+
+        def compose():
+            clip = segment.build_clip(args.fps, audio=False)
+            clip.write_videofile(
+                os.path.join(directory, "compose.mp4"),
+                fps=args.fps,
+                audio=False,
+                logger=None,
+                **SEGMENT_CODEC_PARAMS,
+            )
+            clip.close()
+
+        def stills():
+            encode_stills(
+                segment.timeline(),
+                os.path.join(directory, "stills.mp4"),
+                args.fps,
+            )
+
+        measure("MoviePy compose  ", compose, frames)
+        measure("still fast path  ", stills, frames)
+
+
+if __name__ == "__main__":
+    main()
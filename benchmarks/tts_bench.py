@@ -0,0 +1,97 @@
+"""Compares serial `generate_tts` calls, concurrent `synthesize_many` and
+`synthesize_many` coalescing texts into SSML requests against a local fake
+TTS server, no network or google credentials needed. Coalesced chunks are
+checked to have the same duration as when synthesized alone.
+
+Usage:
+    python -m benchmarks.tts_bench --requests 200 --latency 0.2 --workers 16
+"""
+
+import argparse
+import time
+
+from audio_utils.audio import WaveNetTTS
+from audio_utils.pcm import audio_duration
+from benchmarks.fake_tts import FakeTTSServer, HTTPTTSBackend, speech_length
+
+
+def make_requests(count: int, run: int = 3):
+    """Requests switching between two voices every `run` texts"""
+    return [
+        {
+            "text": f"Sentence number {idx} of the benchmark script.",
+            "filename": f"bench-{idx}.wav",
+            "voice": None if idx // run % 2 == 0 else "J",
+        }
+        for idx in range(count)
+    ]
+
+
+def measure(server: FakeTTSServer, run) -> float:
+    server.requests_count = 0
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--qps", type=float, default=None)
+    parser.add_argument("--run", type=int, default=3, help="texts per voice run")
+    args = parser.parse_args()
+
+    requests = make_requests(args.requests, args.run)
+    with FakeTTSServer(args.latency, args.failure_rate) as server:
+        tts = WaveNetTTS(
+            audio_config="LINEAR16",
+            backend=HTTPTTSBackend(server.url),
+            max_workers=args.workers,
+            qps=args.qps,
+        )
+
+        def serial_run():
+            for request in requests:
+                tts.generate_tts(request["text"], request["filename"], request["voice"])
+
+        serial = measure(server, serial_run)
+        serial_requests = server.requests_count
+
+        tts.coalesce = False
+        concurrent = measure(server, lambda: tts.synthesize_many(requests))
+        concurrent_requests = server.requests_count
+
+        tts.coalesce = True
+        results = []
+        coalesced = measure(
+            server, lambda: results.extend(tts.synthesize_many(requests))
+        )
+        coalesced_requests = server.requests_count
+
+    errors = []
+    for request, (path, duration) in zip(requests, results):
+        with open(path, "rb") as f:
+            content = f.read()
+        expected = int(speech_length(request["text"]) * 44100) / 44100
+        if abs(audio_duration(content) - expected) > 1 / 44100 or duration != (
+            audio_duration(content)
+        ):
+            errors.append(path)
+
+    print(f"[BENCH] serial:     {serial:.2f}s, {serial_requests} server requests")
+    print(
+        f"[BENCH] concurrent: {concurrent:.2f}s ({serial / concurrent:.1f}x), "
+        f"{concurrent_requests} server requests"
+    )
+    print(
+        f"[BENCH] coalesced:  {coalesced:.2f}s ({serial / coalesced:.1f}x), "
+        f"{coalesced_requests} server requests"
+    )
+    print(f"[BENCH] chunks with a wrong duration: {len(errors)}")
+
+
+if __name__ == "__main__":
+    main()
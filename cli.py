@@ -0,0 +1,386 @@
+"""Command line entry point.
+
+    python cli.py render script.txt -o video.mp4
+    python cli.py preview script.txt -o video.mp4 --contact-sheets
+    python cli.py watch script.txt -o video.mp4 --preview
+    python cli.py batch manifest.json --jobs 2
+    python cli.py calibrate --jobs 2
+    python cli.py validate script.txt
+    python cli.py plan script.txt
+
+`validate` and `plan` only parse the script, they never load MoviePy,
+selenium or the google cloud clients.
+"""
+
+import argparse
+import os
+import sys
+from typing import Tuple
+
+from audio_utils.voices import VOICES
+from text_utils.text_processor import TemplateError, TextProcessor
+from video_utils.encoder import Rendition
+from utils import tracing
+
+# Average WaveNet speaking speed at speaking_rate=1, used for estimates only
+CHARS_PER_SECOND = 15
+
+
+def read_segments(script: str):
+    with open(script, "r", encoding="utf-8") as f:
+        segments = list(TextProcessor.parse(f))
+    check_voices(segments)
+    return segments
+
+
+def check_voices(segments) -> None:
+    """Raises TemplateError for a [VOICE] tag naming a voice the TTS doesn't
+    have, which would otherwise only fail once the segment is rendered"""
+    for segment in segments:
+        for voiceover in segment.voiceover_text:
+            if voiceover["voice"] not in VOICES:
+                names = ", ".join(name for name in VOICES if name != "DEFAULT")
+                raise TemplateError(
+                    f"segment #{segment.segment_number} has an unknown voice "
+                    f"[VOICE: {voiceover['voice']}], expected one of {names}"
+                )
+
+
+def validate(args) -> int:
+    try:
+        segments = read_segments(args.script)
+    except TemplateError as e:
+        print(f"[ERROR] {args.script}: {e}")
+        return 1
+    if len(segments) == 0:
+        print(f"[ERROR] {args.script}: no segment with voice over found")
+        return 1
+    print(f"[INFO] {args.script} is valid, {len(segments)} segments")
+    return 0
+
+
+def plan(args) -> int:
+    try:
+        segments = read_segments(args.script)
+    except TemplateError as e:
+        print(f"[ERROR] {args.script}: {e}")
+        return 1
+
+    total_chars = 0
+    total_images = 0
+    total_chunks = 0
+    voices = set()
+    print(
+        f"{'#':>4}  {'images':>6}  {'chunks':>6}  {'chars':>6}  {'~sec':>6}  keyword"
+    )
+    for segment in segments:
+        chars = sum(len(v["text"]) for v in segment.voiceover_text)
+        total_chars += chars
+        total_images += segment.images_number
+        total_chunks += len(segment.voiceover_text)
+        voices.update(v["voice"] for v in segment.voiceover_text)
+        print(
+            f"{segment.segment_number:>4}  {segment.images_number:>6}  "
+            f"{len(segment.voiceover_text):>6}  {chars:>6}  "
+            f"{chars / args.chars_per_second:>6.0f}  {segment.image_keyword.strip()}"
+        )
+
+    keywords = {" ".join(s.image_keyword.lower().split()) for s in segments}
+    seconds = total_chars / args.chars_per_second
+    print()
+    print(f"[PLAN] segments:         {len(segments)}")
+    print(f"[PLAN] voices:           {', '.join(sorted(voices))}")
+    print(f"[PLAN] TTS requests:     {total_chunks} ({total_chars} characters)")
+    print(f"[PLAN] image searches:   {len(keywords)} unique keywords")
+    print(f"[PLAN] images shown:     {total_images}")
+    print(
+        f"[PLAN] estimated length: {seconds / 60:.1f} min, "
+        f"{int(seconds * args.fps)} frames at {args.fps} fps"
+    )
+    return 0
+
+
+def render(args) -> int:
+    from video_utils.profiles import get_profile
+
+    try:
+        profile = get_profile(args.profile) if args.profile else None
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        return 1
+
+    # Template errors are reported before any speech or image is paid for
+    try:
+        read_segments(args.script)
+    except TemplateError as e:
+        print(f"[ERROR] {args.script}: {e}")
+        return 1
+
+    if args.trace:
+        tracing.enable(args.trace)
+
+    # Rendering is the only command that needs the media and cloud libraries
+    from TextToVideo import TextToVideo
+
+    with open(args.script, "r", encoding="utf-8") as f:
+        text = f.read()
+    text = text.replace("\n", " ")
+    ttv = TextToVideo(text, args.output)
+    ttv.render_video(
+        fps=args.fps,
+        workers=args.workers,
+        io_workers=args.io_workers,
+        renditions=args.rendition,
+        profile=profile,
+    )
+
+    if tracing.enabled():
+        trace_dir = os.environ[tracing.TRACE_ENV]
+        tracing.export_chrome(trace_dir, os.path.join(trace_dir, "trace.json"))
+    return 0
+
+
+def preview(args) -> int:
+    try:
+        read_segments(args.script)
+    except TemplateError as e:
+        print(f"[ERROR] {args.script}: {e}")
+        return 1
+
+    from TextToVideo import TextToVideo
+
+    with open(args.script, "r", encoding="utf-8") as f:
+        text = f.read()
+    text = text.replace("\n", " ")
+    ttv = TextToVideo(text, args.output)
+    ttv.preview(
+        fps=args.fps,
+        height=args.height,
+        contact_sheets=args.contact_sheets,
+        workers=args.workers,
+        io_workers=args.io_workers,
+    )
+    return 0
+
+
+def watch(args) -> int:
+    from video_utils.profiles import get_profile
+
+    try:
+        profile = get_profile(args.profile) if args.profile else None
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        return 1
+
+    from watch import ScriptWatcher
+
+    watcher = ScriptWatcher(
+        args.script,
+        args.output,
+        preview=args.preview,
+        fps=args.fps,
+        height=args.height,
+        profile=profile,
+        interval=args.interval,
+        workers=args.workers,
+        io_workers=args.io_workers,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print(f"[INFO] Stopped watching {args.script} after {watcher.renders} renders")
+    return 0
+
+
+def batch(args) -> int:
+    if args.trace:
+        tracing.enable(args.trace)
+
+    from batch import BatchRunner, ManifestError, load_manifest
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except ManifestError as e:
+        print(f"[ERROR] {args.manifest}: {e}")
+        return 1
+    runner = BatchRunner(
+        args.state or args.manifest + ".state.json",
+        jobs=args.jobs,
+        workers=args.workers,
+        io_workers=args.io_workers,
+    )
+    ok = runner.run(jobs)
+
+    if tracing.enabled():
+        trace_dir = os.environ[tracing.TRACE_ENV]
+        tracing.export_chrome(trace_dir, os.path.join(trace_dir, "trace.json"))
+    return 0 if ok else 1
+
+
+def calibrate(args) -> int:
+    from video_utils.profiles import calibrate as calibrate_profiles
+    from video_utils.profiles import candidate_profiles
+
+    calibration = calibrate_profiles(
+        candidate_profiles(args.crf, args.jobs),
+        size=args.size,
+        fps=args.fps,
+        seconds=args.seconds,
+        min_ssim=args.min_ssim,
+        max_kbps=args.max_kbps,
+        jobs=args.jobs,
+    )
+    print(f"[INFO] Use it with --profile auto: {calibration['best']}")
+    return 0
+
+
+def size(spec: str) -> Tuple[int, int]:
+    try:
+        width, height = (int(value) for value in spec.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size {spec!r}")
+    return width, height
+
+
+def rendition(spec: str) -> Rendition:
+    try:
+        return Rendition.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Turns a script into a video")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    render_parser = commands.add_parser("render", help="render a script to a video")
+    render_parser.add_argument("script")
+    render_parser.add_argument("-o", "--output", default="video.mp4")
+    render_parser.add_argument("--fps", type=int, default=24)
+    render_parser.add_argument("--workers", type=int, default=None)
+    render_parser.add_argument("--io-workers", type=int, default=4)
+    render_parser.add_argument(
+        "--rendition",
+        action="append",
+        type=rendition,
+        help="WIDTHxHEIGHT[@FPS][:crf=N][:bitrate=RATE][:preset=NAME]"
+        "[:threads=N], repeat for several variants encoded in one pass",
+    )
+    render_parser.add_argument(
+        "--profile",
+        help="encoder profile: default, fast, quality, small, draft, or auto "
+        "for the one picked by calibrate",
+    )
+    render_parser.add_argument(
+        "--trace",
+        default=os.environ.get(tracing.TRACE_ENV),
+        help="folder to write a trace of the render to",
+    )
+    render_parser.set_defaults(handler=render)
+
+    preview_parser = commands.add_parser(
+        "preview", help="render a fast low resolution draft of a script"
+    )
+    preview_parser.add_argument("script")
+    preview_parser.add_argument("-o", "--output", default="video.mp4")
+    preview_parser.add_argument("--fps", type=int, default=12)
+    preview_parser.add_argument("--height", type=int, default=360)
+    preview_parser.add_argument(
+        "--contact-sheets",
+        action="store_true",
+        help="save a contact sheet per segment and a timing table instead "
+        "of a video",
+    )
+    preview_parser.add_argument("--workers", type=int, default=None)
+    preview_parser.add_argument("--io-workers", type=int, default=4)
+    preview_parser.set_defaults(handler=preview)
+
+    watch_parser = commands.add_parser(
+        "watch",
+        help="render a script again on every save, reusing unchanged segments",
+    )
+    watch_parser.add_argument("script")
+    watch_parser.add_argument("-o", "--output", default="video.mp4")
+    watch_parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="render low resolution drafts with estimated speech",
+    )
+    watch_parser.add_argument(
+        "--fps", type=int, default=None, help="defaults to 24, 12 with --preview"
+    )
+    watch_parser.add_argument(
+        "--height",
+        type=int,
+        default=None,
+        help="defaults to the height of the images, 360 with --preview",
+    )
+    watch_parser.add_argument(
+        "--profile", help="encoder profile of full renders, see render --profile"
+    )
+    watch_parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.5,
+        help="seconds between checks of the script",
+    )
+    watch_parser.add_argument("--workers", type=int, default=None)
+    watch_parser.add_argument("--io-workers", type=int, default=4)
+    watch_parser.set_defaults(handler=watch)
+
+    batch_parser = commands.add_parser(
+        "batch", help="render every job of a manifest with shared resources"
+    )
+    batch_parser.add_argument("manifest")
+    batch_parser.add_argument("--jobs", type=int, default=2)
+    batch_parser.add_argument("--workers", type=int, default=None)
+    batch_parser.add_argument("--io-workers", type=int, default=4)
+    batch_parser.add_argument(
+        "--state", help="checkpoint file, defaults to <manifest>.state.json"
+    )
+    batch_parser.add_argument(
+        "--trace",
+        default=os.environ.get(tracing.TRACE_ENV),
+        help="folder to write a trace of the batch to",
+    )
+    batch_parser.set_defaults(handler=batch)
+
+    calibrate_parser = commands.add_parser(
+        "calibrate",
+        help="pick the fastest encoder profile meeting a quality target on "
+        "this machine",
+    )
+    calibrate_parser.add_argument("--size", type=size, default=(1920, 1080))
+    calibrate_parser.add_argument("--fps", type=int, default=24)
+    calibrate_parser.add_argument("--seconds", type=float, default=2.0)
+    calibrate_parser.add_argument("--crf", type=int, default=23)
+    calibrate_parser.add_argument("--min-ssim", type=float, default=0.97)
+    calibrate_parser.add_argument("--max-kbps", type=float, default=None)
+    calibrate_parser.add_argument(
+        "--jobs", type=int, default=1, help="encodes running at once when rendering"
+    )
+    calibrate_parser.set_defaults(handler=calibrate)
+
+    validate_parser = commands.add_parser("validate", help="check a script's tags")
+    validate_parser.add_argument("script")
+    validate_parser.set_defaults(handler=validate)
+
+    plan_parser = commands.add_parser(
+        "plan", help="print segments, voices and estimated work"
+    )
+    plan_parser.add_argument("script")
+    plan_parser.add_argument("--fps", type=int, default=24)
+    plan_parser.add_argument(
+        "--chars-per-second", type=float, default=CHARS_PER_SECOND
+    )
+    plan_parser.set_defaults(handler=plan)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Concurrent image downloader.
+Downloads share one pooled HTTP session, are limited per host, streamed to disk
+in chunks and named after a hash of their content, so parallel downloads never
+collide and byte identical images are only stored once.
+`acquire` stops downloading once enough images landed or a deadline passed,
+and hedges slow downloads with the next candidate url.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.common import mkdir
+from utils.latency import LatencyStats
+from utils import tracing
+
+
+class ImageDownloader:
+    """Downloads many urls concurrently over a pooled `requests.Session`.
+
+    Attributes:
+        max_workers (int): Maximum concurrent downloads.
+        per_host (int): Maximum concurrent downloads from a single host.
+        timeout (Tuple[float, float]): (connect, read) timeouts in seconds.
+        chunk_size (int): Bytes read from the response at a time.
+        latency (LatencyStats): Duration of every successful download.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        per_host: int = 4,
+        timeout=(5, 15),
+        chunk_size: int = 64 * 1024,
+    ):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.latency = LatencyStats()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=per_host)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._hosts_lock = threading.Lock()
+        self._hosts = {}
+        # Guards the existence check + rename of downloaded files, so two
+        # identical images finishing together are stored once.
+        self._files_lock = threading.Lock()
+
+    def _host_semaphore(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    @tracing.traced("images.download")
+    def download(
+        self,
+        url: str,
+        directory: str,
+        cancel: threading.Event = None,
+        deadline: float = None,
+    ) -> Optional[str]:
+        """Downloads a single image from a url
+
+        Args:
+            url (str): url to download
+            directory (str): folder to save the image in.
+            cancel (threading.Event, optional): aborts the download when set.
+                Defaults to None.
+            deadline (float, optional): `time.monotonic()` time the download
+                is aborted at, timeouts are shortened to meet it. Defaults to
+                None.
+
+        Returns:
+            Optional[str]: path to the downloaded file, None if the download
+            failed or was aborted. A byte identical image already in
+            `directory` is not written again, its path is returned instead.
+        """
+        print(f"[INFO] Downloading from URL: {url}")
+        start = time.monotonic()
+        timeout = self.timeout
+        if deadline is not None:
+            timeout = tuple(min(t, max(0.001, deadline - start)) for t in timeout)
+        tmp_path = os.path.join(directory, f".download-{threading.get_ident()}.tmp")
+        sha = hashlib.sha1()
+        try:
+            with self._host_semaphore(url):
+                with self._session.get(url, stream=True, timeout=timeout) as res:
+                    if res.status_code != 200:
+                        print(
+                            "[INFO] Skipping downloading image, "
+                            f"got status {res.status_code}"
+                        )
+                        return None
+                    with open(tmp_path, "wb") as handler:
+                        for chunk in res.iter_content(self.chunk_size):
+                            if (cancel is not None and cancel.is_set()) or (
+                                deadline is not None and time.monotonic() > deadline
+                            ):
+                                raise _Aborted()
+                            sha.update(chunk)
+                            handler.write(chunk)
+                            tracing.add("bytes", len(chunk))
+        except (requests.RequestException, OSError, _Aborted) as e:
+            if isinstance(e, _Aborted):
+                print(f"[INFO] Cancelled downloading image: {url}")
+                tracing.add("cancelled")
+            else:
+                print(f"[INFO] Skipping downloading image, {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        path = os.path.join(directory, f"image_{sha.hexdigest()[:16]}.jpg")
+        with self._files_lock:
+            if cancel is not None and cancel.is_set():
+                os.remove(tmp_path)
+                tracing.add("cancelled")
+                return None
+            self.latency.record(time.monotonic() - start)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                print(f"[INFO] Skipping duplicate image: {url}")
+                tracing.add("duplicates")
+                return path
+            os.replace(tmp_path, path)
+        print(f"[INFO] Downloaded to: {path}")
+        return path
+
+    @tracing.traced("images.download_all")
+    def download_all(self, urls: List[str], directory: str) -> List[str]:
+        """Downloads urls concurrently
+
+        Args:
+            urls (List[str]): urls to download
+            directory (str): folder to save the images in.
+
+        Returns:
+            List[str]: paths to the downloaded files, in the order of `urls`,
+            failed downloads are left out and duplicates are listed once.
+        """
+        if len(urls) == 0:
+            return []
+
+        mkdir(directory)
+        workers = min(self.max_workers, len(urls))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            paths = list(executor.map(lambda url: self.download(url, directory), urls))
+        return list(dict.fromkeys(path for path in paths if path is not None))
+
+    @tracing.traced("images.acquire")
+    def acquire(
+        self,
+        urls: List[str],
+        directory: str,
+        target: int,
+        deadline: float = None,
+        hedge_after: float = None,
+        accept: Callable[[str], bool] = None,
+    ) -> List[str]:
+        """Downloads candidate urls, in order, until `target` images are
+        accepted. One download per missing image runs at a time, a download
+        running longer than `hedge_after` starts the next candidate alongside
+        it and failed ones are replaced. Downloads still running once the
+        target or the deadline is reached are cancelled.
+
+        Args:
+            urls (List[str]): candidate urls, best first
+            directory (str): folder to save the images in.
+            target (int): number of images wanted
+            deadline (float, optional): `time.monotonic()` time to give up
+                at, with the images accepted so far. Defaults to None.
+            hedge_after (float, optional): seconds before a download is
+                hedged, None to never hedge. Defaults to None.
+            accept (Callable[[str], bool], optional): checks every downloaded
+                file, e.g. that it decodes, in the calling thread. Rejected
+                files don't count. Defaults to accepting every file.
+
+        Returns:
+            List[str]: accepted paths, in the order they landed
+        """
+        mkdir(directory)
+        candidates = iter(urls)
+        cancel = threading.Event()
+        running = {}
+        hedged = set()
+        accepted = []
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        def start_next() -> bool:
+            url = next(candidates, None)
+            if url is None:
+                return False
+            future = executor.submit(self.download, url, directory, cancel, deadline)
+            running[future] = time.monotonic()
+            return True
+
+        try:
+            while len(accepted) < target:
+                # Hedged downloads don't count as covering a missing image
+                while (
+                    len(running) - len(hedged) < target - len(accepted)
+                    and len(running) < self.max_workers
+                    and start_next()
+                ):
+                    pass
+                if len(running) == 0:
+                    break
+
+                now = time.monotonic()
+                wake_ups = []
+                if deadline is not None:
+                    wake_ups.append(deadline)
+                if hedge_after is not None:
+                    wake_ups += [
+                        started + hedge_after
+                        for future, started in running.items()
+                        if future not in hedged
+                    ]
+                if deadline is not None and now >= deadline:
+                    tracing.add("deadline_missed")
+                    break
+                done, _ = wait(
+                    list(running),
+                    timeout=max(0, min(wake_ups) - now) if wake_ups else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    del running[future]
+                    hedged.discard(future)
+                    path = future.result()
+                    if (
+                        path is not None
+                        and len(accepted) < target
+                        and (accept is None or accept(path))
+                    ):
+                        accepted.append(path)
+
+                if hedge_after is not None:
+                    now = time.monotonic()
+                    for future, started in running.items():
+                        if future not in hedged and now - started >= hedge_after:
+                            hedged.add(future)
+                            tracing.add("hedges")
+        finally:
+            cancel.set()
+            tracing.current().set(
+                target=target, acquired=len(accepted), cancelled=len(running)
+            )
+            # Cancelled downloads stop at their next chunk, don't wait for them
+            executor.shutdown(wait=False, cancel_futures=True)
+        return accepted
+
+    def close(self) -> None:
+        self._session.close()
+
+
+class _Aborted(Exception):
+    pass
@@ -9,7 +9,12 @@ from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.options import Options
 import selenium.common.exceptions as sel_ex
 import sys
+import atexit
 import time
+import threading
+import queue
+import functools
+import contextlib
 import urllib.parse
 from retry import retry
 import argparse
@@ -107,8 +112,12 @@ def get_images(wd, start=0, n=20, out=None):
     return sources
 
 
-def google_image_search(wd, query, safe="off", n=20, opts="", out=None):
-    search_url_t = "https://www.google.com/search?safe={safe}&site=&tbm=isch&source=hp&q={q}&oq={q}&gs_l=img&tbs={opts}"
+SEARCH_URL_T = "https://www.google.com/search?safe={safe}&site=&tbm=isch&source=hp&q={q}&oq={q}&gs_l=img&tbs={opts}"
+
+
+def google_image_search(
+    wd, query, safe="off", n=20, opts="", out=None, search_url_t=SEARCH_URL_T
+):
     search_url = search_url_t.format(
         q=urllib.parse.quote(query), opts=urllib.parse.quote(opts), safe=safe
     )
@@ -117,12 +126,110 @@ def google_image_search(wd, query, safe="off", n=20, opts="", out=None):
     return sources
 
 
-def run_search(query, safe, n, otions, out=None):
+@functools.lru_cache(maxsize=None)
+def driver_path():
+    """Resolves the chrome driver binary, once per process"""
+    return ChromeDriverManager().install()
+
+
+def new_driver():
     opts = Options()
     opts.add_argument("--headless")
-    
-    with webdriver.Chrome(ChromeDriverManager().install(), options=opts) as wd:
+    return webdriver.Chrome(driver_path(), options=opts)
+
+
+class BrowserPool:
+    """Keeps warm WebDriver sessions alive across searches.
+
+    Sessions are created on demand up to `size`, handed out to one caller at a
+    time and replaced after `max_uses` searches or when the browser crashes.
+
+    Attributes:
+        size (int): Maximum number of live sessions.
+        max_uses (int): Searches served by a session before it's recycled.
+    """
+
+    def __init__(self, size=2, max_uses=50, driver_factory=new_driver):
+        self.size = size
+        self.max_uses = max_uses
+        self._driver_factory = driver_factory
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._uses = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def session(self):
+        """Borrows a session, blocking while all `size` sessions are in use"""
+        self._slots.acquire()
+        try:
+            try:
+                wd = self._idle.get_nowait()
+            except queue.Empty:
+                wd = self._driver_factory()
+                with self._lock:
+                    self._uses[wd] = 0
+
+            try:
+                yield wd
+            except sel_ex.WebDriverException:
+                logger.warning("browser session crashed, recycling it")
+                self._discard(wd)
+                raise
+            except BaseException:
+                self._release(wd)
+                raise
+            self._release(wd)
+        finally:
+            self._slots.release()
+
+    def _release(self, wd):
+        """Returns a session to the idle queue, or quits it once worn out"""
+        with self._lock:
+            self._uses[wd] += 1
+            worn_out = self._uses[wd] >= self.max_uses
+        if worn_out:
+            self._discard(wd)
+        else:
+            self._idle.put(wd)
+
+    def _discard(self, wd):
+        with self._lock:
+            self._uses.pop(wd, None)
+        try:
+            wd.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                wd = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(wd)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool():
+    """Browser pool shared by every search of this process"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = BrowserPool()
+            atexit.register(_default_pool.close)
+        return _default_pool
+
+
+def run_search(query, safe, n, otions, out=None, pool=None):
+    if pool is None:
+        pool = default_pool()
+
+    with pool.session() as wd:
         sources = google_image_search(
             wd, query, safe=safe, n=n, opts=otions, out=None
         )
-    return sources
\ No newline at end of file
+    return sources
@@ -1,10 +1,17 @@
 import os
-from typing import Tuple, List
-from PIL import Image
-from google_images_download import google_images_download
-from .google_crawl import run_search
-import requests
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Tuple, List
+from .downloader import ImageDownloader
+from .normalizer import ImageNormalizer
+from .image_index import ImageIndex, normalize_keyword
+from .phash import HammingIndex, dhash_batch, select_distinct
 from utils.common import mkdir
+from utils.latency import LatencyStats
+from utils import tracing
+
+if TYPE_CHECKING:
+    from .google_crawl import BrowserPool
 
 
 class ImageGrabber:
@@ -15,9 +22,15 @@ class ImageGrabber:
         _resize (bool): Whether to resize images after download or not.
         _size (Tuple[int, int]): Size to resize images to.
         images_count (int): number of images downloaded.
-        _memory (Dict[str, str]): Mapping between keyword to files paths.
+        _downloader_pool (ImageDownloader): Concurrent downloader shared by
+            all searches.
+        _normalizer (ImageNormalizer): Letterboxes images to `_size` as
+            separate derivatives when `_resize` is True.
+        _index (ImageIndex): Persistent mapping between keyword to images.
             this is checked before searching for a keyword to avoid multiple
             searches for the same keyword.
+        acquisition_latency (LatencyStats): Time taken to search and download
+            the images of every keyword that wasn't indexed.
     """
 
     def __init__(
@@ -26,6 +39,12 @@ class ImageGrabber:
         resize: bool = False,
         size: Tuple[int, int] = (1920, 1080),
         to_download: int = 20,
+        max_workers: int = 8,
+        per_host: int = 4,
+        browser_pool: "BrowserPool" = None,
+        deadline: float = 20.0,
+        hedge_after: float = 2.0,
+        extra_images: int = 2,
     ):
         """Initialize class variables and gid instance
         Args:
@@ -35,159 +54,252 @@ class ImageGrabber:
                 Defaults to False.
             size (Tuple[int, int], optional): Resizes images to this size if
                 resize is set to True. Defaults to (1920, 1080).
-            to_download (int): number of images to download
+            to_download (int): number of candidate urls searched per keyword,
+                and of images downloaded by search_image.
+            max_workers (int, optional): Maximum concurrent downloads.
+                Defaults to 8.
+            per_host (int, optional): Maximum concurrent downloads from a
+                single host. Defaults to 4.
+            browser_pool (BrowserPool, optional): Browser sessions used to
+                search, None to share the process wide pool. Defaults to None.
+            deadline (float, optional): Seconds to download the images of a
+                keyword in, the images downloaded by then are used. None to
+                wait for every download. Defaults to 20.0.
+            hedge_after (float, optional): Seconds after which a slow download
+                is raced by the next candidate url, None to never hedge.
+                Defaults to 2.0.
+            extra_images (int, optional): Images downloaded on top of the
+                count asked to select_images, to choose distinct images from.
+                Defaults to 2.
         """
         self._search_options = search_options
         self._resize = resize
         self._size = size
-        self._downloader = google_images_download.googleimagesdownload()
         self.download_folder = os.path.join(os.getcwd(), "downloads")
         self.images_count = 0
         self.to_download = to_download
-        self._memory = {}
-
-        # Create downloads folder if it doesn't exist and load local images
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.extra_images = extra_images
+        self.acquisition_latency = LatencyStats()
+        self._downloader_pool = ImageDownloader(max_workers, per_host)
+        self._normalizer = ImageNormalizer(size)
+        self._browser_pool = browser_pool
+        # One lock per keyword, so concurrent searches of the same keyword
+        # download it once.
+        self._keyword_locks = {}
+        self._keyword_locks_lock = threading.Lock()
+        # Keywords searched by this instance, not searched again for more
+        # images when fewer than wanted were found.
+        self._searched = set()
+
+        # Create downloads folder if it doesn't exist and open the index
         mkdir("downloads")
-        self._load_images()
+        self._index = ImageIndex(os.path.join(self.download_folder, "index.sqlite3"))
+        if self._index.created:
+            self._load_images()
 
     def _load_images(self) -> None:
-        """Tries to load local files first"""
-        local_files = {}
+        """Indexes images downloaded before the index existed, this only runs
+        once, when the index is created."""
         directory = os.path.join(os.getcwd(), "downloads")
+        print("[INFO] Indexing local images")
         for root, _, files in os.walk(directory):
             # Skip the main folder
             if root == directory:
                 continue
-            local_files[os.path.basename(root).lower()] = []
             for file in files:
-                local_files[os.path.basename(root).lower()].append(
-                    os.path.abspath(os.path.join(root, file))
-                )
-        self._memory = local_files
-
-    def _download_from_url(self, url: str, keyword: str) -> str:
-        """Downloads a single image from a url
+                # Skip partial downloads
+                if file.endswith(".tmp"):
+                    continue
+                self._index.add(os.path.basename(root), os.path.join(root, file))
+
+    def _keyword_lock(self, word: str) -> threading.Lock:
+        with self._keyword_locks_lock:
+            return self._keyword_locks.setdefault(
+                normalize_keyword(word), threading.Lock()
+            )
+
+    @tracing.traced("images.search")
+    def search_image(self, keyword: str) -> List[str]:
+        """Searches google images with the keyword given and arguments supplied to instance.
+        Does not start a new search if keyword is already searched.
 
         Args:
-            url (str): url to download
-            keyword(str): keyword searched, to create directory.
+            keyword (str): single keyword to search
+
         Returns:
-            str: path to downloaded file
+            List[str]: List of downloaded files paths, or of their normalized
+            derivatives if resize is set to True.
         """
-        self.images_count += 1
-
-        # Make keyword directory in downloads if it doesn't exist
-        mkdir(f"{self.download_folder}/{keyword}")
 
-        print(f"[INFO] Downloading from URL: {url}")
-        print(
-            "[INFO] Downloading to: "
-            + f"{self.download_folder}/"
-            + f"{keyword}/image_{self.images_count}.jpg"
-        )
-
-        # Load the image via requests
-        res = requests.get(url)
-        if res.status_code != 200:
-            print(f"[INFO] Skipping downloading image, got status {res.status_code}")
-            self.images_count -= 1
-            return None
-
-        img_data = res.content
-
-        # Save image to desk
-        with open(
-            f"{self.download_folder}/{keyword}/image_{self.images_count}.jpg",
-            "wb",
-        ) as handler:
-            handler.write(img_data)
+        word = keyword.strip()
+        tracing.current().set(keyword=word)
+        with self._keyword_lock(word):
+            paths = self._search_image(word, self.to_download)
+        return self._process_images(paths)
 
-        return f"{self.download_folder}/{keyword}/image_{self.images_count}.jpg"
-
-    def search_image(self, keyword: str) -> List[str]:
-        """Searches google images with the keyword given and arguments supplied to instance.
-        Does not start a new search if keyword is already searched.
+    @tracing.traced("images.select")
+    def select_images(self, keyword: str, count: int, seed: str = "") -> List[str]:
+        """Searches the keyword and picks `count` images that are as different
+        from each other as possible. Only the picked images are normalized.
 
         Args:
             keyword (str): single keyword to search
+            count (int): number of images to pick
+            seed (str, optional): the same seed always picks the same images.
+                Defaults to "".
 
         Returns:
-            List[str]: List of downloaded files paths
-        """
+            List[str]: picked images paths, or of their normalized derivatives
+            if resize is set to True. Images are repeated if fewer than
+            `count` were downloaded.
 
+        Raises:
+            NoImagesFound: if the keyword has no usable image
+        """
         word = keyword.strip()
+        tracing.current().set(keyword=word, count=count)
+        with self._keyword_lock(word):
+            paths = self._search_image(word, count + self.extra_images)
+            phashes = self._index.phashes(paths)
+            missing = [path for path in paths if path not in phashes]
+            if missing:
+                # Images indexed before perceptual hashes were stored
+                computed = {
+                    path: value
+                    for path, value in zip(missing, dhash_batch(missing))
+                    if value is not None
+                }
+                self._index.set_phashes(computed)
+                phashes.update(computed)
+
+        candidates = [path for path in paths if path in phashes]
+        if len(candidates) == 0:
+            raise NoImagesFound(f"No usable image was found for keyword: {word}")
+        picked = [
+            candidates[idx]
+            for idx in select_distinct(
+                [phashes[path] for path in candidates], count, seed
+            )
+        ]
+        usable = set(self._process_images(sorted(set(picked))))
+        if not self._resize:
+            return [path for path in picked if path in usable]
+        return [
+            self._normalizer.derivative_path(path)
+            for path in picked
+            if self._normalizer.derivative_path(path) in usable
+        ]
 
-        # Return images paths if it already exists
-        if word.lower() in self._memory:
-            return self._memory[word.lower()]
-
-        print(f"[INFO] Downloading images for keyword: {word}")
-        # Scrape google images search to get urls of images
-        urls = run_search(word, "off", self.to_download, self._search_options)
+    def _search_image(self, word: str, target: int) -> List[str]:
+        """Returns the original images of a keyword, searching and downloading
+        images until `target` are indexed, or the deadline passed, if the
+        keyword has fewer. Called with the keyword's lock held."""
 
-        # Download the images and add the path to list
-        paths = []
-        for url in urls:
-            path = self._download_from_url(url, word)
-            if path is not None:
-                paths.append(path)
+        # Return images paths if enough already exist
+        paths = self._index.images(word) or []
+        if len(paths) >= target or normalize_keyword(word) in self._searched:
+            tracing.add("cache_hits")
+            return paths
 
-        # Save keyword and paths to memory
-        self._memory[word] = paths
+        print(f"[INFO] Downloading images for keyword: {word}")
+        start = time.monotonic()
+        # Scrape google images search to get urls of images, selenium is only
+        # loaded once a keyword actually has to be searched.
+        from .google_crawl import run_search
+
+        with tracing.span("images.scrape"):
+            urls = run_search(
+                word,
+                "off",
+                self.to_download,
+                self._search_options,
+                pool=self._browser_pool,
+            )
+        self._searched.add(normalize_keyword(word))
+
+        # Download until enough distinct images landed
+        deadline = None
+        if self.deadline is not None:
+            deadline = time.monotonic() + self.deadline
+        acquired = self._downloader_pool.acquire(
+            urls,
+            f"{self.download_folder}/{word}",
+            target - len(paths),
+            deadline=deadline,
+            hedge_after=self.hedge_after,
+            accept=self._acceptor(word, paths),
+        )
+        self.acquisition_latency.record(time.monotonic() - start)
+        self.images_count += len(acquired)
+        return paths + [os.path.abspath(path) for path in acquired]
 
-        # Process images
-        if self._resize and len(paths) > 0:
-            directory = os.path.dirname(os.path.abspath(paths[0]))
-            self._resize_images(self._size, directory)
+    def _acceptor(self, word: str, paths: List[str]) -> Callable[[str], bool]:
+        """Returns a check of downloaded images for `ImageDownloader.acquire`.
+        It deletes images that are the same picture as an earlier one (e.g.
+        another resolution from another host) or can't be decoded, and
+        indexes the others with their perceptual hash.
 
-        return paths
+        Args:
+            word (str): keyword the images are downloaded for
+            paths (List[str]): images already indexed for the keyword
 
-    def _resize_images(self, size: Tuple[int, int], directory: str) -> None:
-        """resizes all images inside a directory to the given size
+        Returns:
+            Callable[[str], bool]: True for images to keep
+        """
+        seen = HammingIndex()
+        for phash in self._index.phashes(paths).values():
+            seen.add(phash)
+        kept = set(paths)
+
+        def accept(path: str) -> bool:
+            # Byte identical to a kept image, the file is the kept one
+            if os.path.abspath(path) in kept:
+                return False
+            phash = dhash_batch([path])[0]
+            if phash is None or seen.near(phash):
+                print(f"[INFO] Dropped duplicate or broken image: {path}")
+                tracing.add("dropped")
+                os.remove(path)
+                return False
+            seen.add(phash)
+            kept.add(os.path.abspath(path))
+            self._index.add(word, path, phash=phash)
+            return True
+
+        return accept
+
+    def latency_stats(self) -> Dict[str, Dict[str, float]]:
+        """p50/p99 latencies of keyword acquisitions and single downloads"""
+        return {
+            "keyword": self.acquisition_latency.summary(),
+            "download": self._downloader_pool.latency.summary(),
+        }
+
+    def _process_images(self, paths: List[str]) -> List[str]:
+        """Normalizes images if resize is enabled, only images without an up
+        to date derivative are processed.
 
         Args:
-            size (Tuple[int, int]): a 2-tuple for the desired size
-            directory (str): path to directory, relative or absolute
+            paths (List[str]): original images paths
+
+        Returns:
+            List[str]: paths of the images to use in the video
         """
+        if not self._resize or len(paths) == 0:
+            return paths
+        derivatives = self._normalizer.normalize(paths)
+        normalized = set(derivatives)
+        self._index.mark_normalized(
+            [p for p in paths if self._normalizer.derivative_path(p) in normalized],
+            f"{self._size[0]}x{self._size[1]}",
+        )
+        return derivatives
 
-        # Get only files from that directory
-        files = [
-            os.path.join(directory, f)
-            for f in os.listdir(directory)
-            if os.path.isfile(os.path.join(directory, f))
-        ]
 
-        for file in files:
-            # Create a new black image with specified size as background
-            background = Image.new("RGB", size)
-            im = Image.open(file)
-
-            # convert image mode to RGB
-            if im.mode != "RGB":
-                im = im.convert("RGB")
-
-            # Resize image
-            # TODO fix this
-            wr = size[0] / im.width
-            hr = size[1] / im.height
-
-            if wr > hr:
-                nw = (im.width) * hr
-                im = im.resize((int(nw), size[1]), Image.ANTIALIAS)
-            else:
-                nh = (im.height) * wr
-                im = im.resize((size[0], int(nh)), Image.ANTIALIAS)
-
-            # Add the image to the background centered
-            x = (size[0] - im.width) // 2
-            y = (size[1] - im.height) // 2
-            background.paste(im, (x, y))
-
-            # To avoid saved WEBP images, which don't work with MoviePy.
-            if im.format == "WEBP":
-                background.save(file + ".jpg", "JPEG")
-            else:
-                background.save(file, "JPEG")
+class NoImagesFound(Exception):
+    pass
 
 
 def main():
@@ -0,0 +1,177 @@
+"""Persistent index of downloaded images.
+Maps normalized keywords to image records (path, content hash, perceptual
+hash, dimensions, format and normalization status) in a SQLite database, so
+looking up a keyword is an indexed query instead of a walk over the downloads
+folder.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+
+def normalize_keyword(keyword: str) -> str:
+    """Lowercases a keyword and collapses its whitespace"""
+    return " ".join(keyword.lower().split())
+
+
+def file_sha1(path: str) -> str:
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ImageIndex:
+    """SQLite backed keyword -> images index, safe to share between threads.
+
+    Attributes:
+        path (str): Database file path.
+        created (bool): True if the database didn't exist before.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS images (
+            keyword TEXT NOT NULL,
+            path TEXT NOT NULL,
+            sha1 TEXT,
+            width INTEGER,
+            height INTEGER,
+            format TEXT,
+            normalized TEXT,
+            phash TEXT,
+            PRIMARY KEY (keyword, path)
+        );
+        CREATE INDEX IF NOT EXISTS images_path ON images (path);
+        DROP INDEX IF EXISTS images_sha1;
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.created = not os.path.exists(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.executescript(ImageIndex.SCHEMA)
+            columns = [
+                row["name"] for row in self._db.execute("PRAGMA table_info(images)")
+            ]
+            # Indexes created before perceptual hashes were stored
+            if "phash" not in columns:
+                self._db.execute("ALTER TABLE images ADD COLUMN phash TEXT")
+
+    def add(
+        self, keyword: str, path: str, sha1: str = None, phash: int = None
+    ) -> Dict:
+        """Indexes an image file under a keyword
+
+        Args:
+            keyword (str): keyword the image was found for
+            path (str): image file path
+            sha1 (str, optional): content hash, computed if None.
+            phash (int, optional): perceptual hash, see images_utils.phash.
+
+        Returns:
+            Dict: the stored record
+        """
+        record = {
+            "keyword": normalize_keyword(keyword),
+            "path": os.path.abspath(path),
+            "sha1": sha1 or file_sha1(path),
+            "width": None,
+            "height": None,
+            "format": None,
+            "phash": None if phash is None else f"{phash:016x}",
+        }
+        try:
+            # Only reads the header, the image isn't decoded
+            with Image.open(path) as im:
+                record["width"], record["height"] = im.size
+                record["format"] = im.format
+        except OSError:
+            pass
+
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images "
+                "(keyword, path, sha1, width, height, format, normalized, phash) "
+                "VALUES (:keyword, :path, :sha1, :width, :height, :format, NULL, "
+                ":phash)",
+                record,
+            )
+        return record
+
+    def records(self, keyword: str) -> List[Dict]:
+        """Returns the records of a keyword, in insertion order"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM images WHERE keyword = ? ORDER BY rowid",
+                (normalize_keyword(keyword),),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def images(self, keyword: str) -> Optional[List[str]]:
+        """Returns the image paths of a keyword, dropping files that were
+        deleted from disk.
+
+        Args:
+            keyword (str): keyword to look up
+
+        Returns:
+            Optional[List[str]]: image paths, None if the keyword was never
+            indexed or all of its files are gone.
+        """
+        paths = [record["path"] for record in self.records(keyword)]
+        if len(paths) == 0:
+            return None
+        missing = [path for path in paths if not os.path.isfile(path)]
+        if missing:
+            self.remove(missing)
+            paths = [path for path in paths if path not in missing]
+        return paths or None
+
+    def remove(self, paths: List[str]) -> None:
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM images WHERE path = ?", [(path,) for path in paths]
+            )
+
+    def mark_normalized(self, paths: List[str], size: str) -> None:
+        """Records that images have a derivative of the given size, e.g. 1920x1080"""
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE images SET normalized = ? WHERE path = ?",
+                [(size, os.path.abspath(path)) for path in paths],
+            )
+
+    def phashes(self, paths: List[str]) -> Dict[str, int]:
+        """Returns the stored perceptual hashes of images, images without one
+        are left out."""
+        paths = [os.path.abspath(path) for path in paths]
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, phash FROM images WHERE phash IS NOT NULL "
+                f"AND path IN ({', '.join('?' * len(paths))})",
+                paths,
+            ).fetchall()
+        return {row["path"]: int(row["phash"], 16) for row in rows}
+
+    def set_phashes(self, phashes: Dict[str, int]) -> None:
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE images SET phash = ? WHERE path = ?",
+                [
+                    (f"{value:016x}", os.path.abspath(path))
+                    for path, value in phashes.items()
+                ],
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,166 @@
+"""Image normalization stage.
+Letterboxes downloaded images to the video size as separate JPEG derivatives,
+leaving the originals untouched. Only images without an up to date derivative
+are processed, large JPEGs are decoded at a reduced scale and the work is
+spread over a process pool.
+"""
+
+import os
+import threading
+from typing import List, Tuple
+
+from PIL import Image
+
+from utils.common import mkdir, process_pool
+from utils import tracing
+
+
+@tracing.traced("images.normalize_one")
+def normalize_image(source: str, destination: str, size: Tuple[int, int]) -> str:
+    """Letterboxes a single image to `size` on a black background.
+    This is a module level function so it can be used as a process pool task.
+
+    Args:
+        source (str): path of the original image
+        destination (str): path of the JPEG derivative to write
+        size (Tuple[int, int]): a 2-tuple for the desired size
+
+    Returns:
+        str: destination path
+    """
+    with Image.open(source) as im:
+        ratio = min(size[0] / im.width, size[1] / im.height)
+        fit = (max(1, int(im.width * ratio)), max(1, int(im.height * ratio)))
+
+        # Let the JPEG decoder downscale by up to 8x while decoding, which is
+        # much cheaper than decoding the full resolution then resizing.
+        im.draft("RGB", fit)
+
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        im = im.resize(fit, Image.LANCZOS)
+
+    background = Image.new("RGB", size)
+    background.paste(im, ((size[0] - fit[0]) // 2, (size[1] - fit[1]) // 2))
+
+    # Write next to the destination then rename, so an interrupted run never
+    # leaves a truncated derivative that looks up to date. Every writer has
+    # its own temp file, segments sharing a keyword may normalize the same
+    # image at once.
+    tmp_path = f"{destination}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        background.save(tmp_path, "JPEG", quality=90)
+        os.replace(tmp_path, destination)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return destination
+
+
+class ImageNormalizer:
+    """Keeps normalized derivatives of images in sync with their originals.
+
+    Attributes:
+        size (Tuple[int, int]): Size derivatives are letterboxed to.
+        output (str): Root folder of the derivatives, one sub folder per size.
+        max_workers (int): Number of normalizing processes.
+        min_parallel (int): Below this many pending images, images are
+            normalized in this process instead of the pool.
+    """
+
+    def __init__(
+        self,
+        size: Tuple[int, int] = (1920, 1080),
+        output: str = None,
+        max_workers: int = None,
+        min_parallel: int = 4,
+    ):
+        self.size = size
+        self.output = output
+        if self.output is None:
+            self.output = os.path.join(os.getcwd(), "normalized")
+        self.output = os.path.join(self.output, f"{size[0]}x{size[1]}")
+        self.max_workers = max_workers
+        self.min_parallel = min_parallel
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def derivative_path(self, source: str) -> str:
+        """Returns the derivative path of an original image
+
+        Args:
+            source (str): path of the original image
+
+        Returns:
+            str: path of its normalized JPEG
+        """
+        keyword = os.path.basename(os.path.dirname(os.path.abspath(source)))
+        name = os.path.splitext(os.path.basename(source))[0]
+        return os.path.join(self.output, keyword, name + ".jpg")
+
+    def is_normalized(self, source: str) -> bool:
+        """Whether a derivative exists and is newer than its original"""
+        destination = self.derivative_path(source)
+        try:
+            return os.path.getmtime(destination) >= os.path.getmtime(source)
+        except OSError:
+            return False
+
+    @tracing.traced("images.normalize")
+    def normalize(self, sources: List[str]) -> List[str]:
+        """Normalizes images that don't have an up to date derivative yet
+
+        Args:
+            sources (List[str]): paths of original images
+
+        Returns:
+            List[str]: derivative paths, in the order of `sources`. Images
+            that couldn't be decoded are left out.
+        """
+        pending = [source for source in sources if not self.is_normalized(source)]
+        failed = set()
+        tracing.current().set(images=len(sources), pending=len(pending))
+
+        if len(pending) > 0:
+            print(f"[INFO] Normalizing {len(pending)} images")
+            for source in pending:
+                mkdir(os.path.dirname(self.derivative_path(source)))
+
+            if len(pending) < self.min_parallel:
+                results = [self._try_normalize(source) for source in pending]
+            else:
+                with self._executor_lock:
+                    if self._executor is None:
+                        self._executor = process_pool(max_workers=self.max_workers)
+                futures = [
+                    self._executor.submit(
+                        normalize_image, source, self.derivative_path(source), self.size
+                    )
+                    for source in pending
+                ]
+                results = []
+                for source, future in zip(pending, futures):
+                    try:
+                        results.append(future.result())
+                    except OSError as e:
+                        print(f"[INFO] Skipping image {source}, {e}")
+                        results.append(None)
+            failed = {
+                source for source, result in zip(pending, results) if result is None
+            }
+
+        return [
+            self.derivative_path(source) for source in sources if source not in failed
+        ]
+
+    def _try_normalize(self, source: str) -> str:
+        try:
+            return normalize_image(source, self.derivative_path(source), self.size)
+        except OSError as e:
+            print(f"[INFO] Skipping image {source}, {e}")
+            return None
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,141 @@
+"""Perceptual hashing of images.
+dHash compares neighbouring pixels of a tiny grayscale version of an image,
+so the same picture at a different resolution, compression or host gets the
+same (or a very close) 64 bit hash. Hashes are compared by Hamming distance.
+"""
+
+import random
+from typing import List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+
+# Images closer than this many differing bits are considered the same picture
+DUPLICATE_DISTANCE = 6
+
+
+def _thumbnail(path: str) -> Optional[np.ndarray]:
+    """Decodes an image to a (HASH_SIZE, HASH_SIZE + 1) grayscale array"""
+    size = (HASH_SIZE + 1, HASH_SIZE)
+    try:
+        with Image.open(path) as im:
+            # Reduced JPEG decoding, the hash only needs a handful of pixels
+            im.draft("L", (size[0] * 8, size[1] * 8))
+            return np.asarray(im.convert("L").resize(size, Image.BILINEAR))
+    except OSError:
+        return None
+
+
+def dhash_batch(paths: Sequence[str]) -> List[Optional[int]]:
+    """Computes the dHash of many images
+
+    Args:
+        paths (Sequence[str]): image paths
+
+    Returns:
+        List[Optional[int]]: 64 bit hashes, None for images that can't be
+        decoded.
+    """
+    thumbnails = [_thumbnail(path) for path in paths]
+    valid = [idx for idx, t in enumerate(thumbnails) if t is not None]
+    hashes = [None] * len(paths)
+    if len(valid) == 0:
+        return hashes
+
+    pixels = np.stack([thumbnails[idx] for idx in valid]).astype(np.int16)
+    # (N, 8, 8) booleans, one per pair of horizontal neighbours
+    bits = (pixels[:, :, 1:] > pixels[:, :, :-1]).reshape(len(valid), -1)
+    packed = np.packbits(bits, axis=1).view(">u8").ravel()
+    for idx, value in zip(valid, packed):
+        hashes[idx] = int(value)
+    return hashes
+
+
+def hamming(hash_value: int, others: np.ndarray) -> np.ndarray:
+    """Hamming distances between one hash and an array of uint64 hashes"""
+    xor = np.bitwise_xor(others, np.uint64(hash_value))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class HammingIndex:
+    """Finds hashes within `radius` bits of a query without scanning them all.
+
+    The 64 bits are split in `radius + 1` bands. Two hashes within `radius`
+    bits of each other have at least one identical band (pigeonhole), so only
+    hashes sharing a band with the query are compared.
+
+    Attributes:
+        radius (int): Maximum distance of a match.
+    """
+
+    def __init__(self, radius: int = DUPLICATE_DISTANCE):
+        self.radius = radius
+        bands = radius + 1
+        bounds = [round(i * 64 / bands) for i in range(bands + 1)]
+        self._bands = list(zip(bounds[:-1], bounds[1:]))
+        self._tables = [{} for _ in self._bands]
+        self._hashes = []
+
+    def _keys(self, hash_value: int):
+        for start, end in self._bands:
+            yield (hash_value >> start) & ((1 << (end - start)) - 1)
+
+    def add(self, hash_value: int) -> None:
+        position = len(self._hashes)
+        self._hashes.append(hash_value)
+        for table, key in zip(self._tables, self._keys(hash_value)):
+            table.setdefault(key, []).append(position)
+
+    def near(self, hash_value: int) -> List[int]:
+        """Returns the indexed hashes within `radius` bits of `hash_value`"""
+        candidates = set()
+        for table, key in zip(self._tables, self._keys(hash_value)):
+            candidates.update(table.get(key, ()))
+        return [
+            self._hashes[position]
+            for position in candidates
+            if bin(self._hashes[position] ^ hash_value).count("1") <= self.radius
+        ]
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+def select_distinct(hashes: List[int], count: int, seed: str = "") -> List[int]:
+    """Picks `count` images as different from each other as possible, by
+    greedy farthest point selection on Hamming distances.
+
+    Args:
+        hashes (List[int]): hash of every candidate image
+        count (int): number of images to pick
+        seed (str, optional): seeds the choice of the first image, the same
+            seed and hashes always give the same selection. Defaults to "".
+
+    Returns:
+        List[int]: positions in `hashes` of the picked images. If there are
+        fewer candidates than `count`, images are repeated in order.
+    """
+    if len(hashes) == 0 or count <= 0:
+        return []
+
+    values = np.array(hashes, dtype=np.uint64)
+    selected = [random.Random(seed).randrange(len(hashes))]
+    closest = hamming(hashes[selected[0]], values)
+    while len(selected) < min(count, len(hashes)):
+        # Candidate farthest from everything selected so far, ties broken by
+        # position so the selection is deterministic.
+        candidate = int(np.argmax(closest))
+        if closest[candidate] == 0:
+            # Everything left is identical to a selected image
+            break
+        selected.append(candidate)
+        closest = np.minimum(closest, hamming(hashes[candidate], values))
+
+    # Not enough images, show the selected ones again rather than failing
+    repeated = list(selected)
+    while len(repeated) < count:
+        repeated.append(selected[len(repeated) % len(selected)])
+    return repeated
+
@@ -1,14 +1,8 @@
-from TextToVideo import TextToVideo
+"""Kept for backwards compatibility, use `python cli.py render` instead."""
 
+import sys
 
-def main():
-    with open("test_script.txt", "r") as f:
-        text = f.read()
-    text = text.replace("\n", " ")
-    ttv = TextToVideo(text, "anime.mp4")
-    ttv.generate_video()
-    ttv.save_video()
-
+from cli import main
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main(["render", "test_script.txt", "-o", "anime.mp4"]))
\ No newline at end of file
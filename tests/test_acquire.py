@@ -0,0 +1,151 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from benchmarks.fake_images import FakeImageServer
+from images_utils.downloader import ImageDownloader
+from images_utils.image_grabber import ImageGrabber
+
+
+class AcquireTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeImageServer(images=12, latency=4.0, hang=30.0)
+        self.server.__enter__()
+        self.directory = tempfile.TemporaryDirectory()
+        # Every fake url has the same host
+        self.downloader = ImageDownloader(max_workers=8, per_host=8)
+
+    def tearDown(self):
+        self.downloader.close()
+        self.server.__exit__(None, None, None)
+        self.directory.cleanup()
+
+    def content(self, path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    def served(self, number: int) -> bytes:
+        return self.server._images[number]
+
+
+class AcquireTest(AcquireTestCase):
+    def test_stops_at_target(self):
+        urls = [self.server.url("fast", idx) for idx in range(10)]
+
+        paths = self.downloader.acquire(urls, self.directory.name, 3)
+
+        self.assertEqual(len(paths), 3)
+        # One download per missing image, nothing past the target
+        self.assertEqual(self.server.requests_count, 3)
+
+    def test_failed_and_rejected_downloads_are_replaced(self):
+        urls = [
+            self.server.url("fail", 0),
+            self.server.url("corrupt", 1),
+            self.server.url("fast", 2),
+            self.server.url("fast", 3),
+        ]
+
+        def decodes(path: str) -> bool:
+            return self.content(path)[:2] == b"\xff\xd8"
+
+        paths = self.downloader.acquire(urls, self.directory.name, 2, accept=decodes)
+
+        self.assertEqual(
+            sorted(self.content(path) for path in paths),
+            sorted([self.served(2), self.served(3)]),
+        )
+
+    def test_results_in_landing_order(self):
+        urls = [self.server.url("slow", 0), self.server.url("fast", 1)]
+
+        paths = self.downloader.acquire(urls, self.directory.name, 2)
+
+        self.assertEqual(
+            [self.content(path) for path in paths], [self.served(1), self.served(0)]
+        )
+
+    def test_deadline_returns_what_landed(self):
+        urls = [self.server.url("fast", 0)] + [
+            self.server.url("hang", idx) for idx in range(1, 4)
+        ]
+        start = time.monotonic()
+
+        paths = self.downloader.acquire(
+            urls, self.directory.name, 3, deadline=start + 1.0
+        )
+
+        self.assertLess(time.monotonic() - start, 3.0)
+        self.assertEqual([self.content(path) for path in paths], [self.served(0)])
+
+    def test_hedge_fires_after_delay(self):
+        urls = [self.server.url("hang", 0), self.server.url("fast", 1)]
+        start = time.monotonic()
+
+        paths = self.downloader.acquire(urls, self.directory.name, 1, hedge_after=2.0)
+
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 2.0)
+        self.assertLess(elapsed, 4.0)
+        self.assertEqual([self.content(path) for path in paths], [self.served(1)])
+
+    def test_no_hedge_before_delay(self):
+        urls = [self.server.url("fast", 0), self.server.url("fast", 1)]
+
+        paths = self.downloader.acquire(urls, self.directory.name, 1, hedge_after=2.0)
+
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(self.server.requests_count, 1)
+
+    def test_losers_are_cancelled(self):
+        urls = [self.server.url("hang", 0), self.server.url("fast", 1)]
+        # Small chunks, so the trickling download checks for cancellation often
+        self.downloader.chunk_size = 1024
+
+        self.downloader.acquire(urls, self.directory.name, 1, hedge_after=0.5)
+
+        # The hanging download stops at its next chunk and leaves no file
+        time.sleep(2.0)
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+
+
+class ImageGrabberAcquireTest(AcquireTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super().tearDown()
+
+    def test_downloads_count_plus_extra_images(self):
+        urls = [self.server.url("fast", idx) for idx in range(12)]
+        gid = ImageGrabber(per_host=8, extra_images=2, hedge_after=None)
+
+        with mock.patch("images_utils.google_crawl.run_search", return_value=urls):
+            images = gid.select_images("cats", 3)
+
+        self.assertEqual(len(images), 3)
+        self.assertEqual(gid.images_count, 5)
+        self.assertEqual(self.server.requests_count, 5)
+        self.assertEqual(gid.latency_stats()["download"]["count"], 5)
+
+    def test_keyword_is_not_searched_again(self):
+        urls = [self.server.url("fast", idx) for idx in range(12)]
+        gid = ImageGrabber(per_host=8, extra_images=2, hedge_after=None)
+
+        with mock.patch(
+            "images_utils.google_crawl.run_search", return_value=urls
+        ) as search:
+            gid.select_images("cats", 3)
+            gid.select_images("Cats ", 2)
+
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(self.server.requests_count, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from audio_utils.cache import AudioCache
+
+
+class AudioCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = os.path.join(self.directory.name, AudioCache.INDEX_FILE)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def cache(self, max_bytes=None) -> AudioCache:
+        return AudioCache(self.directory.name, max_bytes=max_bytes)
+
+    def test_index_is_saved_by_flush_only(self):
+        cache = self.cache()
+
+        cache.put("a", bytes(10), 1.0)
+        self.assertFalse(os.path.exists(self.index))
+        cache.flush()
+        saved = os.path.getmtime(self.index)
+
+        self.assertEqual(self.cache().get("a")[1], 1.0)
+        os.utime(self.index, (saved - 10, saved - 10))
+        cache.get("a")
+        self.assertEqual(os.path.getmtime(self.index), saved - 10)
+
+    def test_flush_keeps_entries_of_other_processes(self):
+        first = self.cache()
+        second = self.cache()
+
+        first.put("a", bytes(10), 1.0)
+        second.put("b", bytes(10), 2.0)
+        first.flush()
+        second.flush()
+
+        cache = self.cache()
+        self.assertEqual(cache.get("a")[1], 1.0)
+        self.assertEqual(cache.get("b")[1], 2.0)
+
+    def test_entries_of_other_processes_count_towards_max_bytes(self):
+        first = self.cache(max_bytes=150)
+        second = self.cache(max_bytes=150)
+
+        first.put("a", bytes(100), 1.0)
+        first.flush()
+        second.put("b", bytes(100), 2.0)
+        second.flush()
+
+        cache = self.cache()
+        self.assertEqual(cache.stats()["entries"], 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+
+    def test_entries_evicted_elsewhere_are_dropped(self):
+        first = self.cache()
+        second = self.cache()
+        path = first.put("a", bytes(10), 1.0)
+        first.flush()
+        second.get("a")
+
+        os.remove(path)
+        second.flush()
+
+        self.assertEqual(self.cache().stats()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
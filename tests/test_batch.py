@@ -0,0 +1,68 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from batch import BatchRunner
+
+
+class FakeTextToVideo:
+    """Records render_video calls and writes an empty output video"""
+
+    calls = []
+    lock = threading.Lock()
+
+    def __init__(self, text, output, tts=None, gid=None):
+        self.output = output
+        self.duration = 1.0
+
+    def render_video(self, **kwargs):
+        with FakeTextToVideo.lock:
+            FakeTextToVideo.calls.append(("render", self.output, kwargs))
+        with open(os.path.join("output", self.output), "wb"):
+            pass
+
+
+class BatchPruneTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        os.mkdir("output")
+        FakeTextToVideo.calls = []
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def jobs(self, count: int):
+        jobs = []
+        for idx in range(count):
+            script = os.path.join(self.directory.name, f"script{idx}.txt")
+            with open(script, "w", encoding="utf-8") as f:
+                f.write("[IMAGE: cats] Some text.")
+            jobs.append({"script": script, "output": f"video{idx}.mp4"})
+        return jobs
+
+    def test_segment_cache_is_pruned_once_after_every_job(self):
+        def prune(cache, keep=()):
+            FakeTextToVideo.calls.append(("prune", None, {}))
+
+        runner = BatchRunner(
+            "state.json", jobs=2, workers=1, tts=object(), gid=object()
+        )
+        with mock.patch("batch.TextToVideo", FakeTextToVideo), mock.patch(
+            "batch.SegmentCache.prune", prune
+        ):
+            self.assertTrue(runner.run(self.jobs(3)))
+
+        renders = [call for call in FakeTextToVideo.calls if call[0] == "render"]
+        self.assertEqual(len(renders), 3)
+        self.assertTrue(all(kwargs["prune"] is False for _, _, kwargs in renders))
+        self.assertEqual(FakeTextToVideo.calls[-1][0], "prune")
+        self.assertEqual(len(FakeTextToVideo.calls), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import threading
+import time
+import unittest
+
+import selenium.common.exceptions as sel_ex
+
+from images_utils.google_crawl import BrowserPool
+
+
+class FakeDriver:
+    """Stands in for a WebDriver session"""
+
+    def __init__(self):
+        self.quit_count = 0
+
+    def quit(self):
+        self.quit_count += 1
+
+
+class BrowserPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.drivers = []
+        self._lock = threading.Lock()
+
+    def factory(self) -> FakeDriver:
+        driver = FakeDriver()
+        with self._lock:
+            self.drivers.append(driver)
+        return driver
+
+    def test_sessions_are_reused(self):
+        pool = BrowserPool(size=2, max_uses=50, driver_factory=self.factory)
+
+        for _ in range(5):
+            with pool.session():
+                pass
+
+        self.assertEqual(len(self.drivers), 1)
+        self.assertEqual(self.drivers[0].quit_count, 0)
+
+    def test_session_recycled_after_max_uses(self):
+        pool = BrowserPool(size=1, max_uses=2, driver_factory=self.factory)
+
+        for _ in range(5):
+            with pool.session():
+                pass
+
+        self.assertEqual(len(self.drivers), 3)
+        self.assertEqual([driver.quit_count for driver in self.drivers], [1, 1, 0])
+
+    def test_crashed_session_is_replaced(self):
+        pool = BrowserPool(size=1, driver_factory=self.factory)
+
+        with self.assertRaises(sel_ex.WebDriverException):
+            with pool.session():
+                raise sel_ex.WebDriverException("browser crashed")
+        with pool.session() as driver:
+            pass
+
+        self.assertEqual(len(self.drivers), 2)
+        self.assertEqual(self.drivers[0].quit_count, 1)
+        self.assertIs(driver, self.drivers[1])
+
+    def test_other_errors_keep_the_session(self):
+        pool = BrowserPool(size=1, driver_factory=self.factory)
+
+        with self.assertRaises(KeyError):
+            with pool.session():
+                raise KeyError("no large image")
+        with pool.session():
+            pass
+
+        self.assertEqual(len(self.drivers), 1)
+
+    def test_concurrent_sessions_bounded_by_size(self):
+        pool = BrowserPool(size=2, driver_factory=self.factory)
+        active = [0, 0]
+        lock = threading.Lock()
+
+        def search():
+            with pool.session():
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active[1], active[0])
+                time.sleep(0.05)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=search) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(active[1], 2)
+        self.assertEqual(len(self.drivers), 2)
+
+    def test_close_quits_idle_sessions(self):
+        pool = BrowserPool(size=2, driver_factory=self.factory)
+        with pool.session():
+            pass
+
+        pool.close()
+
+        self.assertEqual(self.drivers[0].quit_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
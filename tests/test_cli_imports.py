@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "test_script.txt")
+
+HEAVY_MODULES = [
+    "moviepy",
+    "selenium",
+    "webdriver_manager",
+    "google",
+    "google_images_download",
+    "PIL",
+    "numpy",
+    "requests",
+]
+
+CHECK = """
+import sys
+from cli import main
+code = main({argv!r})
+heavy = sorted({{m.split(".")[0] for m in sys.modules}} & set({heavy!r}))
+print("CODE:" + str(code))
+print("HEAVY:" + ",".join(heavy))
+"""
+
+
+def run_cli(argv):
+    """Runs the CLI in a fresh interpreter, returns its exit code and the
+    heavy modules it imported"""
+    process = subprocess.run(
+        [sys.executable, "-c", CHECK.format(argv=argv, heavy=HEAVY_MODULES)],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if process.returncode != 0:
+        raise AssertionError(process.stderr)
+    lines = process.stdout.strip().splitlines()
+    code = int(lines[-2][len("CODE:") :])
+    heavy = [name for name in lines[-1][len("HEAVY:") :].split(",") if name]
+    return code, heavy
+
+
+class CLIImportsTest(unittest.TestCase):
+    def test_plan_imports_no_heavy_module(self):
+        code, heavy = run_cli(["plan", SCRIPT])
+
+        self.assertEqual(code, 0)
+        self.assertEqual(heavy, [])
+
+    def test_validate_imports_no_heavy_module(self):
+        code, heavy = run_cli(["validate", SCRIPT])
+
+        self.assertEqual(code, 0)
+        self.assertEqual(heavy, [])
+
+    def test_render_rejects_unknown_voice_before_rendering(self):
+        with tempfile.TemporaryDirectory() as directory:
+            script = os.path.join(directory, "script.txt")
+            with open(script, "w", encoding="utf-8") as f:
+                f.write("[IMAGE: cats 2] Some text [VOICE: Z]in a voice[/VOICE]")
+
+            code, heavy = run_cli(["render", script])
+
+        self.assertEqual(code, 1)
+        self.assertEqual(heavy, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.fakes import make_images, make_script
+from TextToVideo import TextToVideo
+from video_utils.profiles import get_profile
+
+
+class JoinRenditionTest(unittest.TestCase):
+    def setUp(self):
+        # TextToVideo creates its output and cache folders in the working
+        # directory
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        self.ttv = TextToVideo(
+            make_script(3, 1), "video.mp4", tts=object(), gid=object()
+        )
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def set_images(self, *sizes):
+        for idx, (segment, size) in enumerate(
+            zip(self.ttv._text_processor.video_segments, sizes)
+        ):
+            segment.images = make_images("corpus", 2, size, seed=idx)
+
+    def test_same_sizes_are_stream_copied(self):
+        self.set_images((640, 360), (640, 360), (640, 360))
+
+        self.assertIsNone(self.ttv._join_rendition(24, None, None, None))
+
+    def test_different_sizes_are_reencoded_to_the_largest(self):
+        self.set_images((640, 360), (480, 360), (640, 480))
+
+        rendition = self.ttv._join_rendition(24, None, "veryfast", None)
+
+        self.assertEqual(rendition.size, (640, 480))
+        self.assertEqual(rendition.fps, 24)
+        self.assertEqual(rendition.preset, "veryfast")
+
+    def test_different_widths_at_a_fixed_height(self):
+        self.set_images((640, 360), (480, 360), (640, 360))
+
+        rendition = self.ttv._join_rendition(12, 180, None, get_profile("small"))
+
+        self.assertEqual(rendition.size, (320, 180))
+        self.assertEqual(rendition.crf, get_profile("small").crf)
+
+
+if __name__ == "__main__":
+    unittest.main()
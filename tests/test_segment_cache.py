@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+from video_utils.segment_cache import SegmentCache
+
+
+class SegmentCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = SegmentCache(self.directory.name, max_bytes=250)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def store(self, fingerprint: str, size: int, used: float) -> str:
+        path = self.cache.path(fingerprint)
+        with open(path, "wb") as f:
+            f.write(bytes(size))
+        os.utime(path, (used, used))
+        return path
+
+    def test_prune_deletes_least_recently_used(self):
+        oldest = self.store("a", 100, 1000)
+        older = self.store("b", 100, 2000)
+        newest = self.store("c", 100, 3000)
+
+        self.cache.prune()
+
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(older))
+        self.assertTrue(os.path.exists(newest))
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_hit_makes_entry_recent(self):
+        first = self.store("a", 100, 1000)
+        second = self.store("b", 100, 2000)
+        self.store("c", 100, 3000)
+
+        self.assertEqual(self.cache.get("a"), first)
+        self.cache.prune()
+
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+
+    def test_prune_keeps_given_paths(self):
+        oldest = self.store("a", 100, 1000)
+        older = self.store("b", 100, 2000)
+        self.store("c", 100, 3000)
+
+        self.cache.prune(keep=[oldest])
+
+        self.assertTrue(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(older))
+
+    def test_prune_ignores_segments_being_rendered(self):
+        self.store("a", 300, 1000)
+        partial = os.path.join(self.directory.name, "b.tmp123.mp4")
+        with open(partial, "wb") as f:
+            f.write(bytes(300))
+
+        self.cache.prune()
+
+        self.assertTrue(os.path.exists(partial))
+
+    def test_no_limit(self):
+        self.cache.max_bytes = None
+        paths = [self.store(name, 100, 1000) for name in "abc"]
+
+        self.cache.prune()
+
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        self.assertEqual(self.cache.get("missing"), None)
+        self.assertEqual(self.cache.misses, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+import wave
+from typing import Dict, Tuple
+
+from audio_utils.audio import WaveNetTTS
+from audio_utils.backends import TTSBackend
+from benchmarks.fake_tts import (
+    FakeTTSServer,
+    HTTPTTSBackend,
+    marked_speech,
+    silent_wav,
+    speech_length,
+)
+
+
+class MarkingBackend(TTSBackend):
+    """In process backend answering SSML with the fake service's marks, or
+    without any when `marks` is False"""
+
+    supports_marks = True
+
+    def __init__(self, marks: bool = True):
+        self.marks = marks
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def synthesize(self, text: str, voice: Tuple[str, int], audio_config) -> bytes:
+        with self._lock:
+            self.calls.append(("text", text, voice))
+        return silent_wav(speech_length(text))
+
+    def synthesize_marked(
+        self, ssml: str, voice: Tuple[str, int], audio_config
+    ) -> Tuple[bytes, Dict[str, float]]:
+        with self._lock:
+            self.calls.append(("ssml", ssml, voice))
+        audio_content, marks = marked_speech(ssml)
+        return audio_content, marks if self.marks else {}
+
+
+def samples(path: str) -> bytes:
+    with wave.open(path, "rb") as w:
+        return w.readframes(w.getnframes())
+
+
+class TTSTestCase(unittest.TestCase):
+    def setUp(self):
+        # WaveNetTTS writes to tts_output in the working directory
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def requests(self, texts, voice="A"):
+        return [
+            {"text": text, "filename": f"chunk{idx}.wav", "voice": voice}
+            for idx, text in enumerate(texts)
+        ]
+
+
+class CoalesceTest(TTSTestCase):
+    texts = ["First chunk.", "A second, longer chunk of text.", "Third."]
+
+    def test_same_voice_texts_share_a_request_cut_at_marks(self):
+        backend = MarkingBackend()
+        tts = WaveNetTTS(audio_config="LINEAR16", backend=backend)
+
+        results = tts.synthesize_many(self.requests(self.texts))
+
+        self.assertEqual([kind for kind, _, _ in backend.calls], ["ssml"])
+        self.assertEqual(len(results), 3)
+        for idx, (text, (path, duration)) in enumerate(zip(self.texts, results)):
+            # The fake service says text i with samples of value i + 1
+            content = samples(path)
+            self.assertEqual(set(content[0::2]), {idx + 1})
+            self.assertAlmostEqual(duration, speech_length(text), places=3)
+
+    def test_voices_are_coalesced_separately_in_order(self):
+        backend = MarkingBackend()
+        tts = WaveNetTTS(audio_config="LINEAR16", backend=backend)
+        requests = self.requests(["one", "two"], "A") + self.requests(
+            ["three", "four"], "B"
+        )
+
+        results = tts.synthesize_many(requests)
+
+        self.assertEqual(len(backend.calls), 2)
+        self.assertEqual(
+            {voice for _, _, voice in backend.calls},
+            {WaveNetTTS.VOICES["A"], WaveNetTTS.VOICES["B"]},
+        )
+        for request, (_, duration) in zip(requests, results):
+            self.assertAlmostEqual(duration, speech_length(request["text"]), places=3)
+
+    def test_unsplittable_batch_falls_back_to_one_request_per_text(self):
+        backend = MarkingBackend(marks=False)
+        tts = WaveNetTTS(audio_config="LINEAR16", backend=backend)
+
+        results = tts.synthesize_many(self.requests(self.texts))
+
+        self.assertEqual(
+            sorted(kind for kind, _, _ in backend.calls),
+            ["ssml", "text", "text", "text"],
+        )
+        self.assertEqual(
+            sorted(text for kind, text, _ in backend.calls if kind == "text"),
+            sorted(self.texts),
+        )
+        for text, (_, duration) in zip(self.texts, results):
+            self.assertAlmostEqual(duration, speech_length(text), places=3)
+        # Only that batch fell back, the next calls coalesce again
+        self.assertTrue(tts.coalesce)
+        backend.marks = True
+        backend.calls = []
+        tts.synthesize_many(self.requests(["Another.", "Script."]))
+        self.assertEqual([kind for kind, _, _ in backend.calls], ["ssml"])
+
+    def test_coalesce_disabled(self):
+        backend = MarkingBackend()
+        tts = WaveNetTTS(audio_config="LINEAR16", backend=backend, coalesce=False)
+
+        tts.synthesize_many(self.requests(self.texts))
+
+        self.assertEqual([kind for kind, _, _ in backend.calls], ["text"] * 3)
+
+
+class PooledRequestsTest(TTSTestCase):
+    texts = [f"Chunk number {idx} of the script." * (idx % 3 + 1) for idx in range(12)]
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeTTSServer(latency=0.2)
+        self.server.__enter__()
+        self.backend = HTTPTTSBackend(self.server.url, marks=False)
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        super().tearDown()
+
+    def test_results_keep_request_order(self):
+        tts = WaveNetTTS(audio_config="LINEAR16", backend=self.backend)
+
+        results = tts.synthesize_many(self.requests(self.texts))
+
+        self.assertEqual(self.server.requests_count, len(self.texts))
+        for text, (_, duration) in zip(self.texts, results):
+            self.assertAlmostEqual(duration, speech_length(text), places=3)
+
+    def test_requests_run_concurrently_up_to_max_workers(self):
+        tts = WaveNetTTS(audio_config="LINEAR16", backend=self.backend, max_workers=4)
+        start = time.monotonic()
+
+        tts.synthesize_many(self.requests(self.texts))
+
+        elapsed = time.monotonic() - start
+        # 12 requests of 0.2s, 4 at a time
+        self.assertGreaterEqual(elapsed, 0.6)
+        self.assertLess(elapsed, 12 * 0.2)
+
+    def test_qps_spaces_requests(self):
+        tts = WaveNetTTS(audio_config="LINEAR16", backend=self.backend, qps=20)
+        start = time.monotonic()
+
+        tts.synthesize_many(self.requests(self.texts))
+
+        self.assertGreaterEqual(time.monotonic() - start, (len(self.texts) - 1) / 20)
+
+    def test_failed_requests_are_retried(self):
+        random.seed(0)
+        self.server.failure_rate = 0.3
+        tts = WaveNetTTS(
+            audio_config="LINEAR16", backend=self.backend, tries=10, retry_delay=0.01
+        )
+
+        results = tts.synthesize_many(self.requests(self.texts))
+
+        self.assertGreater(self.server.requests_count, len(self.texts))
+        for text, (_, duration) in zip(self.texts, results):
+            self.assertAlmostEqual(duration, speech_length(text), places=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
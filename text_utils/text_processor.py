@@ -1,21 +1,30 @@
 """This module processes custom text input used to generate videos.
-So far the only tag supported is: [IMAGE: <IMAGE KEYWORD>]
+Supported tags are: [IMAGE: <IMAGE KEYWORD> <COUNT>],
+[VOICE: <VOICE NAME>]...[/VOICE] and [EFFECT: <EFFECT NAME>, ...]
 """
 
+import io
 import re
-from typing import List, Dict
+from typing import Iterable, Iterator, TextIO, Tuple
+from video_utils.effects import EFFECTS
 from video_utils.video_segment import VideoSegment
+from utils import tracing
+
+
+class TemplateError(Exception):
+    pass
 
 
 class TextProcessor:
 
     TextTemplateRe = {
-        "image": r"\[IMAGE: (.+?)(\d*?)]",
-        "split_image": r"\[IMAGE: .+?\d*?]",
-        "search_voice": r"\[VOICE: (.+?)](.+?)\[\/VOICE]",
-        "split_voice": r"\[VOICE: .+?](.+?)\[\/VOICE]",
+        # One alternative per tag, a single scan finds all of them in order
+        "token": r"\[IMAGE: (.+?)(\d*?)]|\[VOICE: (.+?)]|\[/VOICE]|\[EFFECT: (.+?)]",
     }
 
+    DEFAULT_IMAGES_NUMBER = 5
+
+    @tracing.traced("parse")
     def __init__(self, text: str):
         """
         Args:
@@ -25,74 +34,153 @@ class TextProcessor:
         self.video_segments = []
         self.sentences = []
         print("[INFO] Processing text...")
-        self._process_text_for_images()
+        for segment in TextProcessor.parse(io.StringIO(text)):
+            self.video_segments.append(segment)
+            self.sentences.append((segment.text, segment.image_keyword))
         print("[INFO] Processed text..")
 
-    def _process_text_for_images(self) -> None:
-        """processes and formats text
-        Eventually, this function will set `self.sentences` to be an array of
-        2-tuples: Tuple[sentence, images_keyword]. Then each pair, sentence
-        will be used for voice over and images_keyword will be used for image
-        search over this segment.
+    @staticmethod
+    def tokenize(stream: TextIO, chunk_size: int = 64 * 1024) -> Iterator[Tuple]:
+        """Scans a script once, reading it in chunks.
+
+        Args:
+            stream (TextIO): script to scan
+            chunk_size (int, optional): characters read at a time.
+                Defaults to 64K.
+
+        Yields:
+            Tuple: one of ("text", str), ("image", keyword, images_number),
+            ("voice", voice_name), ("end_voice",) or ("effect", names).
+            Text between two tags may be split over several "text" tokens.
         """
-        matches = re.finditer(
-            TextProcessor.TextTemplateRe["image"], self.text, re.DOTALL
-        )
-
-        groups = []
-        for _, match in enumerate(matches):
-            try:
-                images_number = int(match.group(2))
-            except:
-                images_number = 5
-            groups.append((match.group(1), images_number))
-
-        i = 0
-        for sentence in re.split(
-            TextProcessor.TextTemplateRe["split_image"],
-            self.text,
-            re.DOTALL,
-        ):
-            if len(sentence) > 0:
-                self.video_segments.append(
-                    VideoSegment(
-                        sentence.strip(),
-                        self._process_voices(sentence.strip()),
-                        groups[i][0],
-                        i + 1,
-                        groups[i][1],
-                    )
-                )
-                self.sentences.append((sentence.strip(), groups[i][0]))
-                i += 1
+        token_re = re.compile(TextProcessor.TextTemplateRe["token"], re.DOTALL)
+        buffer = ""
+        while True:
+            chunk = stream.read(chunk_size)
+            buffer += chunk
+            position = 0
+            for match in token_re.finditer(buffer):
+                if match.start() > position:
+                    yield ("text", buffer[position : match.start()])
+                position = match.end()
+                if match.group(1) is not None:
+                    images_number = TextProcessor.DEFAULT_IMAGES_NUMBER
+                    if match.group(2):
+                        images_number = int(match.group(2))
+                    yield ("image", match.group(1), images_number)
+                elif match.group(3) is not None:
+                    yield ("voice", match.group(3))
+                elif match.group(4) is not None:
+                    names = [name.strip() for name in match.group(4).split(",")]
+                    yield ("effect", names)
+                else:
+                    yield ("end_voice",)
+            buffer = buffer[position:]
+
+            if not chunk:
+                break
+            # Hold back a tag that may be cut by the end of the chunk
+            bracket = buffer.rfind("[")
+            if bracket != -1 and "]" not in buffer[bracket:]:
+                text, buffer = buffer[:bracket], buffer[bracket:]
+            else:
+                text, buffer = buffer, ""
+            if text:
+                yield ("text", text)
+
+        if buffer:
+            yield ("text", buffer)
 
-    def _process_voices(self, text) -> List[Dict]:
-        """Extracts [VOICE] tags from video and sets every group of text to the
-        the correct voice.
+    @staticmethod
+    def parse(stream: TextIO) -> Iterator[VideoSegment]:
+        """Builds video segments from a script in a single pass. Segments are
+        yielded as soon as the next [IMAGE] tag is read, so long scripts never
+        have to be fully loaded in memory.
 
         Args:
-            text (str): Text to be processed
+            stream (TextIO): script to parse
 
-        Returns:
-            List[Dict]: List of Dict of this format {"voice": str, "text": str}
-            Where voice is the voice name and text is the text to be voiced
-            over.
+        Yields:
+            VideoSegment: segments in script order
         """
-        # TODO do this, but better.
-        # Split all text on voice tags and sets everything to "default"
-        voiceover_segment = []
-        for sentence in re.split(
-            TextProcessor.TextTemplateRe["split_voice"], text, re.DOTALL | re.MULTILINE
-        ):
-            if len(sentence.strip()) > 0:
-                voiceover_segment.append({"voice": "DEFAULT", "text": sentence.strip()})
-
-        # Iterate again but this time set the text to the correct voice in tag.
-        for sentence in re.finditer(
-            TextProcessor.TextTemplateRe["search_voice"], text, re.DOTALL | re.MULTILINE
-        ):
-            for idx, t in enumerate(voiceover_segment):
-                if t["text"] == sentence.group(2).strip():
-                    voiceover_segment[idx]["voice"] = sentence.group(1)
-
-        return voiceover_segment
+        return TextProcessor._build_segments(TextProcessor.tokenize(stream))
+
+    @staticmethod
+    def _build_segments(tokens: Iterable[Tuple]) -> Iterator[VideoSegment]:
+        image = None
+        effects = []
+        raw_text = []
+        voiceover = []
+        voice = None
+        piece = []
+        segment_number = 0
+
+        def close_piece():
+            text = "".join(piece).strip()
+            if len(text) > 0:
+                voiceover.append({"voice": voice or "DEFAULT", "text": text})
+            piece.clear()
+
+        for token in tokens:
+            kind = token[0]
+            if kind == "text":
+                if image is None:
+                    if len(token[1].strip()) > 0:
+                        raise TemplateError(
+                            "Script must start with an [IMAGE: keyword count] tag"
+                        )
+                    continue
+                raw_text.append(token[1])
+                piece.append(token[1])
+                continue
+
+            if kind == "image":
+                if voice is not None:
+                    raise TemplateError(f"[VOICE: {voice}] is not closed")
+                close_piece()
+                if image is not None and len(voiceover) > 0:
+                    segment_number += 1
+                    text = "".join(raw_text).strip()
+                    yield VideoSegment(
+                        text, voiceover, image[0], segment_number, image[1], effects
+                    )
+                image = token[1:]
+                effects = []
+                raw_text = []
+                voiceover = []
+                continue
+
+            if image is None:
+                raise TemplateError(
+                    "Script must start with an [IMAGE: keyword count] tag"
+                )
+            if kind == "effect":
+                for name in token[1]:
+                    if name not in EFFECTS:
+                        raise TemplateError(
+                            f"Unknown effect {name!r}, expected one of "
+                            f"{', '.join(EFFECTS)}"
+                        )
+                effects.extend(token[1])
+            elif kind == "voice":
+                if voice is not None:
+                    raise TemplateError(f"[VOICE: {voice}] is not closed")
+                close_piece()
+                voice = token[1]
+                raw_text.append(f"[VOICE: {voice}]")
+            else:
+                if voice is None:
+                    raise TemplateError("[/VOICE] without an opening [VOICE] tag")
+                close_piece()
+                voice = None
+                raw_text.append("[/VOICE]")
+
+        if voice is not None:
+            raise TemplateError(f"[VOICE: {voice}] is not closed")
+        close_piece()
+        if image is not None and len(voiceover) > 0:
+            segment_number += 1
+            text = "".join(raw_text).strip()
+            yield VideoSegment(
+                text, voiceover, image[0], segment_number, image[1], effects
+            )
@@ -1,6 +1,30 @@
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 
 def mkdir(directory):
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    # exist_ok avoids failing when another thread creates it at the same time
+    os.makedirs(directory, exist_ok=True)
+
+
+def process_pool(max_workers: int = None) -> ProcessPoolExecutor:
+    """Process pool whose workers are never forked from this process.
+    Pools are often first used from worker threads, and forking a
+    multithreaded process copies the locks other threads hold (logging,
+    sqlite, connection pools) in their locked state. Workers are forked by a
+    single threaded fork server instead, or spawned where there's none.
+
+    Args:
+        max_workers (int, optional): Number of processes. Defaults to the
+            number of CPUs.
+
+    Returns:
+        ProcessPoolExecutor: the pool
+    """
+    method = "spawn"
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        method = "forkserver"
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context(method)
+    )
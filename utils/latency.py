@@ -0,0 +1,38 @@
+import threading
+from typing import Dict
+
+
+class LatencyStats:
+    """Thread safe recorder of durations, summarized by percentiles.
+
+    Attributes:
+        samples (List[float]): Recorded durations in seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = []
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        """Nearest rank percentile, e.g. q=99 for p99, 0 without samples"""
+        with self._lock:
+            samples = sorted(self.samples)
+        if len(samples) == 0:
+            return 0.0
+        rank = max(1, -(-len(samples) * q // 100))
+        return samples[int(rank) - 1]
+
+    def summary(self) -> Dict[str, float]:
+        """Returns the sample count, p50, p99 and max in seconds"""
+        with self._lock:
+            samples = list(self.samples)
+        return {
+            "count": len(samples),
+            "p50": round(self.percentile(50), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(max(samples, default=0.0), 3),
+        }
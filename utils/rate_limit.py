@@ -0,0 +1,26 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Thread safe limiter that spaces calls to at most `qps` per second.
+
+    Attributes:
+        qps (float): Maximum calls per second, None or 0 disables limiting.
+    """
+
+    def __init__(self, qps: float = None):
+        self.qps = qps
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self) -> None:
+        """Blocks until the caller is allowed to make its call"""
+        if not self.qps:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / self.qps
+        if slot > now:
+            time.sleep(slot - now)
@@ -0,0 +1,265 @@
+"""Lightweight tracing of the render pipeline.
+Spans are nested per thread and record their duration plus counters such as
+bytes, cache hits or spawned subprocesses. Tracing is enabled by calling
+`enable` or by setting the TTV_TRACE environment variable to an output folder,
+which also enables it in worker processes. Every process appends its finished
+spans to its own JSON lines file in that folder, `export_chrome` merges them
+into a Chrome trace / Perfetto file.
+
+Stages can be profiled with cProfile by listing span names in TTV_PROFILE,
+e.g. TTV_PROFILE=segment.render,tts.request
+
+When tracing is disabled `span` returns a shared no-op object, so
+instrumented code only pays for one function call.
+"""
+
+import cProfile
+import functools
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+
+from utils.common import mkdir
+
+TRACE_ENV = "TTV_TRACE"
+PROFILE_ENV = "TTV_PROFILE"
+
+
+class _NullSpan:
+    """Span used when tracing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, counter: str, value: float = 1) -> None:
+        pass
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """A timed, nested unit of work.
+
+    Attributes:
+        name (str): Stage name, e.g. "tts.request".
+        attrs (Dict): Attributes and counters of the span.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+        self._tracer = tracer
+        self._profiler = None
+
+    def __enter__(self):
+        stack = self._tracer._stack()
+        self.parent = stack[-1].id if stack else None
+        self.id = next(self._tracer._ids)
+        stack.append(self)
+        if self.name in self._tracer.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        end = time.perf_counter()
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._tracer._dump_profile(self)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self._tracer._stack().pop()
+        self._tracer._finish(self, end)
+        return False
+
+    def add(self, counter: str, value: float = 1) -> None:
+        """Adds to a counter of this span"""
+        self.attrs[counter] = self.attrs.get(counter, 0) + value
+
+    def set(self, **attrs) -> None:
+        """Sets attributes of this span"""
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    """Records spans of this process to `directory`/trace-<pid>.jsonl
+
+    Attributes:
+        directory (str): Output folder shared by all processes.
+        profile (set): Span names to run under cProfile.
+    """
+
+    def __init__(self, directory: str, profile: List[str] = ()):
+        self.directory = directory
+        self.profile = set(profile)
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._finished = []
+        self._pid = os.getpid()
+        self._epoch = time.time() - time.perf_counter()
+        mkdir(directory)
+
+    def _stack(self) -> List[Span]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _finish(self, span: Span, end: float) -> None:
+        if os.getpid() != self._pid:
+            # Forked worker, spans of the parent belong to the parent's file
+            self._pid = os.getpid()
+            self._finished = []
+        record = {
+            "name": span.name,
+            "id": f"{self._pid}-{span.id}",
+            "parent": span.parent and f"{self._pid}-{span.parent}",
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+            "start": self._epoch + span.start,
+            "duration": end - span.start,
+            "attrs": span.attrs,
+        }
+        with self._lock:
+            self._finished.append(record)
+            # Flush once a thread is back at its top level. Pool workers exit
+            # without running atexit handlers, so nothing is left to flush on
+            # exit.
+            if not self._stack():
+                self.flush()
+
+    def flush(self) -> None:
+        """Appends finished spans to this process' trace file"""
+        if not self._finished:
+            return
+        path = os.path.join(self.directory, f"trace-{self._pid}.jsonl")
+        with open(path, "a", encoding="utf-8") as f:
+            for record in self._finished:
+                f.write(json.dumps(record, default=str) + "\n")
+        self._finished = []
+
+    def _dump_profile(self, span: Span) -> None:
+        path = os.path.join(
+            self.directory, f"profile-{span.name}-{self._pid}-{span.id}.prof"
+        )
+        span._profiler.dump_stats(path)
+        span.attrs["profile"] = os.path.basename(path)
+
+
+_tracer = None
+
+
+def enable(directory: str, profile: List[str] = ()) -> None:
+    """Enables tracing in this process and in processes started after this
+
+    Args:
+        directory (str): Folder the traces and profiles are written to.
+        profile (List[str], optional): Span names to run under cProfile.
+    """
+    global _tracer
+    os.environ[TRACE_ENV] = directory
+    if profile:
+        os.environ[PROFILE_ENV] = ",".join(profile)
+    _tracer = Tracer(directory, profile)
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, **attrs):
+    """Starts a span, to be used as a context manager
+
+    Args:
+        name (str): Stage name.
+        **attrs: Attributes recorded with the span.
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return Span(_tracer, name, attrs)
+
+
+def traced(name: str):
+    """Decorator running every call of a function in a span
+
+    Args:
+        name (str): Stage name.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with Span(_tracer, name, {}):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def current():
+    """Returns the innermost open span of this thread"""
+    if _tracer is None:
+        return _NULL_SPAN
+    stack = _tracer._stack()
+    return stack[-1] if stack else _NULL_SPAN
+
+
+def add(counter: str, value: float = 1) -> None:
+    """Adds to a counter of the innermost open span of this thread"""
+    if _tracer is not None:
+        current().add(counter, value)
+
+
+def load(directory: str) -> List[Dict]:
+    """Reads the spans of every process traced to `directory`"""
+    records = []
+    for path in sorted(glob.glob(os.path.join(directory, "trace-*.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    return records
+
+
+def export_chrome(directory: str, output: str) -> None:
+    """Merges traced spans into a Chrome trace file, viewable in
+    chrome://tracing or ui.perfetto.dev
+
+    Args:
+        directory (str): Folder given to `enable`.
+        output (str): Path of the JSON trace to write.
+    """
+    events = [
+        {
+            "name": record["name"],
+            "ph": "X",
+            "ts": record["start"] * 1e6,
+            "dur": record["duration"] * 1e6,
+            "pid": record["pid"],
+            "tid": record["tid"],
+            "args": record["attrs"],
+        }
+        for record in load(directory)
+    ]
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+if os.environ.get(TRACE_ENV):
+    _tracer = Tracer(
+        os.environ[TRACE_ENV],
+        [n for n in os.environ.get(PROFILE_ENV, "").split(",") if n],
+    )
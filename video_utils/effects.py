@@ -0,0 +1,272 @@
+"""Motion effects for still images (Ken Burns pan and zoom).
+An effect moves a crop window over the image. The window of every frame is
+computed up front as NumPy arrays, then frames are produced by resampling
+one pre-decoded, oversampled copy of the image, read from the frame store,
+so no image is decoded per frame.
+
+Effects are selected in scripts with the [EFFECT: name, ...] tag.
+"""
+
+from typing import TYPE_CHECKING, Iterator, List, Tuple
+
+if TYPE_CHECKING:
+    from moviepy.editor import VideoClip
+
+# Crop window at the start and at the end of an effect, as (scale, center x,
+# center y) relative to the image. A scale of 0.8 shows 80% of the width.
+ZOOM = 0.8
+PAN = 0.85
+EFFECTS = {
+    "none": ((1.0, 0.5, 0.5), (1.0, 0.5, 0.5)),
+    "zoom-in": ((1.0, 0.5, 0.5), (ZOOM, 0.5, 0.5)),
+    "zoom-out": ((ZOOM, 0.5, 0.5), (1.0, 0.5, 0.5)),
+    "pan-left": ((PAN, 1 - PAN / 2, 0.5), (PAN, PAN / 2, 0.5)),
+    "pan-right": ((PAN, PAN / 2, 0.5), (PAN, 1 - PAN / 2, 0.5)),
+    "pan-up": ((PAN, 0.5, 1 - PAN / 2), (PAN, 0.5, PAN / 2)),
+    "pan-down": ((PAN, 0.5, PAN / 2), (PAN, 0.5, 1 - PAN / 2)),
+}
+
+
+def oversampling(effect: str) -> float:
+    """Source scale needed so the smallest crop window of an effect still has
+    one source pixel per output pixel"""
+    start, end = EFFECTS[effect]
+    return 1 / min(start[0], end[0])
+
+
+def load_source(path: str, size: Tuple[int, int]):
+    """Image letterboxed to `size`, decoded once and kept in the frame store,
+    so every frame and every effect of the same image, in every render, share
+    the decoded pixels.
+
+    Args:
+        path (str): image path
+        size (Tuple[int, int]): source size, the output size times the
+            effect's oversampling
+
+    Returns:
+        np.ndarray: (height, width, 3) uint8 read-only array
+    """
+    from video_utils.frame_store import default_store
+
+    return default_store().frame(path, size)
+
+
+def crop_rects(effect: str, frames: int, source_size: Tuple[int, int]):
+    """Crop window of every frame of an effect, eased in and out
+
+    Args:
+        effect (str): name in EFFECTS
+        frames (int): number of frames
+        source_size (Tuple[int, int]): size of the source image
+
+    Returns:
+        np.ndarray: (frames, 4) float array of x, y, width, height
+    """
+    import numpy as np
+
+    (s0, x0, y0), (s1, x1, y1) = EFFECTS[effect]
+    t = np.linspace(0.0, 1.0, frames) if frames > 1 else np.zeros(1)
+    t = t * t * (3 - 2 * t)
+    scale = s0 + (s1 - s0) * t
+    width = scale * source_size[0]
+    height = scale * source_size[1]
+    left = (x0 + (x1 - x0) * t) * source_size[0] - width / 2
+    top = (y0 + (y1 - y0) * t) * source_size[1] - height / 2
+    return np.stack([left, top, width, height], axis=1)
+
+
+def _taps(start, length, count: int, limit: int):
+    """Bilinear sample positions of `count` output pixels spread over
+    [start, start + length) for every frame at once
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (frames, count) first
+        and second source index and 0-128 weight of the second one
+    """
+    import numpy as np
+
+    centers = (np.arange(count) + 0.5) / count
+    positions = start[:, None] + centers[None, :] * length[:, None] - 0.5
+    positions = np.clip(positions, 0, limit - 1)
+    first = np.floor(positions).astype(np.intp)
+    second = np.minimum(first + 1, limit - 1)
+    weight = np.round((positions - first) * 128).astype(np.int16)
+    return first, second, weight
+
+
+def render_frames(source, rects, size: Tuple[int, int], batch: int = 16) -> Iterator:
+    """Resamples crop windows of a source to output frames.
+    Sample positions and weights are computed for a batch of frames at once.
+    Each frame gathers the two source rows of every output row and blends
+    them, then does the same with columns, in 16 bit fixed point. A frame
+    with the same window as the previous one is not computed again.
+
+    Args:
+        source (np.ndarray): (height, width, 3) uint8 source
+        rects (np.ndarray): (frames, 4) windows from `crop_rects`
+        size (Tuple[int, int]): output size
+        batch (int, optional): frames whose taps are computed together.
+            Defaults to 16.
+
+    Yields:
+        np.ndarray: (height, width, 3) uint8 frames
+    """
+    import numpy as np
+
+    width, height = size
+    channels = source.shape[2]
+    previous_rect = None
+    previous_frame = None
+    for offset in range(0, len(rects), batch):
+        chunk = rects[offset : offset + batch]
+        xs0, xs1, wx = _taps(chunk[:, 0], chunk[:, 2], width, source.shape[1])
+        ys0, ys1, wy = _taps(chunk[:, 1], chunk[:, 3], height, source.shape[0])
+        # Rows are gathered from the columns under the window only, and
+        # channels are folded into the columns so every pass works on 2D
+        # arrays: column c of channel k is at c * channels + k.
+        lefts = xs0[:, :1]
+        xs0 = (xs0 - lefts)[:, :, None] * channels + np.arange(channels)
+        xs1 = (xs1 - lefts)[:, :, None] * channels + np.arange(channels)
+        xs0 = xs0.reshape(len(chunk), -1)
+        xs1 = xs1.reshape(len(chunk), -1)
+        wx = np.repeat(wx, channels, axis=1)
+        for idx, rect in enumerate(chunk):
+            key = tuple(np.round(rect, 2))
+            if key == previous_rect:
+                yield previous_frame
+                continue
+
+            left = lefts[idx, 0]
+            window = source[:, left : left + xs1[idx, -1] // channels + 1]
+            window = window.reshape(len(source), -1)
+            top = np.take(window, ys0[idx], axis=0)
+            rows = np.take(window, ys1[idx], axis=0).astype(np.int16)
+            rows -= top
+            rows *= wy[idx][:, None]
+            rows >>= 7
+            rows += top
+
+            frame = np.take(rows, xs1[idx], axis=1)
+            first = np.take(rows, xs0[idx], axis=1)
+            frame -= first
+            frame *= wx[idx][None, :]
+            frame >>= 7
+            frame += first
+            frame = frame.astype(np.uint8).reshape(height, width, channels)
+
+            previous_rect, previous_frame = key, frame
+            yield frame
+
+
+def _prepare(image: str, effect: str, frames: int, size: Tuple[int, int]):
+    """Decoded source and crop windows of one image with an effect"""
+    factor = oversampling(effect)
+    source_size = (round(size[0] * factor), round(size[1] * factor))
+    source = load_source(image, source_size)
+    return source, crop_rects(effect, frames, source_size)
+
+
+def effect_frames(
+    image: str, effect: str, frames: int, size: Tuple[int, int]
+) -> Iterator:
+    """Frames of one image with an effect
+
+    Args:
+        image (str): image path
+        effect (str): name in EFFECTS
+        frames (int): number of frames
+        size (Tuple[int, int]): output size
+
+    Yields:
+        np.ndarray: (height, width, 3) uint8 frames
+    """
+    source, rects = _prepare(image, effect, frames, size)
+    return render_frames(source, rects, size)
+
+
+def _plan(
+    timeline: List[Tuple[str, float, float]], effects: List[str], frames: int
+) -> List[Tuple[str, str, int, int]]:
+    """(image, effect, first frame, number of frames) of every image of a
+    timeline. Image i gets effect i modulo the number of effects and image
+    boundaries are rounded to whole frames."""
+    total = sum(duration for _, _, duration in timeline)
+    boundaries = [0]
+    for _, start, duration in timeline:
+        boundaries.append(round((start + duration) / total * frames))
+    boundaries[-1] = frames
+    return [
+        (image, effects[idx % len(effects)], boundaries[idx], count)
+        for idx, (image, _, _) in enumerate(timeline)
+        for count in [boundaries[idx + 1] - boundaries[idx]]
+        if count > 0
+    ]
+
+
+def timeline_frames(
+    timeline: List[Tuple[str, float, float]],
+    effects: List[str],
+    frames: int,
+    size: Tuple[int, int],
+) -> Iterator:
+    """Frames of a segment, image i gets effect i modulo the number of
+    effects. Image boundaries are rounded to whole frames.
+
+    Args:
+        timeline (List[Tuple[str, float, float]]): (image, start, duration)
+            of every image, in order and without gaps.
+        effects (List[str]): effect names
+        frames (int): total number of frames
+        size (Tuple[int, int]): output size
+
+    Yields:
+        np.ndarray: (height, width, 3) uint8 frames
+    """
+    for image, effect, _, count in _plan(timeline, effects, frames):
+        yield from effect_frames(image, effect, count, size)
+
+
+def timeline_clip(
+    timeline: List[Tuple[str, float, float]],
+    effects: List[str],
+    fps: int,
+    size: Tuple[int, int],
+) -> "VideoClip":
+    """Same frames as `timeline_frames` as a MoviePy clip, for the
+    `generate_video` path. Frames are computed on demand from the source
+    and crop windows of the current image, read from the frame store.
+
+    Args:
+        timeline (List[Tuple[str, float, float]]): (image, start, duration)
+            of every image, in order and without gaps.
+        effects (List[str]): effect names
+        fps (int): clip FPS
+        size (Tuple[int, int]): output size
+
+    Returns:
+        VideoClip: clip of the whole timeline
+    """
+    import bisect
+
+    from moviepy.editor import VideoClip
+
+    duration = sum(d for _, _, d in timeline)
+    frames = max(1, round(duration * fps))
+    plan = _plan(timeline, effects, frames)
+    firsts = [first for _, _, first, _ in plan]
+    prepared = {}
+
+    def make_frame(t):
+        index = min(max(0, int(t * fps + 1e-6)), frames - 1)
+        idx = bisect.bisect_right(firsts, index) - 1
+        image, effect, first, count = plan[idx]
+        if idx not in prepared:
+            # Frames are asked in order, only the current image is kept
+            prepared.clear()
+            prepared[idx] = _prepare(image, effect, count, size)
+        source, rects = prepared[idx]
+        window = rects[index - first : index - first + 1]
+        return next(render_frames(source, window, size))
+
+    return VideoClip(make_frame, duration=duration)
@@ -0,0 +1,465 @@
+"""Encoding helpers shared by the different render paths.
+Every intermediate segment file is written with the same codec parameters so
+the final video can be joined by stream copy without re-encoding. Segment
+files only hold video, the narration of the whole video is added as a single
+audio track when they are joined.
+"""
+
+import os
+import subprocess
+import tempfile
+from typing import TYPE_CHECKING, Iterable, List, Tuple
+
+from utils import tracing
+
+if TYPE_CHECKING:
+    from video_utils.profiles import EncoderProfile
+
+
+# Parameters passed to `write_videofile` for every segment file. Segments
+# must agree on all of them, otherwise the concat demuxer can't copy streams.
+SEGMENT_CODEC_PARAMS = {
+    "codec": "libx264",
+    "audio_codec": "aac",
+    "audio_fps": 44100,
+    "ffmpeg_params": ["-pix_fmt", "yuv420p"],
+}
+
+# Layout of the narration track, see audio_utils.pcm
+SEGMENT_AUDIO_CHANNELS = 2
+
+# x264 preset of draft previews, fastest to encode at the cost of file size
+PREVIEW_PRESET = "ultrafast"
+
+
+class FFmpegError(Exception):
+    pass
+
+
+class Rendition:
+    """One output variant of a video, e.g. 1280x720 at 30 fps.
+
+    Attributes:
+        size (Tuple[int, int]): Frame size, the video is letterboxed to it.
+        fps (int): Frame rate.
+        crf (int): x264 constant rate factor, used when `bitrate` is None.
+        bitrate (str): Target video bitrate, e.g. "2500k".
+        preset (str): x264 preset, e.g. "veryfast". None for x264's default.
+        threads (int): Encoder threads, None to let x264 decide.
+    """
+
+    def __init__(
+        self,
+        size: Tuple[int, int],
+        fps: int = 24,
+        crf: int = None,
+        bitrate: str = None,
+        preset: str = None,
+        threads: int = None,
+    ):
+        if size[0] % 2 or size[1] % 2:
+            raise ValueError(f"rendition size must be even, got {size}")
+        self.size = size
+        self.fps = fps
+        self.crf = crf
+        self.bitrate = bitrate
+        self.preset = preset
+        self.threads = threads
+
+    @classmethod
+    def parse(cls, spec: str) -> "Rendition":
+        """Parses WIDTHxHEIGHT[@FPS][:crf=N][:bitrate=RATE][:preset=NAME]
+        [:threads=N], e.g. 1280x720@30:crf=23
+
+        Args:
+            spec (str): rendition specification
+
+        Returns:
+            Rendition: the parsed rendition
+        """
+        size, *options = spec.split(":")
+        size, _, fps = size.partition("@")
+        try:
+            width, height = (int(value) for value in size.lower().split("x"))
+            settings = dict(option.split("=", 1) for option in options)
+            return cls(
+                (width, height),
+                int(fps) if fps else 24,
+                int(settings.pop("crf")) if "crf" in settings else None,
+                settings.pop("bitrate", None),
+                settings.pop("preset", None),
+                int(settings.pop("threads")) if "threads" in settings else None,
+            )
+        except ValueError as e:
+            raise ValueError(f"invalid rendition {spec!r}: {e}") from e
+
+    def filename(self, output: str) -> str:
+        """Output file of this rendition, e.g. video_720p.mp4"""
+        root, extension = os.path.splitext(output)
+        return f"{root}_{self.size[1]}p{extension}"
+
+    def encoder_args(self) -> List[str]:
+        """ffmpeg output options of this rendition"""
+        args = ["-r", str(self.fps), "-c:v", SEGMENT_CODEC_PARAMS["codec"]]
+        args += SEGMENT_CODEC_PARAMS["ffmpeg_params"]
+        if self.preset is not None:
+            args += ["-preset", self.preset]
+        if self.bitrate is not None:
+            args += ["-b:v", self.bitrate]
+        elif self.crf is not None:
+            args += ["-crf", str(self.crf)]
+        if self.threads is not None:
+            args += ["-threads", str(self.threads)]
+        return args
+
+
+def ffmpeg_binary() -> str:
+    """Returns the ffmpeg binary used by MoviePy"""
+    from moviepy.config import get_setting
+
+    return get_setting("FFMPEG_BINARY")
+
+
+def run_ffmpeg(args: List[str]) -> None:
+    """Runs ffmpeg with the given arguments and raises on failure
+
+    Args:
+        args (List[str]): ffmpeg arguments, without the binary itself.
+    """
+    tracing.add("subprocesses")
+    process = subprocess.run(
+        [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y"] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if process.returncode != 0:
+        raise FFmpegError(process.stderr.decode(errors="replace").strip())
+
+
+def decode_audio(path: str, sample_rate: int, channels: int) -> bytes:
+    """Decodes an audio file to raw signed 16 bit little endian samples
+
+    Args:
+        path (str): audio file path
+        sample_rate (int): output sample rate
+        channels (int): output channels
+
+    Returns:
+        bytes: interleaved samples
+    """
+    tracing.add("subprocesses")
+    process = subprocess.run(
+        [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-i", path]
+        + ["-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if process.returncode != 0:
+        raise FFmpegError(process.stderr.decode(errors="replace").strip())
+    return process.stdout
+
+
+def frame_count(duration: float, fps: int) -> int:
+    """Number of frames a segment of `duration` seconds is encoded with. The
+    narration is placed at the frame boundaries this gives."""
+    return max(1, int(round(duration * fps)))
+
+
+def _write_concat_list(lines: List[str]) -> str:
+    """Writes a concat demuxer list file and returns its path"""
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".txt", delete=False, encoding="utf-8"
+    ) as list_file:
+        list_file.write("\n".join(lines) + "\n")
+    return list_file.name
+
+
+def _concat_entry(path: str) -> str:
+    # Single quotes have to be escaped for the concat demuxer
+    escaped = os.path.abspath(path).replace("'", "'\\''")
+    return f"file '{escaped}'"
+
+
+@tracing.traced("concat")
+def concat_files(paths: List[str], output: str) -> None:
+    """Joins video files with identical codec parameters by stream copy
+
+    Args:
+        paths (List[str]): Files to join, in order.
+        output (str): Output file path.
+    """
+    list_file = _write_concat_list([_concat_entry(path) for path in paths])
+    try:
+        run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_file, "-c", "copy", output])
+    finally:
+        os.remove(list_file)
+
+
+@tracing.traced("renditions")
+def concat_renditions(
+    paths: List[str],
+    audio_path: str,
+    renditions: List[Rendition],
+    outputs: List[str],
+    sample_rate: int,
+    channels: int = SEGMENT_AUDIO_CHANNELS,
+) -> None:
+    """Joins segment files and encodes them to several renditions in a single
+    ffmpeg pass, the segments are decoded once for all renditions.
+
+    Args:
+        paths (List[str]): Segment files to join, in order.
+        audio_path (str): Raw s16le audio covering all segments.
+        renditions (List[Rendition]): Renditions to encode.
+        outputs (List[str]): Output file of every rendition.
+        sample_rate (int): Sample rate of `audio_path`.
+        channels (int, optional): Channels of `audio_path`. Defaults to 2.
+    """
+    list_file = _write_concat_list([_concat_entry(path) for path in paths])
+    try:
+        run_ffmpeg(
+            ["-f", "concat", "-safe", "0", "-i", list_file]
+            + ["-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels)]
+            + ["-i", audio_path]
+            + rendition_args(renditions, outputs, audio="1:a")
+        )
+    finally:
+        os.remove(list_file)
+
+
+@tracing.traced("renditions")
+def encode_frames(
+    frames: Iterable,
+    size: Tuple[int, int],
+    fps: int,
+    renditions: List[Rendition],
+    outputs: List[str],
+    audio_path: str = None,
+    sample_rate: int = None,
+    channels: int = SEGMENT_AUDIO_CHANNELS,
+) -> None:
+    """Encodes frames composed in Python to several renditions. Every frame
+    is piped once to a single ffmpeg process, which scales it for each
+    rendition.
+
+    Args:
+        frames (Iterable): RGB uint8 arrays of `size`.
+        size (Tuple[int, int]): Frame size.
+        fps (int): Frame rate of `frames`.
+        renditions (List[Rendition]): Renditions to encode.
+        outputs (List[str]): Output file of every rendition.
+        audio_path (str, optional): Raw s16le audio track. Defaults to None.
+        sample_rate (int, optional): Sample rate of `audio_path`.
+        channels (int, optional): Channels of `audio_path`. Defaults to 2.
+    """
+    args = ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}"]
+    args += ["-r", str(fps), "-i", "-"]
+    if audio_path is not None:
+        args += ["-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels)]
+        args += ["-i", audio_path]
+    args += rendition_args(
+        renditions, outputs, audio=None if audio_path is None else "1:a"
+    )
+
+    tracing.add("subprocesses")
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y"] + args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr,
+        )
+        try:
+            for frame in frames:
+                process.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            # ffmpeg exited, its error is reported below
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        if process.wait() != 0:
+            stderr.seek(0)
+            raise FFmpegError(stderr.read().decode(errors="replace").strip())
+
+
+@tracing.traced("mux")
+def concat_with_audio(
+    paths: List[str],
+    audio_path: str,
+    output: str,
+    sample_rate: int,
+    channels: int = SEGMENT_AUDIO_CHANNELS,
+    profile: "EncoderProfile" = None,
+    rendition: Rendition = None,
+) -> None:
+    """Joins video only segment files by stream copy and adds a raw audio
+    track, which is the only audio encoding of the render. Segments of
+    different frame sizes can't be stream copied, they're re-encoded to
+    `rendition` instead.
+
+    Args:
+        paths (List[str]): Segment files to join, in order.
+        audio_path (str): Raw s16le audio covering all segments.
+        output (str): Output file path.
+        sample_rate (int): Sample rate of `audio_path`.
+        channels (int, optional): Channels of `audio_path`. Defaults to 2.
+        profile (EncoderProfile, optional): Audio codec and bitrate. Defaults
+            to the segment audio codec.
+        rendition (Rendition, optional): Size and encoder settings to
+            re-encode the video with, smaller segments are centered. Defaults
+            to None, stream copying the segments.
+    """
+    list_file = _write_concat_list([_concat_entry(path) for path in paths])
+    params = SEGMENT_CODEC_PARAMS
+    video_args = ["-c:v", "copy"]
+    if rendition is not None:
+        width, height = rendition.size
+        video_args = [
+            "-vf",
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2",
+        ] + rendition.encoder_args()
+    audio_args = ["-c:a", params["audio_codec"]]
+    if profile is not None:
+        audio_args = profile.audio_args()
+    try:
+        run_ffmpeg(
+            ["-f", "concat", "-safe", "0", "-i", list_file]
+            + ["-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels)]
+            + ["-i", audio_path, "-map", "0:v", "-map", "1:a"]
+            + video_args
+            + audio_args
+            + ["-ar", str(params["audio_fps"]), output]
+        )
+    finally:
+        os.remove(list_file)
+
+
+def rendition_args(
+    renditions: List[Rendition], outputs: List[str], audio: str = None
+) -> List[str]:
+    """ffmpeg options encoding the first input's video to every rendition.
+    The video is decoded once, split, and every branch is scaled and encoded
+    by its own encoder within the same ffmpeg process.
+
+    Args:
+        renditions (List[Rendition]): renditions to encode
+        outputs (List[str]): output file of every rendition
+        audio (str, optional): audio stream specifier, e.g. "1:a", added to
+            every output. Defaults to None.
+
+    Returns:
+        List[str]: options to append after the inputs
+    """
+    labels = [f"v{idx}" for idx in range(len(renditions))]
+    branches = "".join(f"[s{idx}]" for idx in range(len(renditions)))
+    graph = [f"[0:v]split={len(renditions)}{branches}"]
+    for idx, rendition in enumerate(renditions):
+        width, height = rendition.size
+        graph.append(
+            f"[s{idx}]scale={width}:{height}:force_original_aspect_ratio=decrease"
+            f":flags=lanczos,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2[{labels[idx]}]"
+        )
+
+    args = ["-filter_complex", ";".join(graph)]
+    params = SEGMENT_CODEC_PARAMS
+    for label, rendition, output in zip(labels, renditions, outputs):
+        args += ["-map", f"[{label}]"] + rendition.encoder_args()
+        if audio is not None:
+            args += ["-map", audio, "-c:a", params["audio_codec"]]
+            args += ["-ar", str(params["audio_fps"])]
+        args.append(output)
+    return args
+
+
+def frame_size(images: List[str], height: int = None) -> Tuple[int, int]:
+    """Frame size of a segment: the largest image, smaller ones are centered
+    like MoviePy's "compose" concatenation does. x264 needs even dimensions.
+
+    Args:
+        images (List[str]): image paths
+        height (int, optional): Scales the frame to this height, keeping its
+            aspect ratio. Defaults to None.
+
+    Returns:
+        Tuple[int, int]: even width and height
+    """
+    from PIL import Image
+
+    sizes = []
+    for image in images:
+        with Image.open(image) as im:
+            sizes.append(im.size)
+    width = max(w for w, _ in sizes)
+    if height is not None:
+        width = round(width * height / max(h for _, h in sizes))
+    else:
+        height = max(h for _, h in sizes)
+    return width + width % 2, height + height % 2
+
+
+@tracing.traced("encode_stills")
+def encode_stills(
+    timeline: List[Tuple[str, float, float]],
+    output: str,
+    fps: int = 24,
+    frames: int = None,
+    size: Tuple[int, int] = None,
+    preset: str = None,
+    profile: "EncoderProfile" = None,
+) -> None:
+    """Encodes a sequence of still images in one ffmpeg call. Every image is
+    decoded once and held for its duration by the encoder, no frame goes
+    through Python. The output uses the same codec parameters as MoviePy
+    rendered segments so both can be joined by stream copy.
+
+    Args:
+        timeline (List[Tuple[str, float, float]]): (image path, start,
+            duration) of every image, in order and without gaps.
+        output (str): Output file path.
+        fps (int, optional): Video FPS. Defaults to 24.
+        frames (int, optional): Exact number of frames to encode. Defaults
+            to the length of the timeline.
+        size (Tuple[int, int], optional): Frame size. Defaults to
+            `frame_size` of the images.
+        preset (str, optional): x264 preset, overrides the profile's.
+            Defaults to x264's default.
+        profile (EncoderProfile, optional): Rate control, preset and threads
+            of the encode. Defaults to x264's defaults.
+    """
+    width, height = size or frame_size([image for image, _, _ in timeline])
+    if profile is None:
+        rendition = Rendition((width, height), fps, preset=preset)
+    else:
+        rendition = profile.rendition((width, height), fps, preset)
+
+    images_lines = []
+    for image, _, duration in timeline:
+        images_lines += [_concat_entry(image), f"duration {duration:.6f}"]
+    # The concat demuxer ignores the duration of the last entry unless the
+    # file is listed once more.
+    images_lines.append(_concat_entry(timeline[-1][0]))
+
+    if frames is None:
+        frames = frame_count(sum(duration for _, _, duration in timeline), fps)
+
+    images_list = _write_concat_list(images_lines)
+    try:
+        run_ffmpeg(
+            ["-f", "concat", "-safe", "0", "-i", images_list]
+            + [
+                "-vf",
+                f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2",
+            ]
+            # No still image tuning: segments joined by stream copy must share
+            # the same encoder settings.
+            + ["-frames:v", str(frames)]
+            + rendition.encoder_args()
+            + ["-an", output]
+        )
+    finally:
+        os.remove(images_list)
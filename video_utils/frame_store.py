@@ -0,0 +1,200 @@
+"""On-disk store of decoded images.
+Images are decoded once, letterboxed to a frame size and saved as raw uint8
+arrays (.npy files) named after a hash of the image content and the size.
+Reads memory-map the file, so a repeated render skips JPEG decoding and the
+pixels are shared with the page cache instead of copied into every process.
+Only the most recently used frames are kept open.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from utils.common import mkdir
+from utils import tracing
+
+
+class FrameStore:
+    """Size bounded store of decoded frames with an in-process LRU on top.
+
+    Attributes:
+        directory (str): Folder holding the .npy files.
+        max_bytes (int): Total size of stored frames before the least
+            recently used files are deleted, None for no limit.
+        max_open (int): Frames kept memory-mapped by this process.
+        hits (int): Number of frames read without decoding the image.
+        misses (int): Number of frames that had to be decoded.
+    """
+
+    def __init__(
+        self,
+        directory: str = None,
+        max_bytes: int = 4 * 1024 * 1024 * 1024,
+        max_open: int = 16,
+    ):
+        """
+        Args:
+            directory (str, optional): Store folder. Defaults to
+                "frame_store" in the current working directory.
+            max_bytes (int, optional): Maximum total size of the stored
+                frames. Defaults to 4 GiB.
+            max_open (int, optional): Frames kept open. Defaults to 16.
+        """
+        self.directory = directory
+        if self.directory is None:
+            self.directory = os.path.join(os.getcwd(), "frame_store")
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._open = OrderedDict()
+        # Content hashes by (path, size, mtime), so unchanged images are
+        # hashed once per process
+        self._hashes = {}
+        mkdir(self.directory)
+
+    def key(self, image: str, size: Tuple[int, int]) -> str:
+        """Identifies the frame of an image at a size, by content
+
+        Args:
+            image (str): image path
+            size (Tuple[int, int]): frame (width, height)
+
+        Returns:
+            str: key of the frame
+        """
+        stat = os.stat(image)
+        file_id = (os.path.abspath(image), stat.st_size, stat.st_mtime_ns)
+        digest = self._hashes.get(file_id)
+        if digest is None:
+            sha = hashlib.sha1()
+            with open(image, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(chunk)
+            digest = self._hashes[file_id] = sha.hexdigest()[:24]
+        return f"{digest}-{size[0]}x{size[1]}"
+
+    def path(self, key: str) -> str:
+        """Path a frame with this key is (or will be) stored at"""
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def frame(self, image: str, size: Tuple[int, int]):
+        """Returns an image letterboxed to `size`, decoding and storing it
+        only if it isn't stored yet.
+
+        Args:
+            image (str): image path
+            size (Tuple[int, int]): frame (width, height)
+
+        Returns:
+            np.ndarray: (height, width, 3) uint8 read-only memory-mapped array
+        """
+        import numpy as np
+
+        key = self.key(image, size)
+        with self._lock:
+            if key in self._open:
+                self._open.move_to_end(key)
+                return self._open[key]
+
+        path = self.path(key)
+        try:
+            frame = np.load(path, mmap_mode="r")
+            # Touch the file so stale frames can be told apart by mtime
+            os.utime(path)
+            self.hits += 1
+            tracing.add("frame_hits")
+        except (OSError, ValueError):
+            self.misses += 1
+            tracing.add("frame_decodes")
+            self._save(path, decode(image, size))
+            frame = np.load(path, mmap_mode="r")
+
+        with self._lock:
+            self._open[key] = frame
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return frame
+
+    def _save(self, path: str, frame) -> None:
+        """Writes next to the final file then renames, so concurrent renders
+        never read a partial frame"""
+        import numpy as np
+
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, frame)
+        os.replace(tmp_path, path)
+        self._prune()
+
+    def _prune(self) -> None:
+        """Deletes the least recently used frames above `max_bytes`. Frames
+        already memory-mapped stay readable."""
+        if self.max_bytes is None:
+            return
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def decode(image: str, size: Tuple[int, int]):
+    """Decodes an image letterboxed to `size`, centered on black like MoviePy's
+    "compose" concatenation
+
+    Args:
+        image (str): image path
+        size (Tuple[int, int]): frame (width, height)
+
+    Returns:
+        np.ndarray: (height, width, 3) uint8 array
+    """
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(image) as im:
+        ratio = min(size[0] / im.width, size[1] / im.height)
+        fit = (max(1, round(im.width * ratio)), max(1, round(im.height * ratio)))
+        im.draft("RGB", fit)
+        im = im.convert("RGB")
+        if im.size != fit:
+            im = im.resize(fit, Image.LANCZOS)
+    background = Image.new("RGB", size)
+    background.paste(im, ((size[0] - fit[0]) // 2, (size[1] - fit[1]) // 2))
+    return np.asarray(background)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_store() -> FrameStore:
+    """Store shared by this process, in the current working directory unless
+    set by `set_default_store`"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = FrameStore()
+        return _default_store
+
+
+def set_default_store(store: FrameStore) -> None:
+    global _default_store
+    with _default_store_lock:
+        _default_store = store
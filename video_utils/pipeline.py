@@ -0,0 +1,228 @@
+"""Pipelined rendering of video segments.
+Every segment goes through TTS and image search on a thread pool (network
+bound work) and is then encoded on a process pool (CPU bound work), so
+segments downloading their images overlap with segments being encoded.
+"""
+
+import contextlib
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, List
+
+from video_utils.encoder import SEGMENT_CODEC_PARAMS
+from video_utils.segment_cache import SegmentCache
+from video_utils.video_segment import (
+    VideoSegment,
+    render_segment,
+    synthesize_segments,
+)
+from utils.common import process_pool
+from utils import tracing
+
+if TYPE_CHECKING:
+    from audio_utils.audio import WaveNetTTS
+    from images_utils.image_grabber import ImageGrabber
+    from video_utils.profiles import EncoderProfile
+
+
+class SegmentPipeline:
+    """Schedules the stages of many segments over bounded worker pools.
+
+    Attributes:
+        io_workers (int): Threads running TTS and image search tasks.
+        cpu_workers (int): Processes encoding segments.
+        max_in_flight (int): Segments started but not rendered yet. Once
+            reached, no new segment starts until one is rendered, which
+            bounds memory and disk usage.
+        io_pool (ThreadPoolExecutor): Shared thread pool, None to start one
+            per run.
+        cpu_pool (ProcessPoolExecutor): Shared process pool, None to start
+            one per run.
+        height (int): Frame height of the segments, None for the height of
+            their images.
+        preset (str): x264 preset of the segments, None for x264's default.
+            Overrides the preset of `profile`.
+        profile (EncoderProfile): Rate control, preset and threads of the
+            segments, None for x264's defaults.
+        tts_group (int): Consecutive segments whose speech is requested
+            together, so the TTS can coalesce texts across segments.
+    """
+
+    def __init__(
+        self,
+        tts: "WaveNetTTS",
+        gid: "ImageGrabber",
+        segment_cache: SegmentCache,
+        fps: int = 24,
+        io_workers: int = 4,
+        cpu_workers: int = None,
+        max_in_flight: int = None,
+        io_pool: ThreadPoolExecutor = None,
+        cpu_pool: ProcessPoolExecutor = None,
+        height: int = None,
+        preset: str = None,
+        profile: "EncoderProfile" = None,
+        tts_group: int = 4,
+    ):
+        self.tts = tts
+        self.gid = gid
+        self.segment_cache = segment_cache
+        self.fps = fps
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers or os.cpu_count()
+        self.max_in_flight = max_in_flight or 2 * self.cpu_workers
+        self.io_pool = io_pool
+        self.cpu_pool = cpu_pool
+        self.height = height
+        self.preset = preset
+        self.profile = profile
+        # Every segment of a group holds a slot before its speech is requested
+        self.tts_group = max(1, min(tts_group, self.max_in_flight))
+        self.rendered = 0
+
+    def run(self, segments: List[VideoSegment]) -> List[str]:
+        """Prepares the segments that aren't prepared yet and renders them
+
+        Args:
+            segments (List[VideoSegment]): segments to render
+
+        Returns:
+            List[str]: rendered segment files, in the order of `segments`
+        """
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        results = []
+        with contextlib.ExitStack() as pools:
+            io_pool = self.io_pool
+            if io_pool is None:
+                io_pool = pools.enter_context(
+                    ThreadPoolExecutor(max_workers=self.io_workers)
+                )
+            cpu_pool = self.cpu_pool
+            if cpu_pool is None:
+                cpu_pool = pools.enter_context(
+                    process_pool(max_workers=self.cpu_workers)
+                )
+            for first in range(0, len(segments), self.tts_group):
+                group = segments[first : first + self.tts_group]
+                group_results = []
+                for segment in group:
+                    slots.acquire()
+                    result = Future()
+                    result.add_done_callback(lambda _: slots.release())
+                    group_results.append(result)
+                results += group_results
+
+                # Segments prepared by an earlier run go straight to rendering
+                pending = [segment for segment in group if not segment.prepared]
+                if len(pending) > 0:
+                    speech = io_pool.submit(synthesize_segments, self.tts, pending)
+                for segment, result in zip(group, group_results):
+                    stages = []
+                    if segment in pending:
+                        print(
+                            f"[INFO] Preparing video segment #{segment.segment_number}"
+                        )
+                        stages = [
+                            speech,
+                            io_pool.submit(segment.select_images, self.gid),
+                        ]
+                    _when_all(
+                        stages,
+                        lambda segment=segment, result=result: self._render(
+                            segment, result, cpu_pool
+                        ),
+                        result,
+                    )
+            # Wait for every segment before the pools shut down
+            return [result.result() for result in results]
+
+    def _render(
+        self, segment: VideoSegment, result: Future, cpu_pool: ProcessPoolExecutor
+    ) -> None:
+        """Renders a prepared segment unless it's in the segment cache"""
+        settings = {"fps": self.fps, **SEGMENT_CODEC_PARAMS}
+        # Only set for drafts, full renders keep their existing fingerprints
+        if self.height is not None:
+            settings["height"] = self.height
+        if self.preset is not None:
+            settings["preset"] = self.preset
+        if self.profile is not None:
+            # The settings of the profile segments are encoded with
+            settings["profile"] = {
+                "preset": self.profile.preset,
+                "crf": self.profile.crf,
+                "bitrate": self.profile.bitrate,
+                "threads": self.profile.threads,
+            }
+        fingerprint = segment.fingerprint(**settings)
+        path = self.segment_cache.get(fingerprint)
+        if path is not None:
+            result.set_result(path)
+            return
+
+        self.rendered += 1
+        path = self.segment_cache.path(fingerprint)
+        render = cpu_pool.submit(
+            render_segment,
+            segment,
+            path,
+            self.fps,
+            self.height,
+            self.preset,
+            self.profile,
+        )
+        _chain(render, result)
+
+
+def _when_all(futures: List[Future], callback: Callable, result: Future) -> None:
+    """Calls `callback` once all futures succeeded, or fails `result` with the
+    first error"""
+    if len(futures) == 0:
+        try:
+            callback()
+        except Exception as e:
+            _fail(result, e)
+        return
+
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(future: Future):
+        if result.done():
+            return
+        if future.exception() is not None:
+            _fail(result, future.exception())
+            return
+        with lock:
+            remaining[0] -= 1
+            ready = remaining[0] == 0
+        if ready:
+            try:
+                callback()
+            except Exception as e:
+                _fail(result, e)
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def _chain(source: Future, result: Future) -> None:
+    """Copies the outcome of `source` to `result`"""
+
+    def done(future: Future):
+        if future.exception() is not None:
+            _fail(result, future.exception())
+        else:
+            result.set_result(future.result())
+
+    source.add_done_callback(done)
+
+
+def _fail(result: Future, error: BaseException) -> None:
+    tracing.add("errors")
+    try:
+        result.set_exception(error)
+    except Exception:
+        # Already failed by another stage of the same segment
+        pass
@@ -0,0 +1,105 @@
+"""Contact sheets of prepared segments.
+A contact sheet shows every image of a segment with the time it is on
+screen, so a script edit can be checked without encoding any video.
+"""
+
+import csv
+from typing import List, Tuple
+
+from video_utils.video_segment import VideoSegment
+
+THUMBNAIL_WIDTH = 320
+COLUMNS = 4
+CAPTION_HEIGHT = 20
+
+
+def timing_rows(
+    segments: List[VideoSegment], starts: List[float]
+) -> List[Tuple[int, int, str, float, float]]:
+    """(segment, image, path, start, duration) of every image of the video
+
+    Args:
+        segments (List[VideoSegment]): prepared segments
+        starts (List[float]): start time in seconds of every segment
+
+    Returns:
+        List[Tuple[int, int, str, float, float]]: one row per image, image
+        numbers start at 1 in every segment
+    """
+    rows = []
+    for segment, segment_start in zip(segments, starts):
+        for idx, (image, start, duration) in enumerate(segment.timeline()):
+            start += segment_start
+            rows.append((segment.segment_number, idx + 1, image, start, duration))
+    return rows
+
+
+def write_timing(rows: List[Tuple], path: str) -> None:
+    """Writes rows from `timing_rows` to a CSV file"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["segment", "image", "path", "start", "duration"])
+        for segment, image, image_path, start, duration in rows:
+            writer.writerow(
+                [segment, image, image_path, f"{start:.3f}", f"{duration:.3f}"]
+            )
+
+
+def contact_sheet(
+    segment: VideoSegment,
+    start: float,
+    path: str,
+    thumbnail_width: int = THUMBNAIL_WIDTH,
+    columns: int = COLUMNS,
+) -> str:
+    """Saves a PNG grid of the images of a segment, each captioned with its
+    number and time on screen
+
+    Args:
+        segment (VideoSegment): prepared segment
+        start (float): start time of the segment in seconds
+        path (str): PNG file to write
+        thumbnail_width (int, optional): Defaults to 320.
+        columns (int, optional): Images per row. Defaults to 4.
+
+    Returns:
+        str: path of the contact sheet
+    """
+    from PIL import Image, ImageDraw
+
+    timeline = segment.timeline()
+    thumbnails = []
+    for image, _, _ in timeline:
+        with Image.open(image) as im:
+            im.draft("RGB", (thumbnail_width, thumbnail_width))
+            im = im.convert("RGB")
+            im.thumbnail((thumbnail_width, thumbnail_width), Image.BILINEAR)
+            thumbnails.append(im)
+    cell_height = max(im.height for im in thumbnails) + CAPTION_HEIGHT
+    columns = min(columns, len(thumbnails))
+    rows = -(-len(thumbnails) // columns)
+
+    sheet = Image.new(
+        "RGB",
+        (columns * thumbnail_width, CAPTION_HEIGHT + rows * cell_height),
+        "white",
+    )
+    draw = ImageDraw.Draw(sheet)
+    effects = f" [{', '.join(segment.effects)}]" if segment.effects else ""
+    draw.text(
+        (4, 4),
+        f"#{segment.segment_number} {segment.image_keyword.strip()}{effects}",
+        fill="black",
+    )
+    for idx, (im, (_, image_start, duration)) in enumerate(zip(thumbnails, timeline)):
+        x = (idx % columns) * thumbnail_width
+        y = CAPTION_HEIGHT + (idx // columns) * cell_height
+        sheet.paste(im, (x + (thumbnail_width - im.width) // 2, y))
+        image_start += start
+        draw.text(
+            (x + 4, y + cell_height - CAPTION_HEIGHT + 4),
+            f"{idx + 1}: {image_start:.2f}s - {image_start + duration:.2f}s",
+            fill="black",
+        )
+    sheet.save(path)
+    return path
@@ -0,0 +1,379 @@
+"""Named encoder settings and their calibration on the local machine.
+A profile groups everything the encoder is told: codec, x264 preset, rate
+control (CRF or bitrate), threads, pixel format and audio codec/bitrate.
+`calibrate` encodes a generated sample under candidate profiles and records
+the fastest one meeting a quality and size target, used as the "auto"
+profile on that machine.
+"""
+
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from video_utils.encoder import (
+    PREVIEW_PRESET,
+    SEGMENT_CODEC_PARAMS,
+    Rendition,
+    encode_frames,
+    ffmpeg_binary,
+    run_ffmpeg,
+)
+from utils import tracing
+
+# Results of `calibrate`, in the current working directory
+CALIBRATION_FILE = "encoder_profiles.json"
+
+# x264 presets tried by `calibrate`, fastest first
+PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow")
+
+
+class EncoderProfile:
+    """Named settings of an encode.
+
+    Attributes:
+        name (str): Name the profile is selected by.
+        codec (str): Video codec.
+        preset (str): x264 preset, None for the encoder's default.
+        crf (int): Constant rate factor, used when `bitrate` is None.
+        bitrate (str): Target video bitrate, e.g. "2500k".
+        threads (int): Encoder threads, None to let the encoder decide.
+        pixel_format (str): Output pixel format.
+        audio_codec (str): Audio codec.
+        audio_bitrate (str): Audio bitrate, e.g. "128k", None for the
+            codec's default.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        codec: str = SEGMENT_CODEC_PARAMS["codec"],
+        preset: str = None,
+        crf: int = None,
+        bitrate: str = None,
+        threads: int = None,
+        pixel_format: str = "yuv420p",
+        audio_codec: str = SEGMENT_CODEC_PARAMS["audio_codec"],
+        audio_bitrate: str = None,
+    ):
+        self.name = name
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.bitrate = bitrate
+        self.threads = threads
+        self.pixel_format = pixel_format
+        self.audio_codec = audio_codec
+        self.audio_bitrate = audio_bitrate
+
+    def video_args(self) -> List[str]:
+        """ffmpeg video output options"""
+        args = ["-c:v", self.codec, "-pix_fmt", self.pixel_format]
+        if self.preset is not None:
+            args += ["-preset", self.preset]
+        if self.bitrate is not None:
+            args += ["-b:v", self.bitrate]
+        elif self.crf is not None:
+            args += ["-crf", str(self.crf)]
+        if self.threads is not None:
+            args += ["-threads", str(self.threads)]
+        return args
+
+    def audio_args(self) -> List[str]:
+        """ffmpeg audio output options"""
+        args = ["-c:a", self.audio_codec]
+        if self.audio_bitrate is not None:
+            args += ["-b:a", self.audio_bitrate]
+        return args
+
+    def rendition(
+        self, size: Tuple[int, int], fps: int, preset: str = None
+    ) -> Rendition:
+        """Segment encoding settings of this profile. Segments keep the
+        segment codec and pixel format so they can be joined by stream copy.
+
+        Args:
+            size (Tuple[int, int]): frame size
+            fps (int): frame rate
+            preset (str, optional): overrides the profile's preset, e.g. for
+                drafts. Defaults to None.
+
+        Returns:
+            Rendition: rendition with the rate control, preset and threads of
+            the profile
+        """
+        return Rendition(
+            size,
+            fps,
+            crf=self.crf,
+            bitrate=self.bitrate,
+            preset=preset or self.preset,
+            threads=self.threads,
+        )
+
+    def write_videofile_kwargs(self) -> Dict:
+        """Keyword arguments of MoviePy's `write_videofile`"""
+        ffmpeg_params = ["-pix_fmt", self.pixel_format]
+        if self.bitrate is None and self.crf is not None:
+            ffmpeg_params += ["-crf", str(self.crf)]
+        kwargs = {
+            "codec": self.codec,
+            "bitrate": self.bitrate,
+            "threads": self.threads,
+            "audio_codec": self.audio_codec,
+            "audio_bitrate": self.audio_bitrate,
+            "ffmpeg_params": ffmpeg_params,
+        }
+        # MoviePy always passes a preset, "medium" unless told otherwise
+        if self.preset is not None:
+            kwargs["preset"] = self.preset
+        return kwargs
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "EncoderProfile":
+        return cls(**data)
+
+    def __repr__(self) -> str:
+        settings = ", ".join(
+            f"{key}={value!r}"
+            for key, value in self.to_dict().items()
+            if key != "name" and value is not None
+        )
+        return f"EncoderProfile({self.name!r}, {settings})"
+
+
+PROFILES = {
+    # Same settings as MoviePy's `write_videofile` defaults
+    "default": EncoderProfile("default", preset="medium"),
+    "fast": EncoderProfile("fast", preset="veryfast", crf=23),
+    "quality": EncoderProfile("quality", preset="slow", crf=18, audio_bitrate="192k"),
+    "small": EncoderProfile("small", preset="medium", crf=28, audio_bitrate="96k"),
+    "draft": EncoderProfile("draft", preset=PREVIEW_PRESET, crf=30),
+}
+
+
+def load_calibration(path: str = None) -> Optional[Dict]:
+    """Returns the results saved by `calibrate`, None if it never ran"""
+    path = path or os.path.join(os.getcwd(), CALIBRATION_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_profile(name: str, path: str = None) -> EncoderProfile:
+    """Looks up a profile by name, "auto" is the profile picked by the last
+    `calibrate` on this machine
+
+    Args:
+        name (str): name in PROFILES or "auto"
+        path (str, optional): calibration file. Defaults to
+            encoder_profiles.json in the current working directory.
+
+    Returns:
+        EncoderProfile: the profile
+
+    Raises:
+        ValueError: if there is no profile with this name
+    """
+    if name == "auto":
+        calibration = load_calibration(path)
+        if calibration is None:
+            print(
+                "[INFO] No encoder calibration found, run `python cli.py "
+                "calibrate`. Using the default profile"
+            )
+            return PROFILES["default"]
+        return EncoderProfile.from_dict(calibration["best"])
+    if name not in PROFILES:
+        raise ValueError(
+            f"unknown encoder profile {name!r}, expected auto or one of "
+            f"{', '.join(PROFILES)}"
+        )
+    return PROFILES[name]
+
+
+def candidate_profiles(crf: int = 23, jobs: int = 1) -> List[EncoderProfile]:
+    """Profiles tried by `calibrate`: every preset in PRESETS, with the
+    encoder's own thread count and with the cores split between `jobs`
+    concurrent encodes
+
+    Args:
+        crf (int, optional): constant rate factor of every candidate.
+            Defaults to 23.
+        jobs (int, optional): encodes running at once on this machine, e.g.
+            the number of render workers. Defaults to 1.
+
+    Returns:
+        List[EncoderProfile]: candidates
+    """
+    threads = [None]
+    if jobs > 1:
+        threads.append(max(1, (os.cpu_count() or 1) // jobs))
+    return [
+        EncoderProfile(
+            f"x264-{preset}-crf{crf}" + (f"-t{count}" if count else ""),
+            preset=preset,
+            crf=crf,
+            threads=count,
+        )
+        for preset in PRESETS
+        for count in threads
+    ]
+
+
+def _sample_reference(
+    directory: str, size: Tuple[int, int], fps: int, seconds: float
+) -> Tuple[str, int]:
+    """Encodes a losslessly compressed sample to calibrate against: a zoom
+    over a detailed generated image, like an animated segment.
+
+    Returns:
+        Tuple[str, int]: path of the sample and its number of frames
+    """
+    from PIL import Image, ImageChops
+
+    from video_utils.effects import crop_rects, oversampling, render_frames
+    from video_utils.frame_store import decode
+
+    factor = oversampling("zoom-in")
+    source_size = (round(size[0] * factor), round(size[1] * factor))
+    detail = Image.effect_mandelbrot(source_size, (-2.2, -1.2, 1.0, 1.2), 200)
+    gradient = Image.linear_gradient("L").resize(source_size)
+    # Mild grain, like a photo
+    grain = Image.effect_noise(source_size, 8)
+    image_path = os.path.join(directory, "sample.png")
+    Image.merge(
+        "RGB", (detail, gradient, ImageChops.blend(detail, grain, 0.5))
+    ).save(image_path)
+
+    frames = max(1, round(seconds * fps))
+    source = decode(image_path, source_size)
+    reference = os.path.join(directory, "reference.mp4")
+    encode_frames(
+        render_frames(source, crop_rects("zoom-in", frames, source_size), size),
+        size,
+        fps,
+        [Rendition(size, fps, crf=0, preset="ultrafast")],
+        [reference],
+    )
+    return reference, frames
+
+
+def _ssim(encoded: str, reference: str) -> float:
+    """Average SSIM of an encode against its reference, 1 for identical"""
+    tracing.add("subprocesses")
+    process = subprocess.run(
+        [ffmpeg_binary(), "-hide_banner", "-i", encoded, "-i", reference]
+        + ["-lavfi", "[0:v][1:v]ssim", "-f", "null", "-"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    match = re.search(r"All:([0-9.]+)", process.stderr.decode(errors="replace"))
+    if process.returncode != 0 or match is None:
+        raise ValueError(f"could not measure the SSIM of {encoded}")
+    return float(match.group(1))
+
+
+@tracing.traced("calibrate")
+def calibrate(
+    candidates: List[EncoderProfile] = None,
+    size: Tuple[int, int] = (1920, 1080),
+    fps: int = 24,
+    seconds: float = 2.0,
+    min_ssim: float = 0.97,
+    max_kbps: float = None,
+    jobs: int = 1,
+    path: str = None,
+) -> Dict:
+    """Encodes a sample under every candidate profile and saves the fastest
+    one meeting the quality and size targets as the "auto" profile. `jobs`
+    copies of the sample are encoded at once, so the frame rate is the
+    throughput of a machine running that many encodes.
+
+    Args:
+        candidates (List[EncoderProfile], optional): Profiles to try.
+            Defaults to `candidate_profiles(jobs=jobs)`.
+        size (Tuple[int, int], optional): Sample size. Defaults to 1080p.
+        fps (int, optional): Sample frame rate. Defaults to 24.
+        seconds (float, optional): Sample length. Defaults to 2.0.
+        min_ssim (float, optional): Lowest accepted SSIM. Defaults to 0.97.
+        max_kbps (float, optional): Highest accepted video bitrate, None for
+            no limit. Defaults to None.
+        jobs (int, optional): Concurrent encodes. Defaults to 1.
+        path (str, optional): File the results are saved to. Defaults to
+            encoder_profiles.json in the current working directory.
+
+    Returns:
+        Dict: the saved results, "best" is the picked profile
+    """
+    if candidates is None:
+        candidates = candidate_profiles(jobs=jobs)
+    path = path or os.path.join(os.getcwd(), CALIBRATION_FILE)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"[INFO] Encoding a {size[0]}x{size[1]} calibration sample")
+        reference, frames = _sample_reference(directory, size, fps, seconds)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for profile in candidates:
+                outputs = [
+                    os.path.join(directory, f"{profile.name}-{idx}.mp4")
+                    for idx in range(jobs)
+                ]
+                start = time.perf_counter()
+                list(
+                    executor.map(
+                        lambda output: run_ffmpeg(
+                            ["-i", reference] + profile.video_args() + ["-an", output]
+                        ),
+                        outputs,
+                    )
+                )
+                wall = time.perf_counter() - start
+                result = {
+                    "profile": profile.to_dict(),
+                    "fps": round(frames * jobs / wall, 2),
+                    "kbps": round(
+                        os.path.getsize(outputs[0]) * 8 * fps / frames / 1000
+                    ),
+                    "ssim": round(_ssim(outputs[0], reference), 5),
+                }
+                result["ok"] = result["ssim"] >= min_ssim and (
+                    max_kbps is None or result["kbps"] <= max_kbps
+                )
+                print(
+                    f"[INFO] {profile.name:>22}: {result['fps']:>7.1f} fps, "
+                    f"{result['kbps']:>6} kbps, SSIM {result['ssim']:.4f}"
+                    + ("" if result["ok"] else " (misses target)")
+                )
+                results.append(result)
+
+    accepted = [result for result in results if result["ok"]]
+    if accepted:
+        best = max(accepted, key=lambda result: result["fps"])
+    else:
+        print("[INFO] No profile meets the target, picking the best quality")
+        best = max(results, key=lambda result: result["ssim"])
+    print(f"[INFO] Picked {best['profile']['name']} as the auto profile")
+
+    calibration = {
+        "cpus": os.cpu_count(),
+        "jobs": jobs,
+        "size": list(size),
+        "fps": fps,
+        "min_ssim": min_ssim,
+        "max_kbps": max_kbps,
+        "results": results,
+        "best": best["profile"],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, indent=2)
+    return calibration
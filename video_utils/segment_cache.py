@@ -0,0 +1,94 @@
+"""On-disk cache of rendered segment files.
+A segment file is stored under the fingerprint of everything that went into
+it, so re-rendering a script only encodes the segments that changed. The
+least recently used files are deleted once the cache grows past its budget.
+"""
+
+import os
+from typing import Iterable, Optional
+
+from utils.common import mkdir
+
+
+class SegmentCache:
+    """Rendered segment files keyed by `VideoSegment.fingerprint`.
+
+    Attributes:
+        directory (str): Folder holding the segment files.
+        max_bytes (int): Total size of the segment files before the least
+            recently used ones are deleted, None for no limit.
+        hits (int): Number of segments found in the cache.
+        misses (int): Number of segments that had to be rendered.
+        evictions (int): Number of segment files deleted by `prune`.
+    """
+
+    def __init__(
+        self, directory: str = None, max_bytes: int = 4 * 1024 * 1024 * 1024
+    ):
+        """
+        Args:
+            directory (str, optional): Cache folder. Defaults to
+                "segment_cache" in the current working directory.
+            max_bytes (int, optional): Maximum total size of the segment
+                files. Defaults to 4 GiB.
+        """
+        self.directory = directory
+        if self.directory is None:
+            self.directory = os.path.join(os.getcwd(), "segment_cache")
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        mkdir(self.directory)
+
+    def path(self, fingerprint: str) -> str:
+        """Path a segment with this fingerprint is (or will be) stored at"""
+        return os.path.join(self.directory, f"{fingerprint}.mp4")
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        """Looks up a rendered segment
+
+        Args:
+            fingerprint (str): segment fingerprint
+
+        Returns:
+            Optional[str]: path of the rendered segment, None on a miss.
+        """
+        path = self.path(fingerprint)
+        if os.path.isfile(path):
+            self.hits += 1
+            # Touch the file so stale entries can be told apart by mtime
+            os.utime(path)
+            return path
+        self.misses += 1
+        return None
+
+    def prune(self, keep: Iterable[str] = ()) -> None:
+        """Deletes the least recently used segment files above `max_bytes`
+
+        Args:
+            keep (Iterable[str], optional): paths that must not be deleted,
+                e.g. the segments of the render that just finished. Defaults
+                to none.
+        """
+        if self.max_bytes is None:
+            return
+        keep = {os.path.abspath(path) for path in keep}
+        entries = []
+        for entry in os.scandir(self.directory):
+            # Segments being rendered are written to .tmp<pid>.mp4 files
+            if entry.name.endswith(".mp4") and ".tmp" not in entry.name:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+            total -= size
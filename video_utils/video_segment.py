@@ -1,14 +1,24 @@
-import random
-from typing import List, Dict
-from moviepy.editor import (
-    ImageClip,
-    AudioFileClip,
-    VideoClip,
-    concatenate_videoclips,
-    concatenate_audioclips,
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING, List, Dict, Tuple
+from video_utils.encoder import (
+    Rendition,
+    encode_frames,
+    encode_stills,
+    frame_count,
+    frame_size,
 )
-from audio_utils.audio import WaveNetTTS
-from images_utils.image_grabber import ImageGrabber
+from utils import tracing
+
+# Segments are created when parsing scripts, which must not load MoviePy or
+# the cloud clients, those are only imported when rendering.
+if TYPE_CHECKING:
+    from moviepy.audio.AudioClip import AudioArrayClip
+    from moviepy.editor import VideoClip
+    from audio_utils.audio import WaveNetTTS
+    from images_utils.image_grabber import ImageGrabber
+    from video_utils.profiles import EncoderProfile
 
 
 class VideoSegment:
@@ -23,6 +33,12 @@ class VideoSegment:
         image_keyword (str): Keyword for images to be scraped for this segment.
         segment_number (int): number of segment in the entire video.
         images_number (int): number of images to be displayed in this segment
+        audio_files (List[str]): TTS audio files, set by `prepare`.
+        images (List[str]): Selected images paths, set by `prepare`.
+        duration (float): Total audio duration in seconds, set by `prepare`.
+        effects (List[str]): Effects of the images, image i gets effect i
+            modulo the number of effects. A segment without effects is
+            rendered by the still image fast path.
     """
 
     def __init__(
@@ -32,14 +48,183 @@ class VideoSegment:
         image_keyword: str,
         segment_number: int,
         images_number: int = 5,
+        effects: List[str] = None,
     ):
         self.segment_number = segment_number
         self.text = text
         self.voiceover_text = voiceover_text
         self.image_keyword = image_keyword
         self.images_number = images_number
+        self.audio_files = []
+        self.images = []
+        self.duration = 0
+        self.effects = effects
+        if self.effects is None:
+            self.effects = []
+
+    @tracing.traced("segment.prepare")
+    def prepare(self, tts: "WaveNetTTS", gid: "ImageGrabber") -> None:
+        """Generates the TTS audio files and selects the images of this segment.
+        After this, the segment only holds plain data and can be sent to
+        another process to be rendered.
+
+        Args:
+            tts (WaveNetTTS): TTS object
+            gid (ImageGrabber): Image search/grabber object
+        """
+
+        print(f"[INFO] Preparing video segment #{self.segment_number}")
+        tracing.current().set(segment=self.segment_number)
+        self.synthesize(tts)
+        self.select_images(gid)
+
+    def synthesize(self, tts: "WaveNetTTS") -> None:
+        """Generates the TTS audio files of this segment and its duration.
+
+        Args:
+            tts (WaveNetTTS): TTS object
+        """
+        synthesize_segments(tts, [self])
+
+    def select_images(self, gid: "ImageGrabber") -> None:
+        """Searches the images of this segment and selects `images_number`
+        of them, as different from each other as possible.
 
-    def generate_segment(self, tts: WaveNetTTS, gid: ImageGrabber) -> VideoClip:
+        Args:
+            gid (ImageGrabber): Image search/grabber object
+        """
+        # Seeded from the segment content so the same segment always gets the
+        # same images and fingerprint.
+        self.images = gid.select_images(
+            self.image_keyword,
+            self.images_number,
+            seed=f"{self.image_keyword}\n{self.text}",
+        )
+
+    @property
+    def prepared(self) -> bool:
+        """Whether the audio files and images of this segment are set"""
+        return len(self.images) > 0 and len(self.audio_files) == len(
+            self.voiceover_text
+        )
+
+    def content_key(self) -> str:
+        """Hashes the parsed content of this segment, which is all its audio
+        files and images depend on. Unlike `fingerprint`, it doesn't need
+        the segment to be prepared.
+
+        Returns:
+            str: hex digest identifying the segment content
+        """
+        payload = json.dumps(
+            {
+                "text": self.text,
+                "voiceover": self.voiceover_text,
+                "keyword": self.image_keyword,
+                "images_number": self.images_number,
+                "effects": self.effects,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def fingerprint(self, **render_settings) -> str:
+        """Hashes everything that affects the rendered segment. Must be called
+        after `prepare`.
+
+        Args:
+            **render_settings: fps, codec parameters and any other setting
+                passed to the encoder.
+
+        Returns:
+            str: hex digest identifying the rendered segment
+        """
+        images = []
+        for image in self.images:
+            stat = os.stat(image)
+            images.append((image, stat.st_size, stat.st_mtime_ns))
+
+        payload = json.dumps(
+            {
+                "text": self.text,
+                "voiceover": self.voiceover_text,
+                "keyword": self.image_keyword,
+                "images_number": self.images_number,
+                "images": images,
+                "duration": self.duration,
+                "effects": self.effects,
+                "settings": render_settings,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def timeline(self) -> List[Tuple[str, float, float]]:
+        """Returns (image, start, duration) of every image of the segment"""
+        image_duration = self.duration / len(self.images)
+        return [
+            (image, idx * image_duration, image_duration)
+            for idx, image in enumerate(self.images)
+        ]
+
+    @tracing.traced("segment.compose")
+    def build_clip(self, fps: int = 24, audio: bool = True) -> "VideoClip":
+        """Combines the prepared images and audio files into a clip.
+
+        Args:
+            fps (int, optional): Clip FPS. Defaults to 24.
+            audio (bool, optional): Adds the voice over as one in-memory
+                track if True. Defaults to True.
+
+        Returns:
+            VideoClip: complete video clip combined from images/TTS.
+        """
+        from moviepy.editor import VideoClip, concatenate_videoclips
+
+        size = frame_size(self.images)
+        if len(self.effects) > 0:
+            from video_utils.effects import timeline_clip
+
+            final_clip = timeline_clip(self.timeline(), self.effects, fps, size)
+        else:
+            # Image duration is total duration / number of images, this could be
+            # changed to be random period of times between 0 and segment_duration
+            image_duration = self.duration / len(self.images)
+
+            # Frames are read from the frame store when the video is written,
+            # clips don't hold a decoded copy of every image until then. All
+            # frames are letterboxed to the same size, so clips are chained.
+            from video_utils.frame_store import default_store
+
+            store = default_store()
+            image_clips = [
+                VideoClip(
+                    lambda t, image=video_image: store.frame(image, size),
+                    duration=image_duration,
+                )
+                for video_image in self.images
+            ]
+            final_clip = concatenate_videoclips(image_clips)
+        final_clip.fps = fps
+        if audio:
+            final_clip = final_clip.set_audio(self.audio_clip())
+        return final_clip
+
+    def audio_clip(self) -> "AudioArrayClip":
+        """Returns the voice over as a single in-memory AudioArrayClip, the
+        audio files are decoded once instead of through one ffmpeg reader
+        per file."""
+        import numpy as np
+        from moviepy.audio.AudioClip import AudioArrayClip
+        from audio_utils.pcm import SAMPLE_RATE, read_pcm
+
+        samples = np.concatenate([read_pcm(path) for path in self.audio_files])
+        return AudioArrayClip(samples / 32768.0, fps=SAMPLE_RATE)
+
+    def generate_segment(
+        self, tts: "WaveNetTTS", gid: "ImageGrabber"
+    ) -> "VideoClip":
         """Generates a video segment by searching the images, combining them
         and adding TTS voice over.
 
@@ -52,37 +237,95 @@ class VideoSegment:
         """
 
         print(f"[INFO] Generating video segment #{self.segment_number}")
-        image_clips = []
-        audio_clips = []
+        self.prepare(tts, gid)
+        return self.build_clip()
+
 
+def synthesize_segments(tts: "WaveNetTTS", segments: List[VideoSegment]) -> None:
+    """Generates the TTS audio files and durations of several segments in a
+    single `synthesize_many` call, so texts of the same voice in consecutive
+    segments can share service requests.
+
+    Args:
+        tts (WaveNetTTS): TTS object
+        segments (List[VideoSegment]): segments to synthesize
+    """
+    # All requests are sent concurrently, and coalesced where possible
+    results = tts.synthesize_many(
+        [
+            {
+                "text": voiceover["text"],
+                "filename": f"video-segment{segment.segment_number}-{idx+1}.wav",
+                "voice": voiceover["voice"],
+            }
+            for segment in segments
+            for idx, voiceover in enumerate(segment.voiceover_text)
+        ]
+    )
+    for segment in segments:
+        chunks = len(segment.voiceover_text)
+        segment_results, results = results[:chunks], results[chunks:]
+        segment.audio_files = [audio_file for audio_file, _ in segment_results]
         # Total duration of segment in seconds
-        segment_duration = 0
-
-        # Start by first generating TTS audio file
-        for idx, voiceover in enumerate(self.voiceover_text):
-            audio_file, duration = tts.generate_tts(
-                voiceover["text"],
-                f"video-segment{self.segment_number}-{idx+1}.mp3",
-                voiceover["voice"],
-            )
-            # Add audio duration to the segment duration
-            segment_duration += duration
-            audio_clips.append(AudioFileClip(audio_file))
-
-        # Image duration is total duration / number of images, this could be
-        # changed to be random period of times between 0 and segment_duration
-        image_duration = segment_duration / self.images_number
-        images = gid.search_image(self.image_keyword)
-        # Randomly select the images, this needs to be checked for number of
-        # images downloaded.
-        random_images = random.sample(images, self.images_number)
-
-        # Create the image clips and produce final video
-        for video_image in random_images:
-            image_clips.append(ImageClip(video_image, duration=image_duration))
-
-        audio_clip = concatenate_audioclips(audio_clips)
-        final_clip = concatenate_videoclips(image_clips, method="compose")
-        final_clip.fps = 24
-        final_clip = final_clip.set_audio(audio_clip)
-        return final_clip
+        segment.duration = sum(duration for _, duration in segment_results)
+
+
+@tracing.traced("segment.render")
+def render_segment(
+    segment: VideoSegment,
+    path: str,
+    fps: int = 24,
+    height: int = None,
+    preset: str = None,
+    profile: "EncoderProfile" = None,
+) -> str:
+    """Renders a prepared segment to its own file. This is a module level
+    function so it can be used as a process pool task.
+
+    Args:
+        segment (VideoSegment): Segment with `prepare` already called.
+        path (str): Output file path.
+        fps (int, optional): Video FPS. Defaults to 24.
+        height (int, optional): Frame height, e.g. 360 for a draft. Defaults
+            to the height of the images.
+        preset (str, optional): x264 preset, overrides the profile's.
+            Defaults to x264's default.
+        profile (EncoderProfile, optional): Rate control, preset and threads
+            of the encode. Defaults to x264's defaults.
+
+    Returns:
+        str: path of the rendered file
+    """
+    # Encode next to the final file then rename, so an interrupted render
+    # never leaves a truncated file behind a cacheable path.
+    root, extension = os.path.splitext(path)
+    tracing.current().set(
+        segment=segment.segment_number, stills=len(segment.effects) == 0
+    )
+    tmp_path = f"{root}.tmp{os.getpid()}{extension}"
+    # Segment files only hold video, the narration is added as one track when
+    # they are joined. Their length is a whole number of frames so the
+    # narration can be placed at exact offsets.
+    frames = frame_count(segment.duration, fps)
+    size = frame_size(segment.images, height)
+    if len(segment.effects) == 0:
+        encode_stills(
+            segment.timeline(), tmp_path, fps, frames, size, preset, profile
+        )
+    else:
+        from video_utils.effects import timeline_frames
+
+        encode_frames(
+            timeline_frames(segment.timeline(), segment.effects, frames, size),
+            size,
+            fps,
+            [
+                Rendition(size, fps, preset=preset)
+                if profile is None
+                else profile.rendition(size, fps, preset)
+            ],
+            [tmp_path],
+        )
+    os.replace(tmp_path, path)
+    tracing.add("bytes", os.path.getsize(path))
+    return path
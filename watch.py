@@ -0,0 +1,248 @@
+"""Watch mode: renders a script again every time it is saved.
+
+    python cli.py watch script.txt -o video.mp4 --preview
+
+The TTS client, image grabber and worker pools are created once and stay
+warm between renders. On every save the script is parsed again and its
+segments are compared, by content, to the segments of the previous render:
+unchanged segments keep their audio files and images, only new or edited
+segments go through TTS and image search, and only those are encoded since
+the others are found in the segment cache. The output is then joined again.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from TextToVideo import TextToVideo, default_gid, default_tts
+from text_utils.text_processor import TemplateError
+from video_utils.encoder import PREVIEW_PRESET
+from video_utils.video_segment import VideoSegment
+from utils.common import process_pool
+from utils import tracing
+
+if TYPE_CHECKING:
+    from audio_utils.audio import WaveNetTTS
+    from images_utils.image_grabber import ImageGrabber
+    from video_utils.profiles import EncoderProfile
+
+
+class ScriptWatcher:
+    """Renders a script whenever it changes, reusing the unchanged segments
+    of the previous render.
+
+    Attributes:
+        script (str): Script file to watch.
+        output (str): Output file name, <output>_preview for previews.
+        preview (bool): Renders drafts like `TextToVideo.preview` instead of
+            the full video.
+        fps (int): Video FPS.
+        height (int): Frame height, None for the height of the images.
+        profile (EncoderProfile): Encoder settings of full renders.
+        interval (float): Seconds between checks of the script.
+        renders (int): Number of renders done.
+        changed (int): Segments prepared again by the last render.
+        seconds (float): Duration of the last render.
+    """
+
+    def __init__(
+        self,
+        script: str,
+        output: str,
+        preview: bool = False,
+        fps: int = None,
+        height: int = None,
+        profile: "EncoderProfile" = None,
+        interval: float = 0.5,
+        workers: int = None,
+        io_workers: int = 4,
+        tts: "WaveNetTTS" = None,
+        gid: "ImageGrabber" = None,
+    ):
+        """
+        Args:
+            script (str): Script file to watch.
+            output (str): Output file name.
+            preview (bool, optional): Renders low resolution drafts with
+                estimated speech for uncached texts. Defaults to False.
+            fps (int, optional): Video FPS. Defaults to 24, 12 for previews.
+            height (int, optional): Frame height. Defaults to the height of
+                the images, 360 for previews.
+            profile (EncoderProfile, optional): Encoder settings of full
+                renders. Defaults to x264's defaults.
+            interval (float, optional): Seconds between checks of the
+                script. Defaults to 0.5.
+            workers (int, optional): Number of encoding processes. Defaults
+                to the number of CPUs.
+            io_workers (int, optional): Number of threads running TTS and
+                image search. Defaults to 4.
+            tts (WaveNetTTS, optional): TTS object. Defaults to WaveNetTTS
+                with an audio cache.
+            gid (ImageGrabber, optional): Image search/grabber object.
+                Defaults to searching jpg images and resizing them.
+        """
+        self.script = script
+        self.output = output
+        self.preview = preview
+        self.fps = fps
+        if self.fps is None:
+            self.fps = 12 if preview else 24
+        self.height = height
+        if self.height is None and preview:
+            self.height = 360
+        self.profile = profile
+        self.interval = interval
+        self.workers = workers or os.cpu_count()
+        self.io_workers = io_workers
+        self.tts = tts
+        if self.tts is None:
+            self.tts = default_tts()
+        self.gid = gid
+        if self.gid is None:
+            self.gid = default_gid()
+        if self.preview:
+            from audio_utils.audio import DraftTTS
+
+            self.tts = DraftTTS(self.tts)
+            root, extension = os.path.splitext(self.output)
+            self.output = f"{root}_preview{extension}"
+        self.renders = 0
+        self.changed = 0
+        self.seconds = 0.0
+        # Prepared segments of the previous render, by `_key`
+        self._segments = {}
+
+    def _key(self, segment: VideoSegment) -> str:
+        """Identifies segments whose audio files and images can be reused"""
+        key = segment.content_key()
+        if not self.preview and self.tts.cache is None:
+            # Uncached speech is saved under the segment number, a segment
+            # that moved would share its files with the one taking its place
+            key += f"-{segment.segment_number}"
+        return key
+
+    def reuse(self, segments: List[VideoSegment]) -> int:
+        """Gives unchanged segments the audio files, images and duration
+        they had in the previous render
+
+        Args:
+            segments (List[VideoSegment]): segments of the new script
+
+        Returns:
+            int: number of segments left to prepare
+        """
+        changed = 0
+        for segment in segments:
+            previous = self._segments.get(self._key(segment))
+            if previous is None or not all(
+                os.path.exists(path) for path in previous.audio_files + previous.images
+            ):
+                changed += 1
+                continue
+            segment.audio_files = list(previous.audio_files)
+            segment.images = list(previous.images)
+            segment.duration = previous.duration
+        return changed
+
+    def _remember(self, segments: List[VideoSegment]) -> None:
+        """Keeps the prepared segments of a render for the next one"""
+        self._segments = {
+            self._key(segment): segment for segment in segments if segment.prepared
+        }
+
+    def _stamp(self) -> Optional[Tuple[int, int]]:
+        """Modification time and size of the script, None while it's missing"""
+        try:
+            stat = os.stat(self.script)
+        except FileNotFoundError:
+            # Some editors save by replacing the file
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @tracing.traced("watch.render")
+    def render(
+        self,
+        io_pool: ThreadPoolExecutor = None,
+        cpu_pool: ProcessPoolExecutor = None,
+    ) -> bool:
+        """Renders the current script, preparing only the segments that
+        changed since the previous render
+
+        Args:
+            io_pool (ThreadPoolExecutor, optional): Thread pool running TTS
+                and image search. Defaults to one started for this render.
+            cpu_pool (ProcessPoolExecutor, optional): Process pool encoding
+                segments. Defaults to one started for this render.
+
+        Returns:
+            bool: True if the output was written
+        """
+        start = time.perf_counter()
+        try:
+            with open(self.script, "r", encoding="utf-8") as f:
+                text = f.read().replace("\n", " ")
+            ttv = TextToVideo(text, self.output, tts=self.tts, gid=self.gid)
+        except (OSError, TemplateError) as e:
+            print(f"[ERROR] {self.script}: {e}")
+            return False
+
+        segments = ttv._text_processor.video_segments
+        self.changed = self.reuse(segments)
+        print(
+            f"[INFO] {self.changed} of {len(segments)} segments changed since "
+            "the previous render"
+        )
+        tracing.current().set(segments=len(segments), changed=self.changed)
+        try:
+            ttv.render_video(
+                fps=self.fps,
+                workers=self.workers,
+                io_workers=self.io_workers,
+                io_pool=io_pool,
+                cpu_pool=cpu_pool,
+                height=self.height,
+                preset=PREVIEW_PRESET if self.preview else None,
+                profile=None if self.preview else self.profile,
+            )
+        except Exception as e:
+            print(f"[ERROR] Render of {self.script} failed: {e!r}")
+            return False
+        finally:
+            # Segments prepared before a failure are still reused
+            self._remember(segments)
+
+        self.renders += 1
+        self.seconds = time.perf_counter() - start
+        print(
+            f"[INFO] {self.output} rendered in {self.seconds:.1f}s, "
+            f"watching {self.script} for changes"
+        )
+        return True
+
+    def run(self, max_renders: int = None) -> None:
+        """Watches the script and renders it on start and after every save,
+        until interrupted
+
+        Args:
+            max_renders (int, optional): Stops after this many renders,
+                successful or not. Defaults to None, which watches forever.
+        """
+        attempts = 0
+        last = None
+        print(f"[INFO] Watching {self.script}, press Ctrl+C to stop")
+        with ThreadPoolExecutor(max_workers=self.io_workers) as io_pool:
+            with process_pool(max_workers=self.workers) as cpu_pool:
+                while max_renders is None or attempts < max_renders:
+                    stamp = self._stamp()
+                    if stamp is None or stamp == last:
+                        time.sleep(self.interval)
+                        continue
+                    # Wait until the editor is done writing
+                    time.sleep(self.interval)
+                    if self._stamp() != stamp:
+                        continue
+                    last = stamp
+                    attempts += 1
+                    self.render(io_pool, cpu_pool)
+